@@ -3,20 +3,26 @@ import os
 import logging
 import traceback
 from datetime import datetime, timedelta
-from flask import Flask, request, render_template, flash, jsonify, session
+from flask import Flask, request, render_template, flash, jsonify, session, Response, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
-import psutil
 import hashlib
 from functools import wraps
 import time
 from typing import Dict, Optional, Any
 import threading
+import sys
+import uuid
+import itertools
+from collections import OrderedDict, defaultdict
 
 # Load environment variables
 load_dotenv()
 
+# Shared RAG helpers live alongside the production app in saasa/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "saasa"))
+
 # Configure logging with rotation
 from logging.handlers import RotatingFileHandler
 logging.basicConfig(
@@ -32,23 +38,53 @@ logger.addHandler(handler)
 
 # Import AI/ML dependencies with error handling
 try:
-    from langchain_community.document_loaders import CSVLoader, PyPDFLoader
     from langchain.text_splitter import RecursiveCharacterTextSplitter
-    from langchain_community.embeddings import HuggingFaceEmbeddings
-    from langchain_community.vectorstores import FAISS
     from langchain.chains import RetrievalQA
-    from langchain_together import Together
-    from langchain_core.documents import Document
-    import google.generativeai as genai
+    from llm_client import llm_client
+    from llm_routing import RoutedLLM, llm_providers, router as llm_router
+    from model_registry import preload_embeddings, registry as embedding_registry
+    from indexing import build_vector_store, writable_vector_store, list_documents, remove_document
+    from embedding_cache import embedding_cache
+    from embedding_pipeline import throughput as embedding_throughput
+    from vector_persistence import estimate_vector_store_bytes, fingerprint_vector_store
+    from session_store import create_session_store
+    from llm_streaming import stream_answer, replay_answer, sse_event
+    from answer_cache import create_answer_cache, normalize_query
+    from document_loading import load_documents_parallel
+    from csv_streaming import iter_csv_chunks
+    from hybrid_retrieval import get_lexical_index, retrieval_timer
+    from context_packing import build_context_retriever, take_packing_stats, prompt_usage
     AI_DEPENDENCIES_AVAILABLE = True
     logger.info("AI/ML dependencies loaded successfully")
 except ImportError as e:
     logger.error(f"Failed to import AI/ML dependencies: {e}")
     AI_DEPENDENCIES_AVAILABLE = False
 
+from ingest_jobs import JobManager, IngestJob, JobQueueFullError
+from monitoring import setup_monitoring, metrics, system_sampler
+from structured_query import TableStore, STRUCTURED_QUERY_ENABLED
+from single_flight import SingleFlight
+from prometheus_metrics import stage_timer, record_index_size
+from tracing import trace_callbacks
+
+def readiness_check():
+    """Ready once the AI stack imported and the embedding model is resident in this worker"""
+    embeddings_loaded = AI_DEPENDENCIES_AVAILABLE and embedding_registry.is_loaded()
+    return embeddings_loaded, {
+        "ai_dependencies": "available" if AI_DEPENDENCIES_AVAILABLE else "unavailable",
+        "embedding_models": embedding_registry.loaded_models() if AI_DEPENDENCIES_AVAILABLE else {}
+    }
+
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "supersecretkey")
 CORS(app)
+setup_monitoring(app, register_health=False, readiness_check=readiness_check)
+if AI_DEPENDENCIES_AVAILABLE:
+    metrics.register_source("embedding_cache", embedding_cache.stats)
+    metrics.register_source("embedding_throughput", embedding_throughput.stats)
+    metrics.register_source("prompt_tokens", prompt_usage.stats)
+    metrics.register_source("llm_client", llm_client.stats)
+    metrics.register_source("llm_router", llm_router.stats)
 
 # Enhanced Configuration
 UPLOAD_FOLDER = "uploads"
@@ -63,19 +99,32 @@ MAX_FILE_SIZE = 10 * 1024 * 1024
 
 # Create directories
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs("sessions", exist_ok=True)
 
 # Enhanced global variables with session management
 rag_chains: Dict[str, Any] = {}  # Session-based storage
 app_start_time = datetime.now()
 rate_limit_store: Dict[str, list] = {}  # Simple in-memory rate limiting
+rate_limit_lock = threading.Lock()  # Threaded workers update the store concurrently
 
 class SessionManager:
-    """Manage user sessions and their RAG chains"""
+    """Manage user sessions and their RAG chains
+    
+    Session indexes live in a shared ``SessionStore`` so any worker can serve
+    any session. Only the most recently used chains are kept in memory, up to
+    ``max_bytes``; a miss, or a newer version saved by another worker, reloads
+    the index from the store and rebuilds the chain with ``chain_factory``.
+    """
     
-    def __init__(self):
-        self.sessions = {}
+    def __init__(self, store=None, max_bytes: int = 512 * 1024 * 1024, chain_factory=None,
+                 touch_interval_seconds: int = 60, table_store=None):
+        self.sessions = OrderedDict()
+        self.store = store
+        self.table_store = table_store
+        self.max_bytes = max_bytes
+        self.chain_factory = chain_factory
+        self.touch_interval = timedelta(seconds=touch_interval_seconds)
         self.lock = threading.Lock()
+        self.update_locks = defaultdict(threading.Lock)
     
     def get_session_id(self) -> str:
         """Get or create session ID"""
@@ -86,22 +135,74 @@ class SessionManager:
             session.permanent = True
         return session['session_id']
     
-    def store_rag_chain(self, session_id: str, chain: Any):
-        """Store RAG chain for session"""
-        with self.lock:
-            self.sessions[session_id] = {
-                'chain': chain,
-                'created_at': datetime.now(),
-                'last_used': datetime.now()
-            }
+    def store_rag_chain(self, session_id: str, chain: Any, vector_store: Any = None):
+        """Store RAG chain for session, persisting its index when given"""
+        version, size_bytes, fingerprint, vectors = None, 0, None, 0
+        if vector_store is not None:
+            size_bytes = estimate_vector_store_bytes(vector_store)
+            vectors = vector_store.index.ntotal
+            fingerprint = fingerprint_vector_store(vector_store)
+            if self.store is not None:
+                version = self.store.save(session_id, vector_store)
+        self._cache(session_id, chain, size_bytes, version, fingerprint, vectors)
     
     def get_rag_chain(self, session_id: str) -> Optional[Any]:
-        """Get RAG chain for session"""
+        """Get RAG chain for session, reloading it from the store when missing or stale"""
+        current_version = self.store.version(session_id) if self.store is not None else None
+        
         with self.lock:
-            if session_id in self.sessions:
-                self.sessions[session_id]['last_used'] = datetime.now()
-                return self.sessions[session_id]['chain']
-        return None
+            data = self.sessions.get(session_id)
+            if data is not None and (self.store is None or data['version'] == current_version):
+                self.sessions.move_to_end(session_id)
+                now = datetime.now()
+                touch = now - data['last_used'] > self.touch_interval
+                data['last_used'] = now
+                chain = data['chain']
+            else:
+                chain = None
+        
+        if chain is not None:
+            if touch and self.store is not None:
+                self.store.touch(session_id)
+            return chain
+        if current_version is None or self.chain_factory is None:
+            return None
+        
+        try:
+            vector_store, version = self.store.load(session_id)
+        except Exception as e:
+            logger.error(f"Failed to load session {session_id}: {e}")
+            return None
+        if vector_store is None:
+            return None
+        
+        logger.info(f"Loaded session {session_id} (version {version}) from session store")
+        chain = self.chain_factory(vector_store)
+        self._cache(session_id, chain, estimate_vector_store_bytes(vector_store), version,
+                    fingerprint_vector_store(vector_store), vector_store.index.ntotal)
+        self.store.touch(session_id)
+        return chain
+    
+    def get_vector_store(self, session_id: str) -> Optional[Any]:
+        """Vector store behind the session's chain"""
+        chain = self.get_rag_chain(session_id)
+        return chain.retriever.vectorstore if chain else None
+    
+    def update_lock(self, session_id: str) -> threading.Lock:
+        """Serializes add/remove operations on one session's index"""
+        with self.lock:
+            return self.update_locks[session_id]
+    
+    def get_fingerprint(self, session_id: str) -> Optional[str]:
+        """Content fingerprint of the session's indexed documents, if loaded"""
+        with self.lock:
+            data = self.sessions.get(session_id)
+            return data['fingerprint'] if data else None
+    
+    def memory_usage(self) -> int:
+        """Estimated bytes held by in-memory session indexes"""
+        with self.lock:
+            return sum(data['size_bytes'] for data in self.sessions.values())
     
     def cleanup_old_sessions(self, max_age_hours: int = 2):
         """Clean up old sessions"""
@@ -114,8 +215,69 @@ class SessionManager:
             for sid in expired_sessions:
                 del self.sessions[sid]
                 logger.info(f"Cleaned up expired session: {sid}")
+            self._report_index_size()
+        
+        if self.store is not None:
+            for sid in self.store.expired(cutoff_time.timestamp()):
+                try:
+                    self.store.delete(sid)
+                    if self.table_store is not None:
+                        self.table_store.delete(sid)
+                    logger.info(f"Removed persisted session: {sid}")
+                except Exception as e:
+                    logger.error(f"Failed to remove persisted session {sid}: {e}")
+    
+    def _cache(self, session_id: str, chain: Any, size_bytes: int, version: Optional[int],
+               fingerprint: Optional[str] = None, vectors: int = 0):
+        with self.lock:
+            existing = self.sessions.pop(session_id, None)
+            self.sessions[session_id] = {
+                'chain': chain,
+                'version': version,
+                'fingerprint': fingerprint,
+                'size_bytes': size_bytes,
+                'vectors': vectors,
+                'created_at': existing['created_at'] if existing else datetime.now(),
+                'last_used': datetime.now()
+            }
+            
+            # Evict least recently used sessions; they stay in the store for reload
+            total_bytes = sum(data['size_bytes'] for data in self.sessions.values())
+            while total_bytes > self.max_bytes and len(self.sessions) > 1:
+                sid, data = self.sessions.popitem(last=False)
+                total_bytes -= data['size_bytes']
+                logger.info(f"Evicted session {sid} from memory ({data['size_bytes']} bytes)")
+            self._report_index_size()
+    
+    def _report_index_size(self):
+        """Publish this worker's in-memory index totals; call with ``self.lock`` held"""
+        record_index_size(
+            sum(data['vectors'] for data in self.sessions.values()),
+            sum(data['size_bytes'] for data in self.sessions.values())
+        )
+
+# CSV uploads are also loaded into per-session SQLite tables for the structured fast path
+table_store = TableStore() if STRUCTURED_QUERY_ENABLED else None
+session_manager = SessionManager(
+    store=create_session_store(root="sessions") if AI_DEPENDENCIES_AVAILABLE else None,
+    max_bytes=int(os.environ.get("SESSION_CACHE_MAX_BYTES", 512 * 1024 * 1024)),
+    chain_factory=lambda vector_store: setup_enhanced_rag_chain(vector_store),
+    table_store=table_store
+)
+answer_cache = create_answer_cache() if AI_DEPENDENCIES_AVAILABLE else None
+# Identical concurrent queries share one retrieval + LLM call
+query_flights = SingleFlight()
+metrics.register_source("query_coalescing", query_flights.stats)
+if answer_cache is not None:
+    metrics.register_source("answer_cache", answer_cache.stats)
+job_manager = JobManager(
+    max_workers=int(os.environ.get("INGEST_WORKERS", 2)),
+    max_pending=int(os.environ.get("INGEST_MAX_PENDING", 8))
+)
 
-session_manager = SessionManager()
+# Load the embedding model at import time so gunicorn --preload shares it across workers
+if AI_DEPENDENCIES_AVAILABLE and os.environ.get("PRELOAD_EMBEDDINGS", "true").lower() == "true":
+    preload_embeddings()
 
 def rate_limit(max_requests: int = 10, window_seconds: int = 60):
     """Rate limiting decorator"""
@@ -125,25 +287,25 @@ def rate_limit(max_requests: int = 10, window_seconds: int = 60):
             client_ip = request.remote_addr
             now = time.time()
             
-            # Initialize or clean old requests
-            if client_ip not in rate_limit_store:
-                rate_limit_store[client_ip] = []
-            
-            # Remove old requests outside the window
-            rate_limit_store[client_ip] = [
-                req_time for req_time in rate_limit_store[client_ip]
-                if now - req_time < window_seconds
-            ]
+            with rate_limit_lock:
+                # Remove old requests outside the window
+                recent = [
+                    req_time for req_time in rate_limit_store.get(client_ip, [])
+                    if now - req_time < window_seconds
+                ]
+                
+                # Check rate limit
+                limited = len(recent) >= max_requests
+                if not limited:
+                    # Add current request
+                    recent.append(now)
+                rate_limit_store[client_ip] = recent
             
-            # Check rate limit
-            if len(rate_limit_store[client_ip]) >= max_requests:
+            if limited:
                 return jsonify({
                     "error": f"Rate limit exceeded. Max {max_requests} requests per {window_seconds} seconds."
                 }), 429
             
-            # Add current request
-            rate_limit_store[client_ip].append(now)
-            
             return f(*args, **kwargs)
         return decorated_function
     return decorator
@@ -152,9 +314,10 @@ def validate_file_content(file_path: str, file_type: str) -> bool:
     """Validate file content beyond just extension"""
     try:
         if file_type == 'csv':
-            import pandas as pd
-            df = pd.read_csv(file_path, nrows=1)  # Just read first row
-            return len(df.columns) > 0
+            import csv
+            with open(file_path, newline='', encoding='utf-8') as f:
+                header = next(csv.reader(f), [])  # Just read the header row
+            return len(header) > 0
         elif file_type == 'pdf':
             from PyPDF2 import PdfReader
             reader = PdfReader(file_path)
@@ -175,135 +338,259 @@ def get_file_size(file):
     file.seek(0)
     return size
 
+def save_uploaded_files(session_id: str):
+    """Validate and save the request's files; returns (file paths, original names, error)"""
+    file_paths = []
+    uploaded_files = []
+    
+    for file_key in request.files:
+        file = request.files[file_key]
+        if file and file.filename and allowed_file(file.filename):
+            if get_file_size(file) > MAX_FILE_SIZE:
+                return [], [], f"File {file.filename} too large. Max {MAX_FILE_SIZE // (1024*1024)}MB."
+            
+            filename = secure_filename(file.filename)
+            filename = f"{session_id}_{filename}"
+            file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+            with stage_timer("file_save"):
+                file.save(file_path)
+            
+            file_ext = filename.split('.')[-1].lower()
+            if validate_file_content(file_path, file_ext):
+                file_paths.append(file_path)
+                uploaded_files.append(file.filename)  # Return original filename
+            else:
+                os.remove(file_path)
+                return [], [], f"File {file.filename} appears to be corrupted"
+    
+    return file_paths, uploaded_files, None
+
 def load_documents_enhanced(file_paths: list) -> list:
     """Enhanced document loading with support for multiple file types"""
     if not AI_DEPENDENCIES_AVAILABLE:
         raise ImportError("AI/ML dependencies not available")
     
-    all_docs = []
-    
-    for file_path in file_paths:
-        try:
-            file_ext = file_path.split('.')[-1].lower()
-            logger.info(f"Loading {file_ext} file: {file_path}")
-            
-            if file_ext == 'csv':
-                loader = CSVLoader(file_path=file_path)
-                docs = loader.load()
-            elif file_ext == 'pdf':
-                loader = PyPDFLoader(file_path)
-                docs = loader.load()
-            elif file_ext == 'txt':
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                docs = [Document(page_content=content, metadata={"source": file_path})]
-            else:
-                logger.warning(f"Unsupported file type: {file_ext}")
-                continue
-                
-            all_docs.extend(docs)
-            logger.info(f"Loaded {len(docs)} documents from {file_path}")
-            
-        except Exception as e:
-            logger.error(f"Error loading {file_path}: {e}")
-            continue
+    # Files, and page ranges of large PDFs, are parsed in a process pool;
+    # files that fail or time out are logged and skipped
+    with stage_timer("load_documents"):
+        return load_documents_parallel(file_paths)
+
+def tag_documents(docs: list, file_paths: list) -> Dict[str, str]:
+    """Give each uploaded file a document id and stamp it on every page/row loaded from it"""
+    doc_ids = {path: uuid.uuid4().hex for path in file_paths}
+    for doc in docs:
+        doc.metadata["doc_id"] = doc_ids.get(doc.metadata.get("source"))
+    return doc_ids
+
+def ingest_files(job: IngestJob, session_id: str, file_paths: list, append: bool = False) -> dict:
+    """Run load -> split -> embed -> chain setup for a session, reporting progress on ``job``
     
-    return all_docs
+    With ``append`` the new chunks are added to the session's existing index
+    instead of replacing it, so only the new files are embedded.
+    """
+    # CSVs are streamed row batch by row batch straight into embedding
+    csv_paths = [path for path in file_paths if path.split('.')[-1].lower() == 'csv']
+    other_paths = [path for path in file_paths if path not in csv_paths]
+
+    with job.track_stage("loading"):
+        docs = load_documents_enhanced(other_paths) if other_paths else []
+        doc_ids = tag_documents(docs, file_paths)
+    job.update_progress(files=len(file_paths), pages_parsed=len(docs))
+    if not docs and not csv_paths:
+        raise ValueError("No valid content found in files")
+
+    with job.track_stage("splitting"), stage_timer("split_documents"):
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=1000, chunk_overlap=100
+        )
+        split_docs = text_splitter.split_documents(docs)
+    # The total is unknown until streamed CSVs have been read to the end
+    job.update_progress(chunks_total=None if csv_paths else len(split_docs), chunks_embedded=0)
+
+    rows_parsed = {}
+
+    def on_rows(path, rows):
+        rows_parsed[path] = rows
+        job.update_progress(rows_parsed=sum(rows_parsed.values()))
+
+    chunks = itertools.chain(split_docs, *(
+        iter_csv_chunks(
+            path, text_splitter,
+            metadata={"doc_id": doc_ids[path]},
+            on_rows=lambda rows, path=path: on_rows(path, rows)
+        )
+        for path in csv_paths
+    ))
+
+    with session_manager.update_lock(session_id):
+        existing = session_manager.get_vector_store(session_id) if append else None
+        chunks_embedded = 0
+
+        def on_embedded(done):
+            nonlocal chunks_embedded
+            chunks_embedded = done
+            job.update_progress(chunks_embedded=done)
+
+        with job.track_stage("embedding"):
+            vector_store = build_vector_store(
+                chunks,
+                progress_callback=on_embedded,
+                # Appended in place; queries see the new chunks once they are all embedded
+                vector_store=writable_vector_store(existing) if existing is not None else None
+            )
+        job.update_progress(
+            chunks_total=chunks_embedded,
+            chunks_per_second=round(chunks_embedded / max(job.timings["embedding"], 0.001), 1)
+        )
+
+        with job.track_stage("lexical_index"):
+            # Appends already updated the store's index; only new stores build one
+            get_lexical_index(vector_store)
+
+        if table_store is not None:
+            with job.track_stage("tables"):
+                if not append:
+                    table_store.delete(session_id)
+                for path in csv_paths:
+                    table_store.load_csv(session_id, path, doc_id=doc_ids[path])
+
+        with job.track_stage("chain_setup"):
+            rag_chain = setup_enhanced_rag_chain(vector_store)
+            session_manager.store_rag_chain(session_id, rag_chain, vector_store)
+
+    return {
+        "documents_processed": len(docs) + sum(rows_parsed.values()),
+        "chunks": chunks_embedded,
+        "total_chunks": vector_store.index.ntotal,
+        "doc_ids": {os.path.basename(path): doc_id for path, doc_id in doc_ids.items()}
+    }
+
+def answer_structured(owner_id: str, query: str) -> Optional[dict]:
+    """Answer aggregate/filter questions over uploaded CSVs with SQL; None routes to the RAG chain"""
+    if table_store is None:
+        return None
+    try:
+        result = table_store.answer(owner_id, query)
+    except Exception as e:
+        logger.error(f"Structured query failed, falling back to RAG: {e}")
+        return None
+    if result is not None:
+        logger.info(f"Answered with SQL on {result['table']}: {result['sql']}")
+    return result
+
+ENHANCED_GEMINI_PROMPT = """
+Based on the provided context, please answer the question comprehensively and accurately.
+If the information is not in the context, please state that clearly.
+
+Context: {prompt}
+
+Please provide a detailed and helpful response.
+"""
 
 def setup_enhanced_rag_chain(vector_store, temperature: float = 0.7):
-    """Enhanced RAG chain setup with better prompt engineering"""
+    """Enhanced RAG chain over every configured provider; the router picks one per query"""
     logger.info("Setting up enhanced RAG chain...")
     
-    together_api_key = os.environ.get("TOGETHER_API_KEY")
-    gemini_api_key = os.environ.get("GEMINI_API_KEY")
+    # Gemini gets the enhanced prompt for better responses
+    providers = llm_providers(temperature=temperature, gemini_prompt_template=ENHANCED_GEMINI_PROMPT)
+    if providers:
+        logger.info(f"Using LLM providers: {', '.join(providers)}")
+        # Enhanced retrieval with more context
+        return RetrievalQA.from_chain_type(
+            llm=RoutedLLM(providers=providers),
+            chain_type="stuff",
+            retriever=build_context_retriever(vector_store, k=4),
+            return_source_documents=True
+        )
     
-    if together_api_key:
-        try:
-            logger.info("Using Together API...")
-            llm = Together(
-                model="meta-llama/Llama-3-70b-chat-hf",
-                together_api_key=together_api_key,
-                temperature=temperature
-            )
-            
-            # Enhanced retrieval with more context
-            return RetrievalQA.from_chain_type(
-                llm=llm,
-                chain_type="stuff",
-                retriever=vector_store.as_retriever(
-                    search_type="similarity",
-                    search_kwargs={"k": 4}  # Increased context
-                ),
-                return_source_documents=True
-            )
-        except Exception as e:
-            logger.error(f"Together API failed: {e}")
-            if not gemini_api_key:
-                raise e
+    raise ValueError("No valid API key found")
+
+def answer_query(rag_chain, query: str, fingerprint: Optional[str], temperature: float = 0.7):
+    """Invoke the chain, serving repeated questions from the answer cache and sharing identical in-flight ones
+
+    Returns (result, cached, coalesced).
+    """
+    if answer_cache is not None and fingerprint:
+        result = answer_cache.get(fingerprint, query)
+        if result is not None:
+            logger.info("Answer cache hit")
+            return result, True, False
+    
+    def run():
+        result = rag_chain.invoke(query, config={"callbacks": [retrieval_timer, *trace_callbacks()]})
+        packing = take_packing_stats()
+        if packing is not None:
+            prompt_usage.record(packing)
+            result["context"] = packing
+        if answer_cache is not None and fingerprint:
+            answer_cache.put(fingerprint, query, result)
+        return result
     
-    if gemini_api_key:
+    # Identical questions arriving while this one runs wait for its answer instead of calling the LLM again
+    result, coalesced = query_flights.do(query_key(rag_chain, query, fingerprint, temperature), run)
+    return result, False, coalesced
+
+def query_key(rag_chain, query: str, fingerprint: Optional[str], temperature: float):
+    return (fingerprint or id(rag_chain), normalize_query(query), temperature)
+
+def stream_query(rag_chain, query: str, fingerprint: Optional[str], temperature: float = 0.7):
+    """SSE events answering ``query`` with the same cache, coalescing and prompts as ``answer_query``
+
+    A cached answer, or one an identical in-flight request is producing, is
+    replayed as a single token event. Otherwise tokens stream live and the
+    finished answer is cached; a live stream is not shared with identical
+    requests that arrive while it runs.
+    """
+    if query_flights.in_flight(query_key(rag_chain, query, fingerprint, temperature)):
         try:
-            logger.info("Using Gemini API...")
-            genai.configure(api_key=gemini_api_key)
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            
-            class EnhancedGeminiLLM:
-                def __init__(self, model, temperature=0.7):
-                    self.model = model
-                    self.temperature = temperature
-                
-                def invoke(self, input_text, **kwargs):
-                    # Enhanced prompt for better responses
-                    enhanced_prompt = f"""
-                    Based on the provided context, please answer the question comprehensively and accurately.
-                    If the information is not in the context, please state that clearly.
-                    
-                    Context: {input_text}
-                    
-                    Please provide a detailed and helpful response.
-                    """
-                    
-                    response = self.model.generate_content(enhanced_prompt)
-                    return {"result": response.text}
-            
-            llm = EnhancedGeminiLLM(model, temperature)
-            return RetrievalQA.from_chain_type(
-                llm=llm,
-                chain_type="stuff",
-                retriever=vector_store.as_retriever(search_kwargs={"k": 4}),
-                return_source_documents=True
-            )
+            result, cached, coalesced = answer_query(rag_chain, query, fingerprint, temperature)
         except Exception as e:
-            logger.error(f"Gemini API failed: {e}")
-            raise e
+            logger.error(f"Error processing query: {e}")
+            yield sse_event("error", {"error": f"Query processing error: {str(e)}"})
+            return
+        yield from replay_answer(result, cached, coalesced)
+        return
     
-    raise ValueError("No valid API key found")
+    if answer_cache is not None and fingerprint:
+        result = answer_cache.get(fingerprint, query)
+        if result is not None:
+            logger.info("Answer cache hit")
+            yield from replay_answer(result)
+            return
+    
+    def keep(docs, text):
+        result = {"query": query, "result": text, "source_documents": docs}
+        packing = take_packing_stats()
+        if packing is not None:
+            prompt_usage.record(packing)
+            result["context"] = packing
+        if answer_cache is not None and fingerprint:
+            answer_cache.put(fingerprint, query, result)
+    
+    yield from stream_answer(
+        rag_chain.retriever, query, temperature, gemini_prompt_template=ENHANCED_GEMINI_PROMPT, on_answer=keep
+    )
 
 @app.route("/health", methods=["GET"])
 def health_check():
-    """Enhanced health check with more metrics"""
+    """Enhanced health check with more metrics; constant time, system stats come from the background sampler"""
     try:
-        # System metrics
-        cpu_percent = psutil.cpu_percent(interval=1)
-        memory = psutil.virtual_memory()
-        disk = psutil.disk_usage('/')
+        system = system_sampler.snapshot()
         
         # App metrics
         active_sessions = len(session_manager.sessions)
+        session_memory_bytes = session_manager.memory_usage()
         uptime = datetime.now() - app_start_time
         
         return jsonify({
             "status": "healthy",
             "timestamp": datetime.now().isoformat(),
             "uptime_seconds": uptime.total_seconds(),
-            "system": {
-                "cpu_percent": cpu_percent,
-                "memory_percent": memory.percent,
-                "disk_percent": disk.percent
-            },
+            "system": system,
             "app": {
                 "ai_dependencies": "available" if AI_DEPENDENCIES_AVAILABLE else "unavailable",
                 "active_sessions": active_sessions,
+                "session_memory_bytes": session_memory_bytes,
                 "version": "2.0.0"
             }
         }), 200
@@ -340,7 +627,8 @@ def index():
                     filename = f"{session_id}_{filename}"
                     file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
                     
-                    file.save(file_path)
+                    with stage_timer("file_save"):
+                        file.save(file_path)
                     
                     # Validate file content
                     file_ext = filename.split('.')[-1].lower()
@@ -354,23 +642,10 @@ def index():
             
             if file_paths and AI_DEPENDENCIES_AVAILABLE:
                 try:
-                    docs = load_documents_enhanced(file_paths)
-                    if docs:
-                        text_splitter = RecursiveCharacterTextSplitter(
-                            chunk_size=1000, chunk_overlap=100
-                        )
-                        split_docs = text_splitter.split_documents(docs)
-                        
-                        embeddings = HuggingFaceEmbeddings(
-                            model_name="sentence-transformers/all-MiniLM-L6-v2"
-                        )
-                        vector_store = FAISS.from_documents(split_docs, embeddings)
-                        rag_chain = setup_enhanced_rag_chain(vector_store)
-                        
-                        session_manager.store_rag_chain(session_id, rag_chain)
-                        flash(f"Successfully processed {len(uploaded_files)} files!")
-                    else:
-                        flash("No valid content found in uploaded files.")
+                    ingest_files(IngestJob(), session_id, file_paths)
+                    flash(f"Successfully processed {len(uploaded_files)} files!")
+                except ValueError as e:
+                    flash(str(e))
                 except Exception as e:
                     logger.error(f"Error processing files: {e}")
                     flash(f"Error processing files: {str(e)}")
@@ -387,7 +662,9 @@ def index():
                 else:
                     try:
                         logger.info(f"Processing query for session {session_id}: {query}")
-                        result = rag_chain.invoke(query)
+                        result, _, _ = answer_query(
+                            rag_chain, query, session_manager.get_fingerprint(session_id)
+                        )
                         response = result.get("result", "No response generated")
                     except Exception as e:
                         logger.error(f"Error querying: {e}")
@@ -409,69 +686,130 @@ def upload_files():
         if not request.files:
             return jsonify({"error": "No files uploaded"}), 400
 
-        file_paths = []
-        uploaded_files = []
-        
-        for file_key in request.files:
-            file = request.files[file_key]
-            if file and file.filename and allowed_file(file.filename):
-                if get_file_size(file) > MAX_FILE_SIZE:
-                    return jsonify({
-                        "error": f"File {file.filename} too large. Max {MAX_FILE_SIZE // (1024*1024)}MB."
-                    }), 400
-                
-                filename = secure_filename(file.filename)
-                filename = f"{session_id}_{filename}"
-                file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-                file.save(file_path)
-                
-                file_ext = filename.split('.')[-1].lower()
-                if validate_file_content(file_path, file_ext):
-                    file_paths.append(file_path)
-                    uploaded_files.append(file.filename)  # Return original filename
-                else:
-                    os.remove(file_path)
-                    return jsonify({
-                        "error": f"File {file.filename} appears to be corrupted"
-                    }), 400
+        file_paths, uploaded_files, error = save_uploaded_files(session_id)
+        if error:
+            return jsonify({"error": error}), 400
 
         if not file_paths:
             return jsonify({"error": "No valid files uploaded"}), 400
 
-        if AI_DEPENDENCIES_AVAILABLE:
-            try:
-                docs = load_documents_enhanced(file_paths)
-                if docs:
-                    text_splitter = RecursiveCharacterTextSplitter(
-                        chunk_size=1000, chunk_overlap=100
-                    )
-                    split_docs = text_splitter.split_documents(docs)
-                    
-                    embeddings = HuggingFaceEmbeddings(
-                        model_name="sentence-transformers/all-MiniLM-L6-v2"
-                    )
-                    vector_store = FAISS.from_documents(split_docs, embeddings)
-                    rag_chain = setup_enhanced_rag_chain(vector_store)
-                    
-                    session_manager.store_rag_chain(session_id, rag_chain)
-                    
-                    return jsonify({
-                        "message": "Files uploaded and processed successfully!",
-                        "files": uploaded_files,
-                        "documents_processed": len(docs)
-                    })
-                else:
-                    return jsonify({"error": "No valid content found in files"}), 400
-            except Exception as e:
-                logger.error(f"Error processing files: {e}")
-                return jsonify({"error": f"Error processing files: {str(e)}"}), 500
-        else:
+        if not AI_DEPENDENCIES_AVAILABLE:
             return jsonify({"error": "AI/ML dependencies not available"}), 500
 
+        try:
+            job = job_manager.submit(ingest_files, session_id, file_paths)
+        except JobQueueFullError as e:
+            return jsonify({"error": str(e)}), 503
+
+        return jsonify({
+            "message": "Files uploaded, processing started",
+            "files": uploaded_files,
+            "job_id": job.job_id,
+            "status_url": f"/jobs/{job.job_id}"
+        }), 202
+
     except Exception as e:
         logger.error(f"Error in upload: {e}")
         return jsonify({"error": f"Upload error: {str(e)}"}), 500
 
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job_status(job_id):
+    """Poll the status of an ingestion job"""
+    job_status = job_manager.get(job_id)
+    if not job_status:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_status)
+
+@app.route("/sessions/<session_id>/documents", methods=["GET"])
+def list_session_documents(session_id):
+    """List the documents indexed in a session"""
+    if session_id != session_manager.get_session_id():
+        return jsonify({"error": "Forbidden"}), 403
+    
+    vector_store = session_manager.get_vector_store(session_id)
+    if vector_store is None:
+        return jsonify({"error": "Session has no documents"}), 404
+    
+    return jsonify({
+        "session_id": session_id,
+        "documents": [
+            {"doc_id": doc_id, "source": os.path.basename(info["source"] or ""), "chunks": info["chunks"]}
+            for doc_id, info in list_documents(vector_store).items()
+        ],
+        "total_chunks": vector_store.index.ntotal
+    })
+
+@app.route("/sessions/<session_id>/documents", methods=["POST"])
+@rate_limit(max_requests=5, window_seconds=60)
+def add_session_documents(session_id):
+    """Add files to a session's existing index, embedding only the new chunks"""
+    if session_id != session_manager.get_session_id():
+        return jsonify({"error": "Forbidden"}), 403
+    if not AI_DEPENDENCIES_AVAILABLE:
+        return jsonify({"error": "AI/ML dependencies not available"}), 500
+    if not request.files:
+        return jsonify({"error": "No files uploaded"}), 400
+    
+    try:
+        file_paths, uploaded_files, error = save_uploaded_files(session_id)
+        if error:
+            return jsonify({"error": error}), 400
+        if not file_paths:
+            return jsonify({"error": "No valid files uploaded"}), 400
+        
+        try:
+            job = job_manager.submit(ingest_files, session_id, file_paths, append=True)
+        except JobQueueFullError as e:
+            return jsonify({"error": str(e)}), 503
+        
+        return jsonify({
+            "message": "Files uploaded, processing started",
+            "files": uploaded_files,
+            "job_id": job.job_id,
+            "status_url": f"/jobs/{job.job_id}"
+        }), 202
+    
+    except Exception as e:
+        logger.error(f"Error adding documents: {e}")
+        return jsonify({"error": f"Upload error: {str(e)}"}), 500
+
+@app.route("/sessions/<session_id>/documents/<doc_id>", methods=["DELETE"])
+def delete_session_document(session_id, doc_id):
+    """Remove one document's vectors from a session's index without rebuilding it"""
+    if session_id != session_manager.get_session_id():
+        return jsonify({"error": "Forbidden"}), 403
+    
+    try:
+        with session_manager.update_lock(session_id):
+            vector_store = session_manager.get_vector_store(session_id)
+            if vector_store is None:
+                return jsonify({"error": "Session has no documents"}), 404
+            
+            source = list_documents(vector_store).get(doc_id, {}).get("source")
+            vector_store = writable_vector_store(vector_store)
+            removed = remove_document(vector_store, doc_id)
+            if not removed:
+                return jsonify({"error": "Document not found"}), 404
+            
+            rag_chain = setup_enhanced_rag_chain(vector_store)
+            session_manager.store_rag_chain(session_id, rag_chain, vector_store)
+            if table_store is not None:
+                table_store.drop_document(session_id, doc_id)
+        
+        if source and os.path.exists(source):
+            os.remove(source)
+        
+        return jsonify({
+            "message": "Document removed",
+            "doc_id": doc_id,
+            "chunks_removed": removed,
+            "total_chunks": vector_store.index.ntotal
+        })
+    
+    except Exception as e:
+        logger.error(f"Error removing document {doc_id}: {e}")
+        return jsonify({"error": f"Delete error: {str(e)}"}), 500
+
 @app.route("/query", methods=["POST"])
 @rate_limit(max_requests=20, window_seconds=60)  # More generous for queries
 def query_documents():
@@ -493,16 +831,34 @@ def query_documents():
         if not rag_chain:
             return jsonify({"error": "Please upload files first"}), 400
         
+        structured = answer_structured(session_id, query)
+        if structured is not None:
+            return jsonify({
+                "response": structured["result"],
+                "session_id": session_id,
+                "cached": False,
+                "structured": {key: structured[key] for key in ("sql", "params", "table", "rows_matched")},
+                "timestamp": datetime.now().isoformat()
+            })
+        
         try:
             logger.info(f"Processing query for session {session_id}: {query}")
-            result = rag_chain.invoke(query)
+            result, cached, coalesced = answer_query(
+                rag_chain, query, session_manager.get_fingerprint(session_id), temperature
+            )
             
             response_data = {
                 "response": result.get("result", "No response generated"),
                 "session_id": session_id,
+                "cached": cached,
+                "coalesced": coalesced,
                 "timestamp": datetime.now().isoformat()
             }
             
+            # Context packing stats (prompt tokens, chunks packed/merged) for answers the LLM produced
+            if not cached and "context" in result:
+                response_data["context"] = result["context"]
+            
             # Include source documents if available
             if "source_documents" in result:
                 response_data["sources"] = [
@@ -523,6 +879,37 @@ def query_documents():
         logger.error(f"Error handling query: {e}")
         return jsonify({"error": f"Query handling error: {str(e)}"}), 500
 
+@app.route("/query/stream", methods=["POST"])
+@rate_limit(max_requests=20, window_seconds=60)
+def query_documents_stream():
+    """Stream the answer as Server-Sent Events: sources first, then tokens"""
+    session_id = session_manager.get_session_id()
+    
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Invalid JSON data"}), 400
+    
+    query = data.get("query", "").strip()
+    temperature = data.get("temperature", 0.7)
+    if not query:
+        return jsonify({"error": "Please enter a query"}), 400
+    
+    rag_chain = session_manager.get_rag_chain(session_id)
+    if not rag_chain:
+        return jsonify({"error": "Please upload files first"}), 400
+    
+    structured = answer_structured(session_id, query)
+    if structured is not None:
+        events = replay_answer({"result": structured["result"]}, cached=False)
+    else:
+        logger.info(f"Streaming query for session {session_id}: {query}")
+        events = stream_query(rag_chain, query, session_manager.get_fingerprint(session_id), temperature)
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route("/sessions/cleanup", methods=["POST"])
 def cleanup_sessions():
     """Endpoint to manually trigger session cleanup"""
@@ -533,6 +920,14 @@ def cleanup_sessions():
         logger.error(f"Session cleanup error: {e}")
         return jsonify({"error": "Cleanup failed"}), 500
 
+def cleanup_rate_limits(window_seconds: int = 60):
+    """Drop clients with no requests inside the rate limit window"""
+    now = time.time()
+    with rate_limit_lock:
+        for client_ip in list(rate_limit_store):
+            if not any(now - req_time < window_seconds for req_time in rate_limit_store[client_ip]):
+                del rate_limit_store[client_ip]
+
 # Background task for periodic cleanup
 def periodic_cleanup():
     """Periodic cleanup task"""
@@ -540,12 +935,29 @@ def periodic_cleanup():
         time.sleep(3600)  # Run every hour
         try:
             session_manager.cleanup_old_sessions()
+            job_manager.cleanup_old_jobs()
+            cleanup_rate_limits()
         except Exception as e:
             logger.error(f"Periodic cleanup error: {e}")
 
-# Start cleanup thread
-cleanup_thread = threading.Thread(target=periodic_cleanup, daemon=True)
-cleanup_thread.start()
+cleanup_pid = None
+cleanup_lock = threading.Lock()
+
+@app.before_request
+def start_cleanup_thread():
+    """Start the cleanup thread on the first request in each process
+
+    Starting it at import would leave it in the gunicorn master only when the
+    app is preloaded, so no worker would ever prune its own jobs and rate limits.
+    """
+    global cleanup_pid
+    if cleanup_pid == os.getpid():
+        return
+    with cleanup_lock:
+        if cleanup_pid == os.getpid():
+            return
+        cleanup_pid = os.getpid()
+        threading.Thread(target=periodic_cleanup, name="periodic-cleanup", daemon=True).start()
 
 # Error handlers remain the same...
 @app.errorhandler(404)
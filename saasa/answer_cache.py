@@ -0,0 +1,136 @@
+"""
+Answer cache for repeated and near-duplicate queries over the same documents
+"""
+import os
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 1000))
+ANSWER_CACHE_TTL_SECONDS = int(os.environ.get("ANSWER_CACHE_TTL_SECONDS", 3600))
+ANSWER_CACHE_SEMANTIC = os.environ.get("ANSWER_CACHE_SEMANTIC", "false").lower() == "true"
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", 0.95))
+
+def normalize_query(query):
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip("?!. ")
+
+class AnswerCache:
+    """LRU + TTL cache keyed by (document-set fingerprint, normalized query)
+
+    In semantic mode a miss on the exact key falls back to the cached query
+    for the same documents whose embedding has the highest cosine similarity,
+    provided it reaches ``similarity_threshold``.
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+                 semantic=ANSWER_CACHE_SEMANTIC, similarity_threshold=ANSWER_CACHE_SIMILARITY,
+                 embed_query=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic = semantic and embed_query is not None
+        self.similarity_threshold = similarity_threshold
+        self.embed_query = embed_query
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, fingerprint, query):
+        """Return the cached answer or None"""
+        key = (fingerprint, normalize_query(query))
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry["expires_at"] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry["value"]
+            if entry is not None:
+                del self.entries[key]
+
+        if self.semantic:
+            value = self._semantic_lookup(fingerprint, key[1], now)
+            if value is not None:
+                return value
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, fingerprint, query, value):
+        """Cache an answer, evicting the least recently used entries over the cap"""
+        normalized = normalize_query(query)
+        embedding = None
+        if self.semantic:
+            try:
+                embedding = self._embed(normalized)
+            except Exception as e:
+                # The answer is already paid for; keep it for exact repeats at least
+                logger.warning(f"Answer cache could not embed query, caching it for exact matches only: {e}")
+        with self.lock:
+            key = (fingerprint, normalized)
+            self.entries.pop(key, None)
+            self.entries[key] = {
+                "value": value,
+                "embedding": embedding,
+                "expires_at": time.time() + self.ttl_seconds
+            }
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        """Hit/miss counters for /metrics"""
+        with self.lock:
+            entries, hits, semantic_hits, misses = len(self.entries), self.hits, self.semantic_hits, self.misses
+        lookups = hits + semantic_hits + misses
+        return {
+            "entries": entries,
+            "hits": hits,
+            "semantic_hits": semantic_hits,
+            "misses": misses,
+            "hit_rate": (hits + semantic_hits) / lookups if lookups > 0 else 0,
+            "semantic": self.semantic
+        }
+
+    def _semantic_lookup(self, fingerprint, normalized, now):
+        try:
+            embedding = self._embed(normalized)
+        except Exception as e:
+            logger.warning(f"Answer cache could not embed query: {e}")
+            return None
+
+        with self.lock:
+            best_key, best_score = None, self.similarity_threshold
+            for key, entry in self.entries.items():
+                if key[0] != fingerprint or entry["embedding"] is None or entry["expires_at"] <= now:
+                    continue
+                score = float(np.dot(embedding, entry["embedding"]))
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                return None
+            self.entries.move_to_end(best_key)
+            self.semantic_hits += 1
+            return self.entries[best_key]["value"]
+
+    def _embed(self, normalized):
+        vector = np.asarray(self.embed_query(normalized), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+def create_answer_cache():
+    """Build the process-wide answer cache, or None when disabled"""
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    from model_registry import get_embeddings
+    return AnswerCache(embed_query=lambda text: get_embeddings().embed_query(text))
@@ -2,11 +2,10 @@ import os
 import logging
 import traceback
 from datetime import datetime
-from flask import Flask, request, render_template, flash, jsonify
+from flask import Flask, request, render_template, flash, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
-import psutil
 
 # Load environment variables from .env file
 load_dotenv()
@@ -24,23 +23,54 @@ logger = logging.getLogger(__name__)
 
 # Import AI/ML dependencies with error handling
 try:
-    from langchain_community.document_loaders import CSVLoader, PyPDFLoader
+    from langchain_community.document_loaders import PyPDFLoader
     from langchain.text_splitter import RecursiveCharacterTextSplitter
-    from langchain_community.embeddings import HuggingFaceEmbeddings
-    from langchain_community.vectorstores import FAISS
     from langchain.chains import RetrievalQA
-    from langchain_together import Together
     from langchain_core.documents import Document
-    import google.generativeai as genai
+    from llm_client import llm_client
+    from llm_routing import RoutedLLM, llm_providers, router as llm_router
+    from model_registry import preload_embeddings, registry as embedding_registry
+    from indexing import build_vector_store
+    from embedding_cache import embedding_cache
+    from embedding_pipeline import throughput as embedding_throughput
+    from session_store import create_session_store
+    from llm_streaming import stream_answer, replay_answer, sse_event
+    from answer_cache import create_answer_cache, normalize_query
+    from csv_streaming import iter_csv_chunks
+    from hybrid_retrieval import attach_lexical_index, retrieval_timer
+    from context_packing import build_context_retriever, take_packing_stats, prompt_usage
+    from vector_persistence import fingerprint_vector_store, estimate_vector_store_bytes
     AI_DEPENDENCIES_AVAILABLE = True
     logger.info("AI/ML dependencies loaded successfully")
 except ImportError as e:
     logger.error(f"Failed to import AI/ML dependencies: {e}")
     AI_DEPENDENCIES_AVAILABLE = False
 
+from ingest_jobs import JobManager, JobQueueFullError
+from monitoring import setup_monitoring, metrics, system_sampler
+from structured_query import TableStore, STRUCTURED_QUERY_ENABLED
+from single_flight import SingleFlight
+from prometheus_metrics import stage_timer, record_index_size
+from tracing import trace_callbacks
+
+def readiness_check():
+    """Ready once the AI stack imported and the embedding model is resident in this worker"""
+    embeddings_loaded = AI_DEPENDENCIES_AVAILABLE and embedding_registry.is_loaded()
+    return embeddings_loaded, {
+        "ai_dependencies": "available" if AI_DEPENDENCIES_AVAILABLE else "unavailable",
+        "embedding_models": embedding_registry.loaded_models() if AI_DEPENDENCIES_AVAILABLE else {}
+    }
+
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "supersecretkey")
 CORS(app)  # Enable CORS for all routes
+setup_monitoring(app, register_health=False, readiness_check=readiness_check)
+if AI_DEPENDENCIES_AVAILABLE:
+    metrics.register_source("embedding_cache", embedding_cache.stats)
+    metrics.register_source("embedding_throughput", embedding_throughput.stats)
+    metrics.register_source("prompt_tokens", prompt_usage.stats)
+    metrics.register_source("llm_client", llm_client.stats)
+    metrics.register_source("llm_router", llm_router.stats)
 
 # Configuration
 UPLOAD_FOLDER = "uploads"
@@ -53,7 +83,31 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 # Global variables
 rag_chain = None
+rag_chain_version = None
+rag_chain_fingerprint = None
 app_start_time = datetime.now()
+job_manager = JobManager(
+    max_workers=int(os.environ.get("INGEST_WORKERS", 2)),
+    max_pending=int(os.environ.get("INGEST_MAX_PENDING", 8))
+)
+
+# The uploaded corpus is shared by all users; keep it in the session store so
+# every gunicorn worker serves the most recently published index
+SHARED_INDEX_ID = "shared"
+session_store = create_session_store(root="sessions") if AI_DEPENDENCIES_AVAILABLE else None
+# The uploaded CSV is also loaded into SQLite so aggregate questions skip the LLM
+table_store = TableStore() if STRUCTURED_QUERY_ENABLED else None
+
+answer_cache = create_answer_cache() if AI_DEPENDENCIES_AVAILABLE else None
+# Identical concurrent queries share one retrieval + LLM call
+query_flights = SingleFlight()
+metrics.register_source("query_coalescing", query_flights.stats)
+if answer_cache is not None:
+    metrics.register_source("answer_cache", answer_cache.stats)
+
+# Load the embedding model at import time so gunicorn --preload shares it across workers
+if AI_DEPENDENCIES_AVAILABLE and os.environ.get("PRELOAD_EMBEDDINGS", "true").lower() == "true":
+    preload_embeddings()
 
 
 def allowed_file(filename):
@@ -67,98 +121,200 @@ def get_file_size(file):
     file.seek(0)  # Reset to beginning
     return size
 
-def load_documents(csv_path, pdf_path):
-    """Load documents from CSV and PDF files"""
+def stream_split_documents(csv_path, pdf_path, progress_callback=None):
+    """Yield chunks from the CSV, streamed in row batches, then from the PDF
+
+    ``progress_callback`` receives the rows or pages parsed so far.
+    """
     if not AI_DEPENDENCIES_AVAILABLE:
         raise ImportError("AI/ML dependencies not available")
-    
-    logger.info(f"Loading CSV: {csv_path}")
-    csv_loader = CSVLoader(file_path=csv_path)
-    csv_docs = csv_loader.load()
-    
-    logger.info(f"Loading PDF: {pdf_path}")
-    pdf_loader = PyPDFLoader(pdf_path)
-    pdf_docs = pdf_loader.load()
-    
-    return csv_docs + pdf_docs
 
-def split_documents(docs):
-    """Split documents into chunks"""
-    logger.info("Splitting documents...")
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=500, chunk_overlap=50)
-    return text_splitter.split_documents(docs)
 
-def setup_vector_store(docs):
+    logger.info(f"Streaming CSV: {csv_path}")
+    rows_parsed = 0
+
+    def on_rows(rows):
+        nonlocal rows_parsed
+        rows_parsed = rows
+        if progress_callback:
+            progress_callback(rows)
+
+    yield from iter_csv_chunks(csv_path, text_splitter, on_rows=on_rows)
+
+    logger.info(f"Loading PDF: {pdf_path}")
+    with stage_timer("load_documents"):
+        pdf_docs = PyPDFLoader(pdf_path).load()
+    if progress_callback:
+        progress_callback(rows_parsed + len(pdf_docs))
+    with stage_timer("split_documents"):
+        pdf_chunks = text_splitter.split_documents(pdf_docs)
+    yield from pdf_chunks
+
+def setup_vector_store(docs, progress_callback=None):
     """Setup FAISS vector store"""
     logger.info("Setting up vector store...")
-    embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2")
-    return FAISS.from_documents(docs, embeddings)
+    return build_vector_store(docs, progress_callback=progress_callback)
 
 def setup_rag_chain(vector_store):
-    """Setup RAG chain with fallback options"""
+    """Setup RAG chain over every configured provider; the router picks one per query"""
     logger.info("Setting up RAG chain...")
     
-    # Try Together API first
-    together_api_key = os.environ.get("TOGETHER_API_KEY")
-    gemini_api_key = os.environ.get("GEMINI_API_KEY")
-    
-    if together_api_key:
-        try:
-            logger.info("Using Together API...")
-            llm = Together(
-                model="meta-llama/Llama-3-70b-chat-hf",
-                together_api_key=together_api_key,
-                temperature=0.7
-            )
-            return RetrievalQA.from_chain_type(
-                llm=llm,
-                chain_type="stuff",
-                retriever=vector_store.as_retriever(search_kwargs={"k": 2})
-            )
-        except Exception as e:
-            logger.error(f"Together API failed: {e}")
-            if gemini_api_key:
-                logger.info("Falling back to Gemini API...")
-            else:
-                raise e
+    providers = llm_providers(temperature=0.7)
+    if providers:
+        logger.info(f"Using LLM providers: {', '.join(providers)}")
+        return RetrievalQA.from_chain_type(
+            llm=RoutedLLM(providers=providers),
+            chain_type="stuff",
+            retriever=build_context_retriever(vector_store, k=2)
+        )
     
-    # Fallback to Gemini API
-    if gemini_api_key:
+    raise ValueError("No valid API key found. Please set TOGETHER_API_KEY or GEMINI_API_KEY")
+
+def publish_rag_chain(vector_store):
+    """Make a freshly built index the current one for every worker"""
+    global rag_chain, rag_chain_version, rag_chain_fingerprint
+    chain = setup_rag_chain(vector_store)
+    rag_chain_version = session_store.save(SHARED_INDEX_ID, vector_store)
+    rag_chain_fingerprint = fingerprint_vector_store(vector_store)
+    rag_chain = chain
+    record_index_size(vector_store.index.ntotal, estimate_vector_store_bytes(vector_store))
+
+def current_rag_chain():
+    """Return the RAG chain, reloading it if another worker published a newer index"""
+    global rag_chain, rag_chain_version, rag_chain_fingerprint
+    if session_store is None:
+        return rag_chain
+
+    version = session_store.version(SHARED_INDEX_ID)
+    if version is not None and version != rag_chain_version:
+        vector_store, version = session_store.load(SHARED_INDEX_ID)
+        if vector_store is not None:
+            logger.info(f"Loading shared index version {version}")
+            rag_chain = setup_rag_chain(vector_store)
+            rag_chain_version = version
+            rag_chain_fingerprint = fingerprint_vector_store(vector_store)
+            record_index_size(vector_store.index.ntotal, estimate_vector_store_bytes(vector_store))
+    return rag_chain
+
+def answer_query(chain, query, temperature=0.7):
+    """Invoke the chain, serving repeated questions from the answer cache and sharing identical in-flight ones
+
+    Returns (result, cached, coalesced).
+    """
+    fingerprint = rag_chain_fingerprint
+    if answer_cache is not None and fingerprint:
+        result = answer_cache.get(fingerprint, query)
+        if result is not None:
+            logger.info("Answer cache hit")
+            return result, True, False
+
+    def run():
+        result = chain.invoke(query, config={"callbacks": [retrieval_timer, *trace_callbacks()]})
+        packing = take_packing_stats()
+        if packing is not None:
+            prompt_usage.record(packing)
+            result["context"] = packing
+        if answer_cache is not None and fingerprint:
+            answer_cache.put(fingerprint, query, result)
+        return result
+
+    # Identical questions arriving while this one runs wait for its answer instead of calling the LLM again
+    result, coalesced = query_flights.do(query_key(chain, query, fingerprint, temperature), run)
+    return result, False, coalesced
+
+def query_key(chain, query, fingerprint, temperature):
+    return (fingerprint or id(chain), normalize_query(query), temperature)
+
+def stream_query(chain, query, temperature=0.7):
+    """SSE events answering ``query`` with the same cache and coalescing as ``answer_query``
+
+    A cached answer, or one an identical in-flight request is producing, is
+    replayed as a single token event. Otherwise tokens stream live and the
+    finished answer is cached.
+    """
+    fingerprint = rag_chain_fingerprint
+    if query_flights.in_flight(query_key(chain, query, fingerprint, temperature)):
         try:
-            logger.info("Using Gemini API...")
-            genai.configure(api_key=gemini_api_key)
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            
-            # Create a custom LLM wrapper for Gemini
-            class GeminiLLM:
-                def __init__(self, model):
-                    self.model = model
-                
-                def invoke(self, input_text, **kwargs):
-                    response = self.model.generate_content(input_text)
-                    return {"result": response.text}
-            
-            llm = GeminiLLM(model)
-            return RetrievalQA.from_chain_type(
-                llm=llm,
-                chain_type="stuff",
-                retriever=vector_store.as_retriever(search_kwargs={"k": 2})
-            )
+            result, cached, coalesced = answer_query(chain, query, temperature)
         except Exception as e:
-            logger.error(f"Gemini API failed: {e}")
-            raise e
-    
-    raise ValueError("No valid API key found. Please set TOGETHER_API_KEY or GEMINI_API_KEY")
+            logger.error(f"Error processing query: {e}")
+            yield sse_event("error", {"error": f"Error processing query: {str(e)}"})
+            return
+        yield from replay_answer(result, cached, coalesced)
+        return
+
+    if answer_cache is not None and fingerprint:
+        result = answer_cache.get(fingerprint, query)
+        if result is not None:
+            logger.info("Answer cache hit")
+            yield from replay_answer(result)
+            return
+
+    def keep(docs, text):
+        result = {"query": query, "result": text}
+        packing = take_packing_stats()
+        if packing is not None:
+            prompt_usage.record(packing)
+            result["context"] = packing
+        if answer_cache is not None and fingerprint:
+            answer_cache.put(fingerprint, query, result)
+
+    yield from stream_answer(chain.retriever, query, temperature, on_answer=keep)
+
+def answer_structured(query):
+    """Answer aggregate/filter questions over the uploaded CSV with SQL; None routes to the RAG chain"""
+    if table_store is None:
+        return None
+    try:
+        result = table_store.answer(SHARED_INDEX_ID, query)
+    except Exception as e:
+        logger.error(f"Structured query failed, falling back to RAG: {e}")
+        return None
+    if result is not None:
+        logger.info(f"Answered with SQL on {result['table']}: {result['sql']}")
+    return result
+
+def ingest_files(job, csv_path, pdf_path):
+    """Background ingestion pipeline; publishes the new RAG chain when done"""
+    pages_parsed = 0
+
+    def on_parsed(parsed):
+        nonlocal pages_parsed
+        pages_parsed = parsed
+        job.update_progress(pages_parsed=parsed)
+
+    # Loading and splitting run lazily inside the embedding stage, one row batch at a time
+    job.update_progress(pages_parsed=0, chunks_embedded=0)
+    with job.track_stage("embedding"):
+        vector_store = setup_vector_store(
+            stream_split_documents(csv_path, pdf_path, progress_callback=on_parsed),
+            progress_callback=lambda done: job.update_progress(chunks_embedded=done)
+        )
+    job.update_progress(
+        chunks_total=vector_store.index.ntotal,
+        chunks_per_second=round(vector_store.index.ntotal / max(job.timings["embedding"], 0.001), 1)
+    )
+
+    with job.track_stage("lexical_index"):
+        attach_lexical_index(vector_store)
+
+    if table_store is not None:
+        with job.track_stage("tables"):
+            table_store.load_csv(SHARED_INDEX_ID, csv_path, replace=True)
+
+    with job.track_stage("chain_setup"):
+        publish_rag_chain(vector_store)
+
+    return {"documents_processed": pages_parsed, "chunks": vector_store.index.ntotal}
 
 @app.route("/health", methods=["GET"])
 def health_check():
-    """Health check endpoint for Railway monitoring"""
+    """Health check endpoint for Railway monitoring; reads cached samples, so it never blocks"""
     try:
-        # Check system resources
-        cpu_percent = psutil.cpu_percent()
-        memory = psutil.virtual_memory()
+        # System resources, refreshed in the background
+        system = system_sampler.snapshot()
         
         # Check if AI dependencies are available
         ai_status = "available" if AI_DEPENDENCIES_AVAILABLE else "unavailable"
@@ -173,8 +329,8 @@ def health_check():
             "status": "healthy",
             "timestamp": datetime.now().isoformat(),
             "uptime_seconds": uptime.total_seconds(),
-            "cpu_percent": cpu_percent,
-            "memory_percent": memory.percent,
+            "cpu_percent": system["cpu_percent"],
+            "memory_percent": system["memory_percent"],
             "ai_dependencies": ai_status,
             "rag_chain": rag_status,
             "version": "1.0.0"
@@ -191,7 +347,6 @@ def health_check():
 @app.route("/", methods=["GET", "POST"])
 def index():
     """Main route for file upload and querying"""
-    global rag_chain
     response = None
 
     try:
@@ -218,8 +373,9 @@ def index():
                     pdf_path = os.path.join(app.config["UPLOAD_FOLDER"], pdf_filename)
 
                     try:
-                        csv_file.save(csv_path)
-                        pdf_file.save(pdf_path)
+                        with stage_timer("file_save"):
+                            csv_file.save(csv_path)
+                            pdf_file.save(pdf_path)
                         logger.info(f"Saved CSV to: {csv_path}")
                         logger.info(f"Saved PDF to: {pdf_path}")
                         
@@ -229,10 +385,10 @@ def index():
                         if not AI_DEPENDENCIES_AVAILABLE:
                             flash("AI/ML dependencies not available. Please check server configuration.")
                         else:
-                            docs = load_documents(csv_path, pdf_path)
-                            split_docs = split_documents(docs)
-                            vector_store = setup_vector_store(split_docs)
-                            rag_chain = setup_rag_chain(vector_store)
+                            vector_store = setup_vector_store(stream_split_documents(csv_path, pdf_path))
+                            if table_store is not None:
+                                table_store.load_csv(SHARED_INDEX_ID, csv_path, replace=True)
+                            publish_rag_chain(vector_store)
                             flash("Files uploaded and processed successfully!")
                     except Exception as e:
                         logger.error(f"Error processing files: {e}")
@@ -241,6 +397,7 @@ def index():
         # Handle query submission
         if request.method == "POST" and "query" in request.form:
             query = request.form.get("query").strip()
+            rag_chain = current_rag_chain()
             if not query:
                 flash("Please enter a query.")
             elif not rag_chain:
@@ -248,7 +405,7 @@ def index():
             else:
                 try:
                     logger.info(f"Processing query: {query}")
-                    response = rag_chain.invoke(query)
+                    response, _, _ = answer_query(rag_chain, query)
                 except Exception as e:
                     logger.error(f"Error querying: {e}")
                     flash(f"Error querying: {str(e)}")
@@ -263,7 +420,6 @@ def index():
 @app.route("/upload", methods=["POST"])
 def upload_files():
     """API endpoint for file upload"""
-    global rag_chain
     
     try:
         csv_file = request.files.get("csv_file")
@@ -282,7 +438,8 @@ def upload_files():
             
             csv_filename = secure_filename(csv_file.filename)
             csv_path = os.path.join(app.config["UPLOAD_FOLDER"], csv_filename)
-            csv_file.save(csv_path)
+            with stage_timer("file_save"):
+                csv_file.save(csv_path)
             uploaded_files.append(csv_filename)
             logger.info(f"Saved CSV to: {csv_path}")
 
@@ -294,7 +451,8 @@ def upload_files():
             
             pdf_filename = secure_filename(pdf_file.filename)
             pdf_path = os.path.join(app.config["UPLOAD_FOLDER"], pdf_filename)
-            pdf_file.save(pdf_path)
+            with stage_timer("file_save"):
+                pdf_file.save(pdf_path)
             uploaded_files.append(pdf_filename)
             logger.info(f"Saved PDF to: {pdf_path}")
 
@@ -306,20 +464,21 @@ def upload_files():
         pdf_files = [f for f in os.listdir(app.config["UPLOAD_FOLDER"]) if f.endswith('.pdf')]
         
         if csv_files and pdf_files and AI_DEPENDENCIES_AVAILABLE:
+            # Use the most recent files
+            csv_path = os.path.join(app.config["UPLOAD_FOLDER"], csv_files[-1])
+            pdf_path = os.path.join(app.config["UPLOAD_FOLDER"], pdf_files[-1])
+
             try:
-                # Use the most recent files
-                csv_path = os.path.join(app.config["UPLOAD_FOLDER"], csv_files[-1])
-                pdf_path = os.path.join(app.config["UPLOAD_FOLDER"], pdf_files[-1])
-                
-                docs = load_documents(csv_path, pdf_path)
-                split_docs = split_documents(docs)
-                vector_store = setup_vector_store(split_docs)
-                rag_chain = setup_rag_chain(vector_store)
-                
-                return jsonify({"message": "Files uploaded and processed successfully!", "files": uploaded_files})
-            except Exception as e:
-                logger.error(f"Error processing files: {e}")
-                return jsonify({"error": f"Error processing files: {str(e)}"}), 500
+                job = job_manager.submit(ingest_files, csv_path, pdf_path)
+            except JobQueueFullError as e:
+                return jsonify({"error": str(e)}), 503
+
+            return jsonify({
+                "message": "Files uploaded, processing started",
+                "files": uploaded_files,
+                "job_id": job.job_id,
+                "status_url": f"/jobs/{job.job_id}"
+            }), 202
         else:
             if not AI_DEPENDENCIES_AVAILABLE:
                 return jsonify({"error": "AI/ML dependencies not available"}), 500
@@ -330,10 +489,18 @@ def upload_files():
         return jsonify({"error": f"Error uploading files: {str(e)}"}), 500
 
 
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job_status(job_id):
+    """Poll the status of an ingestion job"""
+    job_status = job_manager.get(job_id)
+    if not job_status:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_status)
+
+
 @app.route("/query", methods=["POST"])
 def query_documents():
     """API endpoint for document querying"""
-    global rag_chain
     
     try:
         data = request.get_json()
@@ -342,14 +509,26 @@ def query_documents():
         if not query:
             return jsonify({"error": "Please enter a query"}), 400
         
+        rag_chain = current_rag_chain()
         if not rag_chain:
             return jsonify({"error": "Please upload both CSV and PDF files first before querying"}), 400
         
+        structured = answer_structured(query)
+        if structured is not None:
+            return jsonify({
+                "response": structured["result"],
+                "cached": False,
+                "structured": {key: structured[key] for key in ("sql", "params", "table", "rows_matched")}
+            })
+        
         try:
             logger.info(f"Processing query: {query}")
-            result = rag_chain.invoke(query)
+            result, cached, coalesced = answer_query(rag_chain, query)
             response_text = result.get("result", "No response generated")
-            return jsonify({"response": response_text})
+            response_data = {"response": response_text, "cached": cached, "coalesced": coalesced}
+            if not cached and "context" in result:
+                response_data["context"] = result["context"]
+            return jsonify(response_data)
         except Exception as e:
             logger.error(f"Error processing query: {e}")
             return jsonify({"error": f"Error processing query: {str(e)}"}), 500
@@ -358,6 +537,32 @@ def query_documents():
         logger.error(f"Error handling query: {e}")
         return jsonify({"error": f"Error handling query: {str(e)}"}), 500
 
+@app.route("/query/stream", methods=["POST"])
+def query_documents_stream():
+    """Stream the answer as Server-Sent Events: sources first, then tokens"""
+    data = request.get_json(silent=True) or {}
+    query = data.get("query", "").strip()
+    temperature = data.get("temperature", 0.7)
+
+    if not query:
+        return jsonify({"error": "Please enter a query"}), 400
+
+    rag_chain = current_rag_chain()
+    if not rag_chain:
+        return jsonify({"error": "Please upload both CSV and PDF files first before querying"}), 400
+
+    structured = answer_structured(query)
+    if structured is not None:
+        events = replay_answer({"result": structured["result"]}, cached=False)
+    else:
+        logger.info(f"Streaming query: {query}")
+        events = stream_query(rag_chain, query, temperature)
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.errorhandler(404)
 def not_found(error):
     """Handle 404 errors"""
@@ -0,0 +1,171 @@
+"""
+Token-budgeted context: retrieve a wider candidate set, merge overlapping
+chunks and pack them by relevance until the prompt budget is spent
+"""
+import os
+import logging
+import threading
+from typing import Any, List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from hybrid_retrieval import build_retriever
+from llm_streaming import build_prompt
+
+logger = logging.getLogger(__name__)
+
+# Tokens of retrieved context per prompt; 0 keeps the fixed-k retriever
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 3000))
+# Chunks retrieved before packing
+CONTEXT_CANDIDATES = int(os.environ.get("CONTEXT_CANDIDATES", 20))
+TOKEN_ENCODING = os.environ.get("TOKEN_ENCODING", "cl100k_base")
+# Chunk overlap is 50-100 characters; shorter shared runs are coincidence
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 400
+# Tokens of the "\n\n" the stuff chain puts between documents
+SEPARATOR_TOKENS = 1
+
+_encoding = None
+_encoding_lock = threading.Lock()
+_last_stats = threading.local()
+
+def _get_encoding():
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+            except Exception as e:
+                # tiktoken fetches its BPE file on first use; offline hosts fall back to an estimate
+                logger.warning(f"tiktoken encoding {TOKEN_ENCODING} unavailable, estimating tokens: {e}")
+                _encoding = False
+        return _encoding
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if not encoding:
+        return -(-len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def _overlap(first, second):
+    """Length of the longest suffix of ``first`` that starts ``second``"""
+    for length in range(min(len(first), len(second), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:length]):
+            return length
+    return 0
+
+def _merge(packed, doc):
+    """``doc`` joined to an adjacent packed chunk of the same source, as (position, text), or None"""
+    for position, selected in enumerate(packed):
+        if selected.metadata != doc.metadata:
+            continue
+        length = _overlap(selected.page_content, doc.page_content)
+        if length:
+            return position, selected.page_content + doc.page_content[length:]
+        length = _overlap(doc.page_content, selected.page_content)
+        if length:
+            return position, doc.page_content + selected.page_content[length:]
+    return None
+
+def pack_documents(docs, token_budget=CONTEXT_TOKEN_BUDGET):
+    """Greedily pack ``docs`` (most relevant first) into ``token_budget`` tokens
+
+    Chunks already contained in the packed context are dropped and chunks that
+    overlap a packed neighbour are merged into it, so overlapping text is only
+    paid for once. A chunk that does not fit is skipped in favour of smaller,
+    less relevant ones. Returns (packed documents, stats).
+    """
+    packed, tokens = [], []
+    duplicates = merged = 0
+    for doc in docs:
+        if any(doc.page_content in selected.page_content for selected in packed):
+            duplicates += 1
+            continue
+
+        merge = _merge(packed, doc)
+        if merge is not None:
+            position, text = merge
+            text_tokens = count_tokens(text)
+            if sum(tokens) - tokens[position] + text_tokens <= token_budget:
+                packed[position] = Document(page_content=text, metadata=packed[position].metadata)
+                tokens[position] = text_tokens
+                merged += 1
+            continue
+
+        doc_tokens = count_tokens(doc.page_content) + SEPARATOR_TOKENS
+        if sum(tokens) + doc_tokens <= token_budget:
+            packed.append(doc)
+            tokens.append(doc_tokens)
+
+    return packed, {
+        "candidates": len(docs),
+        "packed": len(packed),
+        "merged": merged,
+        "duplicates": duplicates,
+        "context_tokens": sum(tokens),
+        "token_budget": token_budget
+    }
+
+def take_packing_stats():
+    """Stats of the last packing done on this thread, cleared once read"""
+    stats = getattr(_last_stats, "value", None)
+    _last_stats.value = None
+    return stats
+
+class PackedRetriever(BaseRetriever):
+    """Wraps a candidate retriever and returns its results packed to a token budget"""
+
+    retriever: Any
+    token_budget: int = CONTEXT_TOKEN_BUDGET
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        candidates = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        packed, stats = pack_documents(candidates, self.token_budget)
+        stats["prompt_tokens"] = count_tokens(build_prompt(query, packed))
+        logger.info(
+            f"Packed {stats['packed']}/{stats['candidates']} chunks into {stats['context_tokens']} tokens "
+            f"({stats['prompt_tokens']} prompt tokens)"
+        )
+        _last_stats.value = stats
+        return packed
+
+def build_context_retriever(vector_store, k):
+    """Token-budgeted retriever, or the fixed-``k`` one when CONTEXT_TOKEN_BUDGET is 0"""
+    if CONTEXT_TOKEN_BUDGET <= 0:
+        return build_retriever(vector_store, k)
+    return PackedRetriever(retriever=build_retriever(vector_store, max(k, CONTEXT_CANDIDATES)))
+
+class PromptUsage:
+    """Prompt tokens sent per query, for sizing CONTEXT_TOKEN_BUDGET against the model's window"""
+
+    def __init__(self):
+        self.queries = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.last = None
+        self.lock = threading.Lock()
+
+    def record(self, stats):
+        with self.lock:
+            self.queries += 1
+            self.prompt_tokens += stats["prompt_tokens"]
+            self.max_prompt_tokens = max(self.max_prompt_tokens, stats["prompt_tokens"])
+            self.last = stats
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queries": self.queries,
+                "avg_prompt_tokens": self.prompt_tokens / self.queries if self.queries else None,
+                "max_prompt_tokens": self.max_prompt_tokens,
+                "token_budget": CONTEXT_TOKEN_BUDGET,
+                "last": self.last
+            }
+
+# Global prompt token tracker
+prompt_usage = PromptUsage()
@@ -0,0 +1,145 @@
+"""
+Parallel document loading: files and PDF page ranges are parsed in a process pool
+"""
+import os
+import time
+import logging
+import multiprocessing
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+LOADER_WORKERS = int(os.environ.get("LOADER_WORKERS", os.cpu_count() or 1))
+FILE_LOAD_TIMEOUT = float(os.environ.get("FILE_LOAD_TIMEOUT", 120))
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", 8))
+
+SUPPORTED_EXTENSIONS = {"csv", "pdf", "txt"}
+
+def file_extension(file_path):
+    return file_path.split('.')[-1].lower()
+
+# Worker functions run in child processes and return plain (text, metadata)
+# tuples, which are cheaper to pickle than Document objects
+
+def _load_csv(file_path):
+    from csv_streaming import iter_csv_documents
+    return [(doc.page_content, doc.metadata) for doc in iter_csv_documents(file_path)]
+
+def _load_txt(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return [(f.read(), {"source": file_path})]
+
+def _count_pdf_pages(file_path):
+    from pypdf import PdfReader
+    return len(PdfReader(file_path).pages)
+
+def _extract_pdf_pages(file_path, start, end):
+    """Extract text for pages [start, end) with PyPDFLoader's metadata layout"""
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    return [
+        (reader.pages[page].extract_text(), {"source": file_path, "page": page})
+        for page in range(start, end)
+    ]
+
+def _plan(file_path):
+    """First pass per file: load small formats outright, count PDF pages"""
+    file_ext = file_extension(file_path)
+    if file_ext == 'csv':
+        return "docs", _load_csv(file_path)
+    if file_ext == 'txt':
+        return "docs", _load_txt(file_path)
+    return "pages", _count_pdf_pages(file_path)
+
+def _pool_context():
+    # forkserver children start from a clean process rather than a copy of a
+    # threaded gunicorn worker holding the embedding model
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    # Preload only this module, not the app script the server was started from
+    context.set_forkserver_preload([__name__])
+    return context
+
+def load_documents_parallel(file_paths, max_workers=LOADER_WORKERS, timeout=FILE_LOAD_TIMEOUT):
+    """Load files into Documents, preserving file and page order
+
+    Files that fail or take longer than ``timeout`` seconds are skipped and
+    logged; stuck worker processes are terminated when loading finishes.
+    """
+    file_paths = [path for path in file_paths if _is_supported(path)]
+    if not file_paths:
+        return []
+    # A single CSV or text file is not worth starting a pool for
+    if max_workers <= 1 or _task_estimate(file_paths) <= 1:
+        return _load_sequential(file_paths)
+
+    results = {}
+    with _pool_context().Pool(processes=min(max_workers, _task_estimate(file_paths))) as pool:
+        deadlines = {path: time.monotonic() + timeout for path in file_paths}
+        plans = {path: pool.apply_async(_plan, (path,)) for path in file_paths}
+
+        page_tasks = {}
+        for path in file_paths:
+            try:
+                kind, value = plans[path].get(_remaining(deadlines[path]))
+            except multiprocessing.TimeoutError:
+                logger.error(f"Timed out loading {path} after {timeout:.0f}s")
+                continue
+            except Exception as e:
+                logger.error(f"Error loading {path}: {e}")
+                continue
+
+            if kind == "docs":
+                results[path] = value
+            else:
+                page_tasks[path] = [
+                    pool.apply_async(_extract_pdf_pages, (path, start, min(start + PDF_PAGES_PER_TASK, value)))
+                    for start in range(0, value, PDF_PAGES_PER_TASK)
+                ]
+
+        for path, tasks in page_tasks.items():
+            try:
+                pages = []
+                for task in tasks:
+                    pages.extend(task.get(_remaining(deadlines[path])))
+                results[path] = pages
+            except multiprocessing.TimeoutError:
+                logger.error(f"Timed out loading {path} after {timeout:.0f}s")
+            except Exception as e:
+                logger.error(f"Error loading {path}: {e}")
+        # Leaving the block terminates the pool, killing workers stuck on a skipped file
+
+    all_docs = []
+    for path in file_paths:
+        if path in results:
+            all_docs.extend(Document(page_content=text, metadata=metadata) for text, metadata in results[path])
+            logger.info(f"Loaded {len(results[path])} documents from {path}")
+    return all_docs
+
+def _load_sequential(file_paths):
+    all_docs = []
+    for path in file_paths:
+        try:
+            kind, value = _plan(path)
+            pages = value if kind == "docs" else _extract_pdf_pages(path, 0, value)
+        except Exception as e:
+            logger.error(f"Error loading {path}: {e}")
+            continue
+        all_docs.extend(Document(page_content=text, metadata=metadata) for text, metadata in pages)
+        logger.info(f"Loaded {len(pages)} documents from {path}")
+    return all_docs
+
+def _is_supported(file_path):
+    if file_extension(file_path) in SUPPORTED_EXTENSIONS:
+        return True
+    logger.warning(f"Unsupported file type: {file_extension(file_path)}")
+    return False
+
+def _task_estimate(file_paths):
+    # PDFs fan out into page ranges, so give them room for more than one worker
+    return sum(4 if file_extension(path) == 'pdf' else 1 for path in file_paths)
+
+def _remaining(deadline):
+    return max(0.0, deadline - time.monotonic())
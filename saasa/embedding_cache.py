@@ -0,0 +1,193 @@
+"""
+Persistent chunk-level embedding cache so re-uploaded documents skip re-embedding
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 200000))
+# Rows written between checks of the cap; the table may run over it by this much per worker
+EMBEDDING_CACHE_EVICT_EVERY = int(os.environ.get("EMBEDDING_CACHE_EVICT_EVERY", 1000))
+# Keys per SQL statement, well under SQLite's bound-parameter limit
+SQL_BATCH_SIZE = 500
+
+class EmbeddingCache:
+    """SQLite store of float32 vectors keyed by (model name, chunk text hash) with LRU eviction
+
+    Counting rows is a full scan, so the cap is only checked once every
+    ``evict_every`` rows written rather than on every batch; in between the
+    entry count reported to /metrics is kept running from the writes.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+                 evict_every=EMBEDDING_CACHE_EVICT_EVERY):
+        self.path = path
+        self.max_entries = max_entries
+        self.evict_every = max(1, evict_every)
+        self.written_since_check = 0
+        # Rows in the table as of the last count, plus this process's writes since
+        self.entries = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self._conn = None
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model_name, texts):
+        """Return cached vectors for ``texts`` (None where missing) and bump their recency"""
+        keys = [self.text_hash(text) for text in texts]
+        found = {}
+        with self.lock:
+            conn = self._connect()
+            for start in range(0, len(keys), SQL_BATCH_SIZE):
+                batch = keys[start:start + SQL_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model_name, *batch]
+                ).fetchall()
+                for text_hash, vector in rows:
+                    found[text_hash] = np.frombuffer(vector, dtype=np.float32).tolist()
+
+            if found:
+                # One UPDATE per batch of hits rather than one per hit
+                now = time.time()
+                hit_keys = list(found)
+                for start in range(0, len(hit_keys), SQL_BATCH_SIZE):
+                    batch = hit_keys[start:start + SQL_BATCH_SIZE]
+                    placeholders = ",".join("?" * len(batch))
+                    conn.execute(
+                        f"UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash IN ({placeholders})",
+                        [now, model_name, *batch]
+                    )
+                conn.commit()
+
+            results = [found.get(key) for key in keys]
+            hit_count = sum(1 for vector in results if vector is not None)
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+        return results
+
+    def put_many(self, model_name, texts, vectors):
+        """Store vectors for ``texts``; every ``evict_every`` rows, evict least recently used entries over the cap"""
+        now = time.time()
+        rows = [
+            (model_name, self.text_hash(text), np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self.lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_access) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self.written_since_check += len(rows)
+            self.entries += len(rows)
+            if self.written_since_check >= self.evict_every:
+                self.written_since_check = 0
+                self.entries = self._count(conn)
+                overflow = self.entries - self.max_entries
+                if overflow > 0:
+                    conn.execute(
+                        "DELETE FROM embeddings WHERE rowid IN "
+                        "(SELECT rowid FROM embeddings ORDER BY last_access LIMIT ?)",
+                        (overflow,)
+                    )
+                    self.evictions += overflow
+                    self.entries -= overflow
+            conn.commit()
+
+    def stats(self):
+        """Hit/miss counters for /metrics; ``entries`` is approximate between cap checks"""
+        with self.lock:
+            hits, misses, evictions, entries = self.hits, self.misses, self.evictions, self.entries
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups > 0 else 0,
+            "evictions": evictions,
+            "entries": entries,
+            "max_entries": self.max_entries
+        }
+
+    @staticmethod
+    def _count(conn):
+        return conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _connect(self):
+        # Opened lazily so gunicorn workers never inherit a connection from the master
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                "last_access REAL NOT NULL, PRIMARY KEY (model, text_hash))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)"
+            )
+            # Counted once per process; put_many keeps it running from here
+            self.entries = self._count(self._conn)
+        return self._conn
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends cache misses to the underlying model"""
+
+    def __init__(self, embeddings, cache, model_name=None):
+        self.embeddings = embeddings
+        self.cache = cache
+        if model_name is None:
+            model_name = getattr(embeddings, "model_name", type(embeddings).__name__)
+            # Vectors from other inference backends differ slightly, so keep them apart
+            backend = getattr(embeddings, "backend", None)
+            if backend:
+                model_name = f"{model_name}:{backend}"
+        self.model_name = model_name
+
+    def embed_documents(self, texts):
+        try:
+            vectors = self.cache.get_many(self.model_name, texts)
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache lookup failed: {e}")
+            return self.embeddings.embed_documents(texts)
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            new_vectors = self.embeddings.embed_documents(missing_texts)
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+            try:
+                self.cache.put_many(self.model_name, missing_texts, new_vectors)
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding cache write failed: {e}")
+        return vectors
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+# Global embedding cache
+embedding_cache = EmbeddingCache()
+
+def with_embedding_cache(embeddings):
+    """Wrap ``embeddings`` with the shared cache unless caching is disabled"""
+    if not EMBEDDING_CACHE_ENABLED:
+        return embeddings
+    return CachedEmbeddings(embeddings, embedding_cache)
@@ -0,0 +1,118 @@
+"""
+Multi-core embedding: batches sharded across a process pool, throughput tracking
+"""
+import os
+import logging
+import threading
+import multiprocessing
+
+from langchain_core.embeddings import Embeddings
+
+from model_registry import get_embeddings, set_embedding_threads, embedding_threads, backend_tag, DEFAULT_EMBEDDING_MODEL
+
+logger = logging.getLogger(__name__)
+
+# 0 or 1 embeds in the calling process
+EMBED_PROCESSES = int(os.environ.get("EMBED_PROCESSES", 0))
+
+def _init_worker(model_name, num_threads):
+    # Each worker's share of the cores replaces EMBED_THREADS
+    set_embedding_threads(num_threads)
+    get_embeddings(model_name)
+
+def _embed_shard(model_name, texts):
+    return get_embeddings(model_name).embed_documents(texts)
+
+class ShardedEmbeddings(Embeddings):
+    """Split each ``embed_documents`` call across worker processes
+
+    Every worker loads its own copy of the model and gets an equal share of
+    the machine's cores for inference, so the shards run side by side instead of
+    competing for threads. Queries are embedded in the calling process.
+    """
+
+    def __init__(self, model_name=None, processes=EMBED_PROCESSES):
+        self.model_name = model_name or DEFAULT_EMBEDDING_MODEL
+        self.backend = backend_tag()
+        self.processes = processes
+        self._pool = None
+        self.lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        shard_size = -(-len(texts) // self.processes)
+        shards = [texts[start:start + shard_size] for start in range(0, len(texts), shard_size)]
+        results = self._get_pool().starmap(_embed_shard, [(self.model_name, shard) for shard in shards])
+        return [vector for shard in results for vector in shard]
+
+    def embed_query(self, text):
+        return get_embeddings(self.model_name).embed_query(text)
+
+    def close(self):
+        with self.lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+
+    def _get_pool(self):
+        with self.lock:
+            if self._pool is None:
+                context = multiprocessing.get_context(
+                    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                )
+                threads = max(1, (os.cpu_count() or 1) // self.processes)
+                logger.info(f"Starting {self.processes} embedding workers with {threads} threads each")
+                self._pool = context.Pool(
+                    processes=self.processes,
+                    initializer=_init_worker,
+                    initargs=(self.model_name, threads)
+                )
+            return self._pool
+
+class EmbeddingThroughput:
+    """Chunks/sec of recent indexing runs, for tuning batch size and threads per node"""
+
+    def __init__(self):
+        self.runs = 0
+        self.chunks = 0
+        self.seconds = 0.0
+        self.last_chunks_per_second = None
+        self.lock = threading.Lock()
+
+    def record(self, chunks, seconds):
+        rate = chunks / seconds if seconds > 0 else None
+        with self.lock:
+            self.runs += 1
+            self.chunks += chunks
+            self.seconds += seconds
+            self.last_chunks_per_second = rate
+        return rate
+
+    def stats(self):
+        with self.lock:
+            return {
+                "runs": self.runs,
+                "chunks": self.chunks,
+                "seconds": round(self.seconds, 3),
+                "chunks_per_second": self.chunks / self.seconds if self.seconds > 0 else None,
+                "last_chunks_per_second": self.last_chunks_per_second,
+                "processes": EMBED_PROCESSES,
+                "threads": embedding_threads()
+            }
+
+# Global throughput tracker
+throughput = EmbeddingThroughput()
+
+_sharded = {}
+_sharded_lock = threading.Lock()
+
+def pipeline_embeddings(model_name=None):
+    """Embeddings for indexing: the shared model, or a process-sharded wrapper when EMBED_PROCESSES > 1"""
+    if EMBED_PROCESSES <= 1:
+        return get_embeddings(model_name)
+    model_name = model_name or DEFAULT_EMBEDDING_MODEL
+    with _sharded_lock:
+        if model_name not in _sharded:
+            _sharded[model_name] = ShardedEmbeddings(model_name)
+        return _sharded[model_name]
@@ -0,0 +1,262 @@
+"""
+FAISS index selection by corpus size: exact Flat for small stores, HNSW or IVF-PQ for large ones
+
+Stores are built as Flat while chunks stream in; once the final chunk count
+is known ``upgrade_index`` moves large stores to an approximate index,
+trained on a sample of the stored vectors, and stores that keep growing
+move on from HNSW to IVF-PQ. Vector positions are unchanged, so
+LangChain's index_to_docstore_id mapping stays valid.
+
+Run ``python faiss_index.py <saved index folder> [flat|hnsw|ivfpq ...]`` for
+a recall-vs-latency report of a persisted store, or of the same vectors
+rebuilt as each listed index type.
+"""
+import os
+import sys
+import json
+import time
+import logging
+
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+# auto, flat, hnsw or ivfpq
+FAISS_INDEX_TYPE = os.environ.get("FAISS_INDEX_TYPE", "auto").lower()
+FAISS_FLAT_MAX = int(os.environ.get("FAISS_FLAT_MAX", 50000))
+FAISS_HNSW_MAX = int(os.environ.get("FAISS_HNSW_MAX", 500000))
+FAISS_HNSW_M = int(os.environ.get("FAISS_HNSW_M", 32))
+FAISS_HNSW_EF_CONSTRUCTION = int(os.environ.get("FAISS_HNSW_EF_CONSTRUCTION", 80))
+FAISS_HNSW_EF_SEARCH = int(os.environ.get("FAISS_HNSW_EF_SEARCH", 64))
+# 0 picks about 4 * sqrt(n) lists
+FAISS_IVF_NLIST = int(os.environ.get("FAISS_IVF_NLIST", 0))
+FAISS_IVF_NPROBE = int(os.environ.get("FAISS_IVF_NPROBE", 16))
+FAISS_PQ_M = int(os.environ.get("FAISS_PQ_M", 48))
+FAISS_PQ_NBITS = int(os.environ.get("FAISS_PQ_NBITS", 8))
+FAISS_TRAIN_SAMPLE = int(os.environ.get("FAISS_TRAIN_SAMPLE", 100000))
+# Log recall/latency after each upgrade; builds a second, exact copy of every vector, so off by default
+FAISS_INDEX_REPORT = os.environ.get("FAISS_INDEX_REPORT", "false").lower() == "true"
+
+class MmapFlatIndex:
+    """Read-only exact L2 index over a memory-mapped float32 matrix
+
+    Search gives the same results as IndexFlatL2, but the vectors stay in
+    the OS page cache, shared by every worker that maps the same file,
+    instead of being copied into each process. Copy the store with
+    ``materialize`` before adding or removing vectors.
+    """
+
+    metric_type = faiss.METRIC_L2
+    is_trained = True
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.ntotal, self.d = vectors.shape
+
+    def search(self, x, k):
+        return faiss.knn(np.ascontiguousarray(x, dtype=np.float32), self.vectors, k)
+
+    def reconstruct(self, key):
+        return np.array(self.vectors[key])
+
+    def reconstruct_n(self, start, count):
+        return np.array(self.vectors[start:start + count])
+
+    def add(self, x):
+        raise TypeError("Memory-mapped index is read-only; materialize it first")
+
+    def remove_ids(self, ids):
+        raise TypeError("Memory-mapped index is read-only; materialize it first")
+
+def materialize(index):
+    """Independent in-memory copy of ``index`` that can be modified"""
+    if isinstance(index, MmapFlatIndex):
+        copy = faiss.IndexFlatL2(index.d)
+        copy.add(np.ascontiguousarray(index.vectors))
+        return copy
+    return faiss.clone_index(index)
+
+def choose_index_type(num_vectors, index_type=FAISS_INDEX_TYPE):
+    """Index type for a store of ``num_vectors`` chunks"""
+    if index_type != "auto":
+        return index_type
+    if num_vectors < FAISS_FLAT_MAX:
+        return "flat"
+    if num_vectors < FAISS_HNSW_MAX:
+        return "hnsw"
+    return "ivfpq"
+
+def index_type_of(index):
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, (faiss.IndexFlat, MmapFlatIndex)):
+        return "flat"
+    return type(index).__name__
+
+def build_index(vectors, index_type):
+    """Train (where needed) and fill an index of ``index_type`` with ``vectors``"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    num_vectors, dimension = vectors.shape
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dimension)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, FAISS_HNSW_M)
+        index.hnsw.efConstruction = FAISS_HNSW_EF_CONSTRUCTION
+    elif index_type == "ivfpq":
+        # k-means wants roughly 39 training points per list
+        nlist = FAISS_IVF_NLIST or max(1, min(int(4 * np.sqrt(num_vectors)), min(num_vectors, FAISS_TRAIN_SAMPLE) // 39))
+        # PQ sub-quantizers must divide the dimension
+        pq_m = max(m for m in range(1, min(FAISS_PQ_M, dimension) + 1) if dimension % m == 0)
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dimension), dimension, nlist, pq_m, FAISS_PQ_NBITS)
+        sample = vectors
+        if num_vectors > FAISS_TRAIN_SAMPLE:
+            rows = np.random.default_rng(0).choice(num_vectors, FAISS_TRAIN_SAMPLE, replace=False)
+            sample = vectors[np.sort(rows)]
+        logger.info(f"Training IVF-PQ (nlist={nlist}, m={pq_m}) on {len(sample)} vectors")
+        index.train(sample)
+    else:
+        raise ValueError(f"Unknown FAISS index type: {index_type}")
+
+    index.add(vectors)
+    tune_index(index)
+    return index
+
+def tune_index(index):
+    """Apply search-time parameters, which are not all kept when an index is saved"""
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = FAISS_HNSW_EF_SEARCH
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = FAISS_IVF_NPROBE
+    return index
+
+def supports_removal(index):
+    """Whether ``FAISS.delete`` can remove vectors in place
+
+    HNSW graphs cannot drop vectors, and IVF's remove_ids keeps the old
+    labels while LangChain renumbers positions 0..n-1 after a delete, so
+    both go through ``remove_positions`` instead.
+    """
+    return not isinstance(index, (faiss.IndexHNSW, faiss.IndexIVF, MmapFlatIndex))
+
+def stored_vectors(index):
+    """All vectors in position order (approximate for PQ indexes)"""
+    if not isinstance(index, faiss.IndexIVF):
+        return index.reconstruct_n(0, index.ntotal)
+    index.make_direct_map()
+    try:
+        return index.reconstruct_n(0, index.ntotal)
+    finally:
+        # An array direct map would block remove_ids
+        index.make_direct_map(False)
+
+# Index types by the store sizes they serve; a store only ever moves up this list
+INDEX_TYPE_ORDER = ["flat", "hnsw", "ivfpq"]
+
+def upgrade_index(vector_store, index_type=FAISS_INDEX_TYPE):
+    """Swap a Flat or HNSW index for the type its size calls for; returns the report or None
+
+    IVF-PQ is never rebuilt: it only holds lossy codes, and retraining from
+    their reconstructions would add quantization error each time.
+    """
+    index = vector_store.index
+    current = index_type_of(index)
+    target = choose_index_type(index.ntotal, index_type)
+    if current not in ("flat", "hnsw") or target not in INDEX_TYPE_ORDER:
+        return None
+    if INDEX_TYPE_ORDER.index(target) <= INDEX_TYPE_ORDER.index(current):
+        return None
+
+    start_time = time.time()
+    vectors = stored_vectors(index)
+    vector_store.index = build_index(vectors, target)
+    logger.info(f"Rebuilt {index.ntotal} vectors as {target} in {time.time() - start_time:.2f}s")
+
+    if not FAISS_INDEX_REPORT:
+        return None
+    report = recall_latency_report(vector_store.index, vectors)
+    logger.info(f"Index report: {json.dumps(report)}")
+    return report
+
+def remove_positions(index, positions):
+    """Index without the vectors at ``positions``, the rest renumbered 0..n-1 in order as LangChain expects
+
+    IVF indexes drop the vectors in place and relabel the rest, keeping the
+    trained quantizer and every remaining code as it was. HNSW graphs cannot
+    drop vectors, so they are rebuilt from their exact stored vectors.
+    """
+    positions = np.unique(np.asarray(list(positions), dtype=np.int64))
+    if not isinstance(index, faiss.IndexIVF):
+        return rebuild_without(index, positions)
+
+    index.remove_ids(positions)
+    invlists = index.invlists
+    for list_no in range(index.nlist):
+        size = invlists.list_size(list_no)
+        if not size:
+            continue
+        ids = faiss.rev_swig_ptr(invlists.get_ids(list_no), size).copy()
+        codes = faiss.rev_swig_ptr(invlists.get_codes(list_no), size * invlists.code_size).copy()
+        # Each label moves down by the number of removed positions before it
+        ids -= np.searchsorted(positions, ids)
+        invlists.update_entries(list_no, 0, size, faiss.swig_ptr(ids), faiss.swig_ptr(codes))
+    return index
+
+def rebuild_without(index, positions):
+    """Rebuild without the vectors at ``positions``, sized for what remains
+
+    Only for indexes that store exact vectors (Flat, HNSW); see ``remove_positions``.
+    """
+    keep = np.setdiff1d(np.arange(index.ntotal), np.asarray(list(positions), dtype=np.int64))
+    vectors = stored_vectors(index)[keep]
+    if len(vectors) == 0:
+        return faiss.IndexFlatL2(index.d)
+    return build_index(vectors, choose_index_type(len(vectors)))
+
+def recall_latency_report(index, vectors, k=10, num_queries=50):
+    """Recall@k of ``index`` against exact search over ``vectors``, with per-query latency"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), min(num_queries, len(vectors)), replace=False)]
+    k = min(k, len(vectors))
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    start_time = time.time()
+    _, expected = exact.search(queries, k)
+    exact_ms = (time.time() - start_time) * 1000 / len(queries)
+
+    start_time = time.time()
+    _, found = index.search(queries, k)
+    approx_ms = (time.time() - start_time) * 1000 / len(queries)
+
+    recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(expected, found)])
+    return {
+        "index_type": index_type_of(index),
+        "vectors": int(index.ntotal),
+        f"recall_at_{k}": round(float(recall), 4),
+        "query_ms": round(approx_ms, 3),
+        "exact_query_ms": round(exact_ms, 3)
+    }
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from vector_persistence import INDEX_FILE, VECTORS_FILE
+
+    # Flat stores are saved as a plain matrix, everything else in FAISS's format
+    vectors_path = os.path.join(sys.argv[1], VECTORS_FILE)
+    if os.path.exists(vectors_path):
+        index = MmapFlatIndex(np.load(vectors_path, mmap_mode="r"))
+    else:
+        index = tune_index(faiss.read_index(os.path.join(sys.argv[1], INDEX_FILE)))
+    vectors = stored_vectors(index)
+    reports = [recall_latency_report(index, vectors)]
+    for index_type in sys.argv[2:]:
+        start_time = time.time()
+        report = recall_latency_report(build_index(vectors, index_type), vectors)
+        report["build_seconds"] = round(time.time() - start_time, 2)
+        reports.append(report)
+    print(json.dumps(reports, indent=2))
@@ -0,0 +1,49 @@
+"""
+Gunicorn configuration for production deployment
+"""
+import os
+import multiprocessing
+
+# gthread (default) or gevent: a request waiting on the LLM holds a thread or
+# greenlet instead of a whole worker, so one worker serves many slow queries.
+# sync keeps the old one-request-per-worker behaviour.
+worker_class = os.environ.get("WORKER_CLASS", "gthread")
+
+if worker_class == "gevent":
+    # Patch before the app is preloaded, or locks and sockets created at import would block the hub
+    from gevent import monkey
+    monkey.patch_all()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+# Sessions live in the shared session store, so any worker can serve any request
+workers = int(os.environ.get("WORKERS", multiprocessing.cpu_count()))
+# Concurrent requests per gthread worker; keep LLM_MAX_CONCURRENCY at least this high
+threads = int(os.environ.get("THREADS", 100))
+# Concurrent requests per gevent worker
+worker_connections = int(os.environ.get("WORKER_CONNECTIONS", 1000))
+timeout = int(os.environ.get("TIMEOUT", 120))
+max_requests = int(os.environ.get("MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("MAX_REQUESTS_JITTER", 100))
+
+# Import the app in the master process so the embedding model loaded at import
+# time is shared copy-on-write by every forked worker instead of loaded per worker
+preload_app = True
+
+# Workers write Prometheus samples here for /metrics/prometheus to aggregate
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.abspath(os.path.join(os.environ.get("METRICS_DIR", "metrics"), "prometheus"))
+)
+
+def on_starting(server):
+    """Start counting from zero: samples left by a previous run would be summed in"""
+    import shutil
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
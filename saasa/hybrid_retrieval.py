@@ -0,0 +1,340 @@
+"""
+Hybrid retrieval: a BM25 inverted index next to the FAISS index, fused by reciprocal rank
+"""
+import os
+import re
+import math
+import time
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, List
+
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStoreRetriever
+
+from prometheus_metrics import observe_stage, record_stage_failure
+
+logger = logging.getLogger(__name__)
+
+# hybrid or vector
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "hybrid").lower()
+# Results per query in hybrid mode; 0 keeps the k the chain asks for
+HYBRID_K = int(os.environ.get("HYBRID_K", 0))
+HYBRID_FETCH_K = int(os.environ.get("HYBRID_FETCH_K", 20))
+RRF_K = int(os.environ.get("RRF_K", 60))
+
+# Identifiers such as SKU-1234 or v2.1.0 are kept whole as well as split into parts
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./:][a-z0-9]+)*")
+
+def tokenize(text):
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[-_./:]", token) if part)
+    return tokens
+
+class BM25Index:
+    """Okapi BM25 over a vector store's chunks, addressed by docstore id
+
+    Chunks are added and removed without re-reading the others: an addition
+    extends only the postings of its own terms, and a removal marks the
+    chunk dead until dead chunks outnumber live ones and the postings are
+    compacted.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.doc_ids = []
+        self.numbers = {}
+        self.postings = {}
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+        self.live = np.zeros(0, dtype=bool)
+        self.num_live = 0
+        self.total_length = 0.0
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def from_vector_store(cls, vector_store):
+        """Tokenize every stored chunk, in index order"""
+        docs = vector_store.docstore._dict
+        lexical_index = cls()
+        lexical_index.add(
+            (doc_id, docs[doc_id].page_content)
+            for _, doc_id in sorted(vector_store.index_to_docstore_id.items())
+        )
+        return lexical_index
+
+    def __len__(self):
+        return self.num_live
+
+    @property
+    def avg_length(self):
+        return self.total_length / self.num_live if self.num_live else 0.0
+
+    def add(self, chunks):
+        """Index ``(docstore_id, text)`` pairs, touching only the postings of their terms
+
+        An id that is already indexed, or repeated in the batch, keeps its last text.
+        """
+        chunks = dict(chunks)
+        # Before numbering the batch: a removal may compact, which renumbers every chunk
+        self.remove([doc_id for doc_id in chunks if doc_id in self.numbers])
+        new_postings = {}
+        lengths = []
+        for doc_id, text in chunks.items():
+            number = len(self.doc_ids)
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            self.numbers[doc_id] = number
+            self.doc_ids.append(doc_id)
+            for term, count in counts.items():
+                numbers, term_counts = new_postings.setdefault(term, ([], []))
+                numbers.append(number)
+                term_counts.append(count)
+        if not lengths:
+            return
+
+        for term, (numbers, counts) in new_postings.items():
+            numbers = np.array(numbers, dtype=np.int32)
+            counts = np.array(counts, dtype=np.float32)
+            if term in self.postings:
+                old_numbers, old_counts = self.postings[term]
+                numbers = np.concatenate((old_numbers, numbers))
+                counts = np.concatenate((old_counts, counts))
+            self.postings[term] = (numbers, counts)
+        self.doc_lengths = np.concatenate((self.doc_lengths, np.array(lengths, dtype=np.float32)))
+        self.live = np.concatenate((self.live, np.ones(len(lengths), dtype=bool)))
+        self.num_live += len(lengths)
+        self.total_length += float(sum(lengths))
+
+    def remove(self, doc_ids):
+        """Drop chunks by docstore id; their postings are cleared at the next compaction"""
+        for doc_id in doc_ids:
+            number = self.numbers.pop(doc_id, None)
+            if number is None:
+                continue
+            self.live[number] = False
+            self.num_live -= 1
+            self.total_length -= float(self.doc_lengths[number])
+        if len(self.doc_ids) > 2 * self.num_live:
+            self._compact()
+
+    def _compact(self):
+        """Renumber the live chunks and drop the dead ones from every posting list"""
+        renumbered = np.cumsum(self.live, dtype=np.int64) - 1
+        postings = {}
+        for term, (numbers, counts) in self.postings.items():
+            alive = self.live[numbers]
+            if alive.any():
+                postings[term] = (renumbered[numbers[alive]].astype(np.int32), counts[alive])
+        self.postings = postings
+        self.doc_ids = [doc_id for doc_id, alive in zip(self.doc_ids, self.live) if alive]
+        self.numbers = {doc_id: number for number, doc_id in enumerate(self.doc_ids)}
+        self.doc_lengths = self.doc_lengths[self.live]
+        self.live = np.ones(len(self.doc_ids), dtype=bool)
+
+    def copy(self):
+        """Independent copy; posting arrays are shared since updates replace them rather than write to them"""
+        copy = BM25Index(self.k1, self.b)
+        copy.doc_ids = list(self.doc_ids)
+        copy.numbers = dict(self.numbers)
+        copy.postings = dict(self.postings)
+        copy.doc_lengths = self.doc_lengths
+        copy.live = self.live.copy()
+        copy.num_live = self.num_live
+        copy.total_length = self.total_length
+        return copy
+
+    def search(self, query, k):
+        """Top ``k`` ``(docstore_id, score)`` pairs for ``query``"""
+        if not self.num_live:
+            return []
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        num_docs = self.num_live
+        avg_length = self.avg_length
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            numbers, counts = self.postings[term]
+            alive = self.live[numbers]
+            if not alive.all():
+                numbers, counts = numbers[alive], counts[alive]
+                if not len(numbers):
+                    continue
+            idf = math.log(1 + (num_docs - len(numbers) + 0.5) / (len(numbers) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[numbers] / avg_length)
+            scores[numbers] += idf * counts * (self.k1 + 1) / (counts + norm)
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k)[:k]]
+        matched = matched[np.argsort(-scores[matched])]
+        return [(self.doc_ids[number], float(scores[number])) for number in matched]
+
+def attach_lexical_index(vector_store):
+    """Build the BM25 index for ``vector_store`` and keep it on the store"""
+    vector_store.lexical_index = BM25Index.from_vector_store(vector_store)
+    logger.info(f"Built lexical index: {len(vector_store.lexical_index.postings)} terms")
+    return vector_store.lexical_index
+
+def current_lexical_index(vector_store):
+    """The BM25 index attached to the store if it matches the store's chunks, else None"""
+    lexical_index = getattr(vector_store, "lexical_index", None)
+    # Indexes pickled before incremental updates lack the live-chunk bookkeeping
+    if lexical_index is None or not hasattr(lexical_index, "live"):
+        return None
+    return lexical_index if len(lexical_index) == vector_store.index.ntotal else None
+
+def get_lexical_index(vector_store):
+    """The store's BM25 index, built now if ingestion or loading did not attach a current one"""
+    lexical_index = current_lexical_index(vector_store)
+    if lexical_index is None:
+        lexical_index = attach_lexical_index(vector_store)
+    return lexical_index
+
+class SearchLock:
+    """Any number of searches at once, or one in-place update of the store
+
+    An update waiting for the lock keeps new searches out, so a steady
+    stream of queries cannot hold an upload back indefinitely.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.searches = 0
+        self.updating = False
+        self.waiting_updates = 0
+
+    @contextmanager
+    def shared(self):
+        with self.condition:
+            while self.updating or self.waiting_updates:
+                self.condition.wait()
+            self.searches += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.searches -= 1
+                if not self.searches:
+                    self.condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self.condition:
+            self.waiting_updates += 1
+            while self.updating or self.searches:
+                self.condition.wait()
+            self.waiting_updates -= 1
+            self.updating = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.updating = False
+                self.condition.notify_all()
+
+_search_locks_lock = threading.Lock()
+
+def get_search_lock(vector_store):
+    """The store's SearchLock: retrieval holds it shared, in-place updates exclusively"""
+    search_lock = getattr(vector_store, "search_lock", None)
+    if search_lock is None:
+        with _search_locks_lock:
+            search_lock = getattr(vector_store, "search_lock", None)
+            if search_lock is None:
+                search_lock = vector_store.search_lock = SearchLock()
+    return search_lock
+
+class HybridRetriever(BaseRetriever):
+    """Reciprocal-rank fusion of FAISS similarity and BM25 results"""
+
+    vectorstore: Any
+    lexical_index: Any
+    k: int = 4
+    fetch_k: int = HYBRID_FETCH_K
+    rrf_k: int = RRF_K
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        with get_search_lock(self.vectorstore).shared():
+            fused = {}
+            for ranking in (self._vector_ranking(query), self.lexical_index.search(query, self.fetch_k)):
+                for rank, (doc_id, _) in enumerate(ranking):
+                    fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+
+            best = sorted(fused, key=fused.get, reverse=True)[:self.k]
+            return [self.vectorstore.docstore.search(doc_id) for doc_id in best]
+
+    def _vector_ranking(self, query):
+        embedding_function = self.vectorstore.embedding_function
+        if isinstance(embedding_function, Embeddings):
+            embedding = embedding_function.embed_query(query)
+        else:
+            embedding = embedding_function(query)
+        fetch_k = min(self.fetch_k, self.vectorstore.index.ntotal)
+        distances, positions = self.vectorstore.index.search(
+            np.array([embedding], dtype=np.float32), fetch_k
+        )
+        return [
+            (self.vectorstore.index_to_docstore_id[position], float(distance))
+            for position, distance in zip(positions[0], distances[0])
+            if position != -1
+        ]
+
+class LockedVectorStoreRetriever(VectorStoreRetriever):
+    """Plain similarity search, holding the store's search lock like the hybrid retriever"""
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        with get_search_lock(self.vectorstore).shared():
+            return super()._get_relevant_documents(query, run_manager=run_manager)
+
+def build_retriever(vector_store, k):
+    """Hybrid retriever in hybrid mode, otherwise plain similarity search with ``k`` results"""
+    if RETRIEVAL_MODE != "hybrid":
+        return LockedVectorStoreRetriever(
+            vectorstore=vector_store, search_type="similarity", search_kwargs={"k": k}
+        )
+    return HybridRetriever(
+        vectorstore=vector_store,
+        lexical_index=get_lexical_index(vector_store),
+        k=HYBRID_K or k
+    )
+
+class RetrievalTimer(BaseCallbackHandler):
+    """Callback handler observing each top-level retriever run as the ``retrieval`` stage
+
+    Pass it in the run's callbacks; retrievers nested in another (the hybrid
+    retriever inside the packing one) are part of their parent's run.
+    """
+
+    def __init__(self):
+        self.started = {}
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        if parent_run_id not in self.started:
+            self.started[run_id] = time.perf_counter()
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        start_time = self.started.pop(run_id, None)
+        if start_time is not None:
+            observe_stage("retrieval", time.perf_counter() - start_time)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        start_time = self.started.pop(run_id, None)
+        if start_time is not None:
+            record_stage_failure("retrieval")
+            observe_stage("retrieval", time.perf_counter() - start_time)
+
+# Shared by every query; runs are told apart by run id
+retrieval_timer = RetrievalTimer()
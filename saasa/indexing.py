@@ -0,0 +1,150 @@
+"""
+Vector store construction shared by the RAG servers
+"""
+import time
+import logging
+from itertools import islice
+
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from model_registry import EMBED_BATCH_SIZE
+from embedding_cache import with_embedding_cache
+from embedding_pipeline import pipeline_embeddings, throughput, EMBED_PROCESSES
+from faiss_index import upgrade_index, supports_removal, remove_positions, materialize, MmapFlatIndex
+from hybrid_retrieval import current_lexical_index, get_search_lock
+from prometheus_metrics import StageClock
+
+logger = logging.getLogger(__name__)
+
+def build_vector_store(docs, embeddings=None, batch_size=None, progress_callback=None,
+                       vector_store=None):
+    """Embed ``docs`` batch by batch into a FAISS store, reporting chunks embedded so far
+
+    ``docs`` may be any iterable, including a generator, so chunks can be
+    produced lazily while earlier batches are embedded. When ``vector_store``
+    is given the new chunks are appended to it in place, so only new data is
+    embedded: they are all embedded first, then added together with their
+    BM25 postings under the store's search lock, so queries never see part
+    of an upload. Without explicit ``embeddings`` batches go through the
+    multi-core pipeline, sized so each embedding process gets a full batch.
+    """
+    embeddings = with_embedding_cache(embeddings or pipeline_embeddings())
+    batch_size = batch_size or EMBED_BATCH_SIZE * max(1, EMBED_PROCESSES)
+    start_time = time.time()
+
+    docs = iter(docs)
+    done = 0
+    appending = vector_store is not None
+    pending = []
+    # Batches alternate between the model and FAISS; each stage's share is observed once per build
+    embedding_clock, faiss_clock = StageClock("embedding"), StageClock("faiss_build")
+    while True:
+        batch = list(islice(docs, batch_size))
+        if not batch:
+            break
+        texts = [doc.page_content for doc in batch]
+        with embedding_clock.running():
+            vectors = embeddings.embed_documents(texts)
+        metadatas = [doc.metadata for doc in batch]
+        if appending:
+            pending.append((texts, np.asarray(vectors, dtype=np.float32), metadatas))
+        else:
+            with faiss_clock.running():
+                text_embeddings = list(zip(texts, vectors))
+                if vector_store is None:
+                    vector_store = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas)
+                else:
+                    vector_store.add_embeddings(text_embeddings, metadatas=metadatas)
+
+        done += len(batch)
+        if progress_callback:
+            progress_callback(done)
+
+    if done == 0:
+        raise ValueError("No documents to index")
+    embedding_clock.observe()
+
+    elapsed = time.time() - start_time
+    rate = throughput.record(done, elapsed)
+    logger.info(f"Indexed {done} chunks in {elapsed:.2f}s ({rate or 0:.1f} chunks/s)")
+
+    if appending:
+        with faiss_clock.running(), get_search_lock(vector_store).exclusive():
+            lexical_index = current_lexical_index(vector_store)
+            for texts, vectors, metadatas in pending:
+                ids = vector_store.add_embeddings(zip(texts, vectors), metadatas=metadatas)
+                if lexical_index is not None:
+                    lexical_index.add(zip(ids, texts))
+            # Only a store crossing a size threshold is rebuilt here; searches wait for it
+            upgrade_index(vector_store)
+    else:
+        # Chunks stream in as Flat; switch to HNSW/IVF-PQ once the final size is known
+        with faiss_clock.running():
+            upgrade_index(vector_store)
+    faiss_clock.observe()
+    return vector_store
+
+def writable_vector_store(vector_store):
+    """``vector_store`` itself, or a private copy when its index cannot be modified in place
+
+    A memory-mapped index is read-only and its pages are shared with the
+    other workers, so only that case pays for a full copy. Stores modified
+    in place are changed under their search lock.
+    """
+    if not isinstance(vector_store.index, MmapFlatIndex):
+        return vector_store
+    copy = FAISS(
+        vector_store.embedding_function,
+        materialize(vector_store.index),
+        InMemoryDocstore(dict(vector_store.docstore._dict)),
+        dict(vector_store.index_to_docstore_id)
+    )
+    lexical_index = current_lexical_index(vector_store)
+    if lexical_index is not None:
+        copy.lexical_index = lexical_index.copy()
+    return copy
+
+def list_documents(vector_store):
+    """Uploaded documents in a store: doc_id -> source and chunk count"""
+    documents = {}
+    with get_search_lock(vector_store).shared():
+        for doc in vector_store.docstore._dict.values():
+            doc_id = doc.metadata.get("doc_id")
+            if doc_id is None:
+                continue
+            entry = documents.setdefault(doc_id, {"source": doc.metadata.get("source"), "chunks": 0})
+            entry["chunks"] += 1
+    return documents
+
+def remove_document(vector_store, doc_id):
+    """Delete every chunk of ``doc_id`` and its BM25 postings; returns the number of vectors removed"""
+    ids = [
+        docstore_id for docstore_id, doc in vector_store.docstore._dict.items()
+        if doc.metadata.get("doc_id") == doc_id
+    ]
+    if not ids:
+        return 0
+
+    with get_search_lock(vector_store).exclusive():
+        lexical_index = current_lexical_index(vector_store)
+        if supports_removal(vector_store.index):
+            vector_store.delete(ids)
+        else:
+            # Same bookkeeping as FAISS.delete, with the index edited or rebuilt by remove_positions
+            removed = set(ids)
+            positions = [
+                position for position, docstore_id in vector_store.index_to_docstore_id.items()
+                if docstore_id in removed
+            ]
+            vector_store.index = remove_positions(vector_store.index, positions)
+            vector_store.docstore.delete(ids)
+            remaining = [
+                docstore_id for _, docstore_id in sorted(vector_store.index_to_docstore_id.items())
+                if docstore_id not in removed
+            ]
+            vector_store.index_to_docstore_id = dict(enumerate(remaining))
+        if lexical_index is not None:
+            lexical_index.remove(ids)
+    return len(ids)
@@ -0,0 +1,169 @@
+"""
+Background ingestion jobs so uploads return immediately instead of pinning a worker
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+class JobQueueFullError(Exception):
+    """Raised when the ingestion queue has no room for another job"""
+
+class IngestJob:
+    """Status of a single ingestion run: stage, progress counters and per-stage timings"""
+
+    def __init__(self, job_id=None, on_update=None):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.status = "queued"
+        self.stage = "queued"
+        self.progress = {}
+        self.timings = {}
+        self.result = None
+        self.error = None
+        self.created_at = datetime.now()
+        self.finished_at = None
+        self._on_update = on_update
+
+    @contextmanager
+    def track_stage(self, name):
+        """Mark ``name`` as the current stage and record how long it takes"""
+        self.stage = name
+        self._notify()
+        start_time = time.time()
+        try:
+            with span(f"ingest.{name}"):
+                yield
+        finally:
+            self.timings[name] = round(time.time() - start_time, 3)
+            self._notify()
+
+    def update_progress(self, **counters):
+        """Update progress counters, e.g. pages_parsed or chunks_embedded"""
+        self.progress.update(counters)
+        self._notify()
+
+    def mark_running(self):
+        self.status = "running"
+        self._notify()
+
+    def mark_completed(self, result=None):
+        self.status = "completed"
+        self.stage = "done"
+        self.result = result
+        self.finished_at = datetime.now()
+        self._notify()
+
+    def mark_failed(self, error):
+        self.status = "failed"
+        self.error = str(error)
+        self.finished_at = datetime.now()
+        self._notify()
+
+    def to_dict(self):
+        """Serialize job status for the /jobs endpoint"""
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": dict(self.progress),
+            "timings": dict(self.timings),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+    def _notify(self):
+        if self._on_update:
+            self._on_update(self)
+
+class JobManager:
+    """Run ingestion jobs on a bounded thread pool and expose their status"""
+
+    def __init__(self, max_workers=2, max_pending=8, jobs_dir="jobs"):
+        self.max_pending = max_pending
+        self.jobs_dir = jobs_dir
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue ``fn(job, *args, **kwargs)`` and return the job immediately"""
+        with self.lock:
+            pending = sum(1 for job in self.jobs.values() if job.status in ("queued", "running"))
+            if pending >= self.max_pending:
+                raise JobQueueFullError(f"Ingestion queue is full ({pending} jobs pending)")
+            job = IngestJob(on_update=self._persist)
+            self.jobs[job.job_id] = job
+        self._persist(job)
+        # The job's spans continue the uploading request's trace
+        self.executor.submit(contextvars.copy_context().run, self._run, job, fn, args, kwargs)
+        logger.info(f"Queued ingestion job {job.job_id}")
+        return job
+
+    def get(self, job_id):
+        """Return job status, falling back to disk so any worker can answer"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        try:
+            with open(self._job_path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def cleanup_old_jobs(self, max_age_hours=2):
+        """Forget finished jobs older than ``max_age_hours``"""
+        cutoff_time = datetime.now() - timedelta(hours=max_age_hours)
+        with self.lock:
+            expired_jobs = [
+                job_id for job_id, job in self.jobs.items()
+                if job.finished_at and job.finished_at < cutoff_time
+            ]
+            for job_id in expired_jobs:
+                del self.jobs[job_id]
+        for filename in os.listdir(self.jobs_dir):
+            path = os.path.join(self.jobs_dir, filename)
+            try:
+                if datetime.fromtimestamp(os.path.getmtime(path)) < cutoff_time:
+                    os.remove(path)
+            except OSError:
+                continue
+
+    def _run(self, job, fn, args, kwargs):
+        job.mark_running()
+        try:
+            with span("ingest_job", job_id=job.job_id):
+                result = fn(job, *args, **kwargs)
+            job.mark_completed(result)
+            logger.info(f"Ingestion job {job.job_id} completed in {sum(job.timings.values()):.2f}s")
+        except Exception as e:
+            logger.error(f"Ingestion job {job.job_id} failed: {e}")
+            job.mark_failed(e)
+
+    def _job_path(self, job_id):
+        # Job ids are uuid hex strings; anything else cannot name a job file
+        if not job_id.isalnum():
+            job_id = "invalid"
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _persist(self, job):
+        path = self._job_path(job.job_id)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(job.to_dict(), f, default=str)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not persist job {job.job_id}: {e}")
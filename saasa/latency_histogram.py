@@ -0,0 +1,168 @@
+"""
+Fixed-size, log-bucketed latency histograms over sliding windows, merged across workers
+
+Every latency falls in one of NUM_BUCKETS buckets whose bounds grow by
+BUCKET_GROWTH (about 9% relative error at the bucket midpoint), so recording
+is O(1), memory is bounded and histograms from different gunicorn workers
+merge by adding counts. Each worker keeps one histogram per series and time
+slot, and writes the live slots to METRICS_DIR/<pid>.json at most every
+METRICS_FLUSH_SECONDS for the other workers to merge at scrape time.
+"""
+import os
+import json
+import math
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.environ.get("METRICS_DIR", "metrics")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", 5))
+# Sliding windows reported, as label -> seconds; the longest sets how long slots are kept
+LATENCY_WINDOWS = {"1m": 60, "10m": 600}
+SLOT_SECONDS = 10
+
+MIN_LATENCY = 0.001
+BUCKET_GROWTH = 2 ** 0.25
+# 1ms .. ~17 minutes; slower requests land in the last bucket
+NUM_BUCKETS = 81
+PERCENTILES = (50, 90, 99)
+
+def bucket_index(seconds):
+    if seconds <= MIN_LATENCY:
+        return 0
+    return min(NUM_BUCKETS - 1, 1 + int(math.log(seconds / MIN_LATENCY, BUCKET_GROWTH)))
+
+def bucket_value(index):
+    """Representative latency of a bucket: the geometric midpoint of its bounds"""
+    if index == 0:
+        return MIN_LATENCY
+    return MIN_LATENCY * BUCKET_GROWTH ** (index - 0.5)
+
+def summarize(counts):
+    """Count and p50/p90/p99 of a {bucket: count} histogram"""
+    total = sum(counts.values())
+    summary = {"count": total}
+    if not total:
+        return summary
+    cumulative, ordered = 0, sorted(counts.items())
+    targets = iter(PERCENTILES)
+    target = next(targets)
+    for index, count in ordered:
+        cumulative += count
+        while target is not None and cumulative >= total * target / 100:
+            summary[f"p{target}"] = round(bucket_value(index), 4)
+            target = next(targets, None)
+    return summary
+
+class WindowedHistograms:
+    """Per-series latency histograms in SLOT_SECONDS slots, kept for the longest window"""
+
+    def __init__(self, directory=METRICS_DIR):
+        self.directory = directory
+        self.slots_kept = max(LATENCY_WINDOWS.values()) // SLOT_SECONDS + 1
+        # series -> slot number -> bucket -> count
+        self.series = {}
+        self.lock = threading.Lock()
+        self.last_flush = 0.0
+        self.pid = os.getpid()
+
+    def record(self, series, seconds, now=None):
+        now = now or time.time()
+        slot = int(now // SLOT_SECONDS)
+        with self.lock:
+            if self.pid != os.getpid():
+                # Forked from a preloaded master: start this worker's own histograms
+                self.series, self.pid, self.last_flush = {}, os.getpid(), 0.0
+            slots = self.series.setdefault(series, {})
+            counts = slots.get(slot)
+            if counts is None:
+                counts = slots[slot] = {}
+                for old in [old for old in slots if old <= slot - self.slots_kept]:
+                    del slots[old]
+            index = bucket_index(seconds)
+            counts[index] = counts.get(index, 0) + 1
+            flush_due = now - self.last_flush >= METRICS_FLUSH_SECONDS
+            if flush_due:
+                self.last_flush = now
+        if flush_due:
+            self.flush(now)
+
+    def _live_slots(self, now):
+        oldest = int(now // SLOT_SECONDS) - self.slots_kept + 1
+        with self.lock:
+            return {
+                series: {slot: dict(counts) for slot, counts in slots.items() if slot >= oldest}
+                for series, slots in self.series.items()
+            }
+
+    def flush(self, now=None):
+        """Write this worker's live slots where the other workers can merge them"""
+        now = now or time.time()
+        with self.lock:
+            self.last_flush = now
+        data = {"pid": os.getpid(), "updated": now, "series": self._live_slots(now)}
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{os.getpid()}.json")
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Could not write latency histograms: {e}")
+
+    def _worker_snapshots(self, now):
+        """Live slots of every worker, including ones that exited within the longest window"""
+        snapshots = [self._live_slots(now)]
+        if not os.path.isdir(self.directory):
+            return snapshots, 1
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json") or name == f"{os.getpid()}.json":
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if now - data["updated"] > max(LATENCY_WINDOWS.values()):
+                # Nothing in it is inside any window any more
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            snapshots.append({
+                series: {int(slot): {int(index): count for index, count in counts.items()}
+                         for slot, counts in slots.items()}
+                for series, slots in data["series"].items()
+            })
+        return snapshots, len(snapshots)
+
+    def summary(self, now=None):
+        """p50/p90/p99 and counts per series and window, merged across workers"""
+        now = now or time.time()
+        self.flush(now)
+        snapshots, workers = self._worker_snapshots(now)
+        current = int(now // SLOT_SECONDS)
+
+        merged = {}
+        for snapshot in snapshots:
+            for series, slots in snapshot.items():
+                windows = merged.setdefault(series, {label: {} for label in LATENCY_WINDOWS})
+                for slot, counts in slots.items():
+                    for label, seconds in LATENCY_WINDOWS.items():
+                        if slot > current - seconds // SLOT_SECONDS:
+                            target = windows[label]
+                            for index, count in counts.items():
+                                target[index] = target.get(index, 0) + count
+
+        return {
+            "workers": workers,
+            "series": {
+                series: {label: summarize(counts) for label, counts in windows.items()}
+                for series, windows in sorted(merged.items())
+            }
+        }
@@ -0,0 +1,412 @@
+"""
+Process-wide HTTP client for the Together and Gemini APIs
+
+One pooled keep-alive session per process, a cap on concurrent calls, a
+deadline per call and retries with jittered exponential backoff on 429/5xx
+and connection errors. ``TogetherLLM`` and ``GeminiLLM`` put the chains on
+top of it; llm_streaming uses it for token streams.
+
+Run ``python llm_client.py [calls] [concurrency] [failure rate]`` to measure
+the client's latency overhead against a local stub server, compared with a
+new connection per call; tests/test_llm_client.py runs against the same stub.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.llms import LLM
+
+from prometheus_metrics import record_llm_tokens
+
+logger = logging.getLogger(__name__)
+
+TOGETHER_MODEL = "meta-llama/Llama-3-70b-chat-hf"
+TOGETHER_COMPLETIONS_URL = os.environ.get("TOGETHER_COMPLETIONS_URL", "https://api.together.xyz/v1/completions")
+GEMINI_MODEL = "gemini-1.5-flash"
+GEMINI_API_URL = os.environ.get("GEMINI_API_URL", "https://generativelanguage.googleapis.com/v1beta")
+
+# LLM calls in flight per process; more wait for a slot within their deadline.
+# Threaded/gevent workers hold many requests at once, so match their THREADS
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 100))
+# Keep-alive connections kept per API host; 0 keeps one per concurrent call
+LLM_POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", 0))
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", 5))
+# Deadline for a whole call, including queueing and retries
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 120))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 3))
+LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", 0.5))
+LLM_BACKOFF_MAX = float(os.environ.get("LLM_BACKOFF_MAX", 8))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class LLMError(Exception):
+    """An LLM call failed after its retries"""
+
+class LLMTimeoutError(LLMError):
+    """An LLM call ran past its deadline"""
+
+def backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, or the server's Retry-After when it asks for longer"""
+    delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+    try:
+        return max(delay, float(retry_after)) if retry_after else delay
+    except ValueError:
+        return delay
+
+class LLMClient:
+    """Pooled, bounded, retrying JSON-over-HTTP client shared by every LLM call in the process"""
+
+    def __init__(self, pool_size=LLM_POOL_SIZE, max_concurrency=LLM_MAX_CONCURRENCY,
+                 max_retries=LLM_MAX_RETRIES, connect_timeout=LLM_CONNECT_TIMEOUT):
+        self.pool_size = pool_size or max_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.connect_timeout = connect_timeout
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.lock = threading.Lock()
+        self._session = None
+        self._session_pid = None
+
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.seconds = 0.0
+
+    def session(self):
+        """The keep-alive session; rebuilt after a fork so workers never share sockets"""
+        with self.lock:
+            if self._session is None or self._session_pid != os.getpid():
+                session = requests.Session()
+                # Retries are ours, with deadlines and jitter, not urllib3's
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session, self._session_pid = session, os.getpid()
+            return self._session
+
+    def post_json(self, url, payload, headers=None, timeout=LLM_TIMEOUT):
+        """POST ``payload`` and return the decoded JSON response"""
+        deadline_at = time.monotonic() + timeout
+        with self._call(deadline_at):
+            response = self._send(url, payload, headers, deadline_at, stream=False)
+            return response.json()
+
+    def stream_lines(self, url, payload, headers=None, timeout=LLM_TIMEOUT):
+        """POST ``payload`` and yield the response body line by line
+
+        The connection slot is held until the stream is consumed or closed.
+        """
+        deadline_at = time.monotonic() + timeout
+        with self._call(deadline_at):
+            response = self._send(url, payload, headers, deadline_at, stream=True)
+            # SSE and JSON lines are UTF-8; requests would guess ISO-8859-1 for text/event-stream
+            response.encoding = "utf-8"
+            with response:
+                for line in response.iter_lines(decode_unicode=True):
+                    if time.monotonic() > deadline_at:
+                        raise LLMTimeoutError(f"Stream from {url} ran past its {timeout:.0f}s deadline")
+                    yield line
+
+    @contextmanager
+    def _call(self, deadline_at):
+        if not self.slots.acquire(timeout=max(0.0, deadline_at - time.monotonic())):
+            with self.lock:
+                self.failures += 1
+            raise LLMTimeoutError(f"No free LLM slot (max {self.max_concurrency} concurrent calls) before the deadline")
+        start_time = time.monotonic()
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+        try:
+            yield
+        except Exception:
+            with self.lock:
+                self.failures += 1
+            raise
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+                self.seconds += time.monotonic() - start_time
+            self.slots.release()
+
+    def _send(self, url, payload, headers, deadline_at, stream):
+        attempt = 0
+        while True:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                raise LLMTimeoutError(f"Call to {url} ran past its deadline")
+
+            retry_after = None
+            try:
+                response = self.session().post(
+                    url, json=payload, headers=headers, stream=stream,
+                    timeout=(min(self.connect_timeout, remaining), remaining)
+                )
+            except requests.Timeout as e:
+                error = LLMTimeoutError(f"Call to {url} timed out: {e}")
+            except requests.ConnectionError as e:
+                error = LLMError(f"Connection to {url} failed: {e}")
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    if response.status_code >= 400:
+                        message = response.text[:200]
+                        response.close()
+                        raise LLMError(f"{url} returned {response.status_code}: {message}")
+                    return response
+                error = LLMError(f"{url} returned {response.status_code}")
+                retry_after = response.headers.get("Retry-After")
+                response.close()
+
+            delay = backoff_delay(attempt, retry_after)
+            if attempt >= self.max_retries or time.monotonic() + delay >= deadline_at:
+                raise error
+            attempt += 1
+            with self.lock:
+                self.retries += 1
+            logger.warning(f"{error}; retry {attempt}/{self.max_retries} in {delay:.2f}s")
+            time.sleep(delay)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "failures": self.failures,
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "pool_size": self.pool_size,
+                "avg_call_seconds": self.seconds / self.calls if self.calls else None
+            }
+
+# Global LLM client
+llm_client = LLMClient()
+
+def together_payload(prompt, model, temperature, max_tokens, stop=None, stream=False):
+    payload = {
+        "model": model,
+        "prompt": prompt,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": stream
+    }
+    if stop:
+        payload["stop"] = stop
+    return payload
+
+def together_headers(api_key):
+    return {"Authorization": f"Bearer {api_key}"}
+
+def together_complete(prompt, api_key, temperature=0.7, model=TOGETHER_MODEL, max_tokens=512,
+                      stop=None, timeout=LLM_TIMEOUT):
+    """Text of one Together completion"""
+    data = llm_client.post_json(
+        TOGETHER_COMPLETIONS_URL,
+        together_payload(prompt, model, temperature, max_tokens, stop),
+        headers=together_headers(api_key),
+        timeout=timeout
+    )
+    record_together_usage(data)
+    choices = data.get("choices") or []
+    return choices[0].get("text", "") if choices else ""
+
+def record_together_usage(data):
+    usage = data.get("usage") or {}
+    record_llm_tokens("together", usage.get("prompt_tokens"), usage.get("completion_tokens"))
+
+def gemini_url(model, method):
+    return f"{GEMINI_API_URL}/models/{model}:{method}"
+
+def gemini_payload(prompt, temperature, stop=None):
+    config = {"temperature": temperature}
+    if stop:
+        config["stopSequences"] = stop
+    return {"contents": [{"parts": [{"text": prompt}]}], "generationConfig": config}
+
+def gemini_headers(api_key):
+    return {"x-goog-api-key": api_key}
+
+def gemini_text(data):
+    """Concatenated text parts of a generateContent response"""
+    candidates = data.get("candidates") or []
+    if not candidates:
+        return ""
+    parts = candidates[0].get("content", {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts)
+
+def gemini_complete(prompt, api_key, temperature=0.7, model=GEMINI_MODEL, stop=None, timeout=LLM_TIMEOUT):
+    """Text of one Gemini generateContent call (REST, so it shares the pooled session)"""
+    data = llm_client.post_json(
+        gemini_url(model, "generateContent"),
+        gemini_payload(prompt, temperature, stop),
+        headers=gemini_headers(api_key),
+        timeout=timeout
+    )
+    record_gemini_usage(data)
+    return gemini_text(data)
+
+def record_gemini_usage(data):
+    usage = data.get("usageMetadata") or {}
+    record_llm_tokens("gemini", usage.get("promptTokenCount"), usage.get("candidatesTokenCount"))
+
+class TogetherLLM(LLM):
+    """Together completions through the shared client"""
+
+    together_api_key: str
+    model: str = TOGETHER_MODEL
+    temperature: float = 0.7
+    max_tokens: int = 512
+    timeout: float = LLM_TIMEOUT
+
+    @property
+    def _llm_type(self) -> str:
+        return "together"
+
+    def _call(
+        self, prompt: str, stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any
+    ) -> str:
+        return together_complete(
+            prompt, self.together_api_key, temperature=self.temperature, model=self.model,
+            max_tokens=self.max_tokens, stop=stop, timeout=self.timeout
+        )
+
+class GeminiLLM(LLM):
+    """Gemini generateContent through the shared client; ``prompt_template`` wraps the chain's prompt"""
+
+    gemini_api_key: str
+    model: str = GEMINI_MODEL
+    temperature: float = 0.7
+    prompt_template: str = "{prompt}"
+    timeout: float = LLM_TIMEOUT
+
+    @property
+    def _llm_type(self) -> str:
+        return "gemini"
+
+    def _call(
+        self, prompt: str, stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any
+    ) -> str:
+        return gemini_complete(
+            self.prompt_template.format(prompt=prompt), self.gemini_api_key,
+            temperature=self.temperature, model=self.model, stop=stop, timeout=self.timeout
+        )
+
+def run_stub_server(delay=0.0, failure_rate=0.0, statuses=()):
+    """Local Together-compatible completions endpoint answering after ``delay`` seconds
+
+    The first requests get ``statuses`` in order (e.g. 503, 429), later ones
+    200 or, with ``failure_rate``, a random 429. The server counts requests,
+    connections and the most requests it held at once, for the tests.
+    """
+    import socket
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    scripted = list(statuses)
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        # HTTP/1.1 so clients can keep connections alive
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            # Headers and body go out in separate writes; without this Nagle's
+            # algorithm would add delayed-ACK stalls to every kept-alive call
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with lock:
+                server.connections += 1
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            with lock:
+                server.requests += 1
+                server.in_flight += 1
+                server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                status = scripted.pop(0) if scripted else None
+            try:
+                time.sleep(delay)
+            finally:
+                with lock:
+                    server.in_flight -= 1
+            if status is None:
+                status = 429 if random.random() < failure_rate else 200
+            if status == 200:
+                body = json.dumps({
+                    "choices": [{"text": "stub answer"}],
+                    "usage": {"prompt_tokens": 100, "completion_tokens": 2}
+                }).encode()
+            else:
+                body = json.dumps({"error": f"stub status {status}"}).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.requests = server.connections = server.in_flight = server.max_in_flight = 0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/v1/completions"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def _measure(call, calls, concurrency):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def timed(_):
+        start_time = time.monotonic()
+        try:
+            call()
+            return time.monotonic() - start_time, True
+        except Exception:
+            return time.monotonic() - start_time, False
+
+    start_time = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(timed, range(calls)))
+    elapsed = time.monotonic() - start_time
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "calls": calls,
+        "errors": sum(1 for _, ok in results if not ok),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+        "calls_per_second": round(calls / elapsed, 1)
+    }
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    failure_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+    stub_delay = 0.005
+
+    server = run_stub_server(stub_delay, failure_rate)
+    url = server.url
+    payload = together_payload("ping", TOGETHER_MODEL, 0.7, 16)
+    client = LLMClient(max_concurrency=concurrency)
+
+    reports = {
+        "stub_delay_ms": stub_delay * 1000,
+        "new_connection_per_call": _measure(
+            lambda: requests.post(url, json=payload, timeout=10).raise_for_status(), calls, concurrency
+        ),
+        "pooled_client": _measure(lambda: client.post_json(url, payload, timeout=10), calls, concurrency),
+        "pooled_client_stats": client.stats()
+    }
+    server.shutdown()
+    print(json.dumps(reports, indent=2))
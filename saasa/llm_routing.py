@@ -0,0 +1,231 @@
+"""
+Latency-aware routing between LLM providers, with optional hedged requests
+
+Every call's latency and outcome is recorded per provider in a rolling
+window. Each query goes to the healthy provider with the lowest p50; a
+provider whose error rate crosses LLM_ROUTER_MAX_ERROR_RATE sits out for
+LLM_ROUTER_COOLDOWN seconds. With LLM_HEDGE_DELAY set, a second provider is
+asked too if the first has not answered within the delay, and the first
+answer wins.
+"""
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.llms import LLM
+
+from llm_client import TogetherLLM, GeminiLLM, LLM_MAX_CONCURRENCY
+from prometheus_metrics import stage_timer
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Calls per provider kept for latency percentiles and error rate
+LLM_ROUTER_WINDOW = int(os.environ.get("LLM_ROUTER_WINDOW", 100))
+LLM_ROUTER_MIN_SAMPLES = int(os.environ.get("LLM_ROUTER_MIN_SAMPLES", 5))
+LLM_ROUTER_MAX_ERROR_RATE = float(os.environ.get("LLM_ROUTER_MAX_ERROR_RATE", 0.5))
+LLM_ROUTER_COOLDOWN = float(os.environ.get("LLM_ROUTER_COOLDOWN", 30))
+# Seconds before a hedged second request: 0 disables hedging, "auto" uses the first provider's p95
+LLM_HEDGE_DELAY = os.environ.get("LLM_HEDGE_DELAY", "0").lower()
+
+class ProviderStats:
+    """Rolling latency and error window for one provider"""
+
+    def __init__(self, window=LLM_ROUTER_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.unhealthy_until = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, seconds, ok):
+        with self.lock:
+            self.samples.append((seconds, ok))
+            errors = sum(1 for _, success in self.samples if not success)
+            if (len(self.samples) >= LLM_ROUTER_MIN_SAMPLES
+                    and errors / len(self.samples) > LLM_ROUTER_MAX_ERROR_RATE):
+                self.unhealthy_until = time.monotonic() + LLM_ROUTER_COOLDOWN
+                # Start the next probe from a clean window
+                self.samples.clear()
+
+    def healthy(self):
+        return time.monotonic() >= self.unhealthy_until
+
+    def percentile(self, q):
+        with self.lock:
+            latencies = [seconds for seconds, ok in self.samples if ok]
+        return float(np.percentile(latencies, q)) if latencies else None
+
+    def error_rate(self):
+        with self.lock:
+            total = len(self.samples)
+            errors = sum(1 for _, ok in self.samples if not ok)
+        return errors / total if total else 0.0
+
+    def stats(self):
+        with self.lock:
+            total = len(self.samples)
+        return {
+            "samples": total,
+            "error_rate": self.error_rate(),
+            "p50_seconds": self.percentile(50),
+            "p95_seconds": self.percentile(95),
+            "healthy": self.healthy()
+        }
+
+class ProviderRouter:
+    """Ranks providers by health and latency and runs (possibly hedged) calls across them"""
+
+    def __init__(self, hedge_delay=LLM_HEDGE_DELAY):
+        self.hedge_delay = hedge_delay
+        self.providers = {}
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix="llm-router")
+
+    def provider_stats(self, name):
+        with self.lock:
+            if name not in self.providers:
+                self.providers[name] = ProviderStats()
+            return self.providers[name]
+
+    def rank(self, names):
+        """``names`` in routing order: healthy before unhealthy, then fastest expected answer, then given order
+
+        The expected answer time is p50 divided by the success rate, so a
+        provider that keeps failing sorts behind slower ones that answer, and
+        one with only failures sorts last even before it is marked unhealthy.
+        """
+        def key(item):
+            position, name = item
+            stats = self.provider_stats(name)
+            p50, error_rate = stats.percentile(50), stats.error_rate()
+            if error_rate >= 1.0:
+                expected = float("inf")
+            elif p50 is None:
+                # No samples yet: rank as fastest so it gets measured
+                expected = 0.0
+            else:
+                expected = p50 / (1.0 - error_rate)
+            return (not stats.healthy(), expected, position)
+        return [name for _, name in sorted(enumerate(names), key=key)]
+
+    def call(self, providers, fn):
+        """Run ``fn(name, provider)`` on the best provider, hedging or failing over to the next ones
+
+        ``providers`` maps name to provider, in preference order. Returns the
+        first successful result; raises the last error if every provider fails.
+        """
+        pending = self.rank(list(providers))
+        running, submitted = {}, []
+        error = None
+
+        def submit():
+            name = pending.pop(0)
+            # Carry the caller's trace over to the pool thread
+            context = contextvars.copy_context()
+            future = self.executor.submit(context.run, self._timed, name, fn, providers[name])
+            running[future] = name
+            submitted.append(future)
+
+        submit()
+        while running:
+            timeout = self._hedge_delay(running) if pending else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                with self.lock:
+                    self.hedges += 1
+                logger.info(f"No answer from {'/'.join(running.values())} yet, hedging with {pending[0]}")
+                submit()
+                continue
+
+            for future in done:
+                name = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"LLM provider {name} failed: {e}")
+                    error = e
+                    continue
+                if future is not submitted[0] and running:
+                    with self.lock:
+                        self.hedge_wins += 1
+                # A slower request still in flight finishes in the background and only updates its stats
+                return result
+
+            if pending and not running:
+                with self.lock:
+                    self.failovers += 1
+                logger.info(f"Failing over to {pending[0]}")
+                submit()
+
+        raise error
+
+    def _hedge_delay(self, running):
+        """Seconds to wait for the in-flight request before hedging, or None to wait for it"""
+        if self.hedge_delay in ("", "0", "off", "false"):
+            return None
+        if self.hedge_delay == "auto":
+            # Unknown latency: no hedge until the provider has a p95
+            return self.provider_stats(next(iter(running.values()))).percentile(95)
+        return float(self.hedge_delay)
+
+    def _timed(self, name, fn, provider):
+        start_time = time.monotonic()
+        try:
+            with span(f"llm.{name}"):
+                result = fn(name, provider)
+        except Exception:
+            self.provider_stats(name).record(time.monotonic() - start_time, False)
+            raise
+        self.provider_stats(name).record(time.monotonic() - start_time, True)
+        return result
+
+    def stats(self):
+        with self.lock:
+            names = list(self.providers)
+            counters = {"hedges": self.hedges, "hedge_wins": self.hedge_wins, "failovers": self.failovers}
+        return {
+            "hedge_delay": self.hedge_delay,
+            **counters,
+            "providers": {name: self.provider_stats(name).stats() for name in names}
+        }
+
+# Global provider router
+router = ProviderRouter()
+
+class RoutedLLM(LLM):
+    """LLM that sends each prompt to the router's choice among ``providers`` (name -> LLM)"""
+
+    providers: dict
+
+    @property
+    def _llm_type(self) -> str:
+        return "routed"
+
+    def _call(
+        self, prompt: str, stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any
+    ) -> str:
+        with stage_timer("llm_call"):
+            return router.call(self.providers, lambda name, llm: llm.invoke(prompt, stop=stop))
+
+def llm_providers(temperature=0.7, gemini_prompt_template="{prompt}"):
+    """Configured providers in preference order: Together first, Gemini as fallback"""
+    providers = {}
+    together_api_key = os.environ.get("TOGETHER_API_KEY")
+    gemini_api_key = os.environ.get("GEMINI_API_KEY")
+    if together_api_key:
+        providers["together"] = TogetherLLM(together_api_key=together_api_key, temperature=temperature)
+    if gemini_api_key:
+        providers["gemini"] = GeminiLLM(
+            gemini_api_key=gemini_api_key, temperature=temperature, prompt_template=gemini_prompt_template
+        )
+    return providers
@@ -0,0 +1,149 @@
+"""
+Token streaming from the Together and Gemini back ends as Server-Sent Events
+"""
+import os
+import json
+import logging
+
+from llm_client import (
+    llm_client, together_payload, together_headers, gemini_url, gemini_payload, gemini_headers, gemini_text,
+    record_together_usage, record_gemini_usage, TOGETHER_MODEL, TOGETHER_COMPLETIONS_URL, GEMINI_MODEL
+)
+from llm_routing import router
+from hybrid_retrieval import retrieval_timer
+
+logger = logging.getLogger(__name__)
+
+# Same wording as the "stuff" chain's default prompt so streamed and
+# non-streamed answers stay consistent
+QA_PROMPT = """Use the following pieces of context to answer the question at the end. If you don't know the answer, just say that you don't know, don't try to make up an answer.
+
+{context}
+
+Question: {question}
+Helpful Answer:"""
+
+def sse_event(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def build_prompt(query, docs):
+    """Stuff retrieved documents into the QA prompt"""
+    context = "\n\n".join(doc.page_content for doc in docs)
+    return QA_PROMPT.format(context=context, question=query)
+
+def stream_together(prompt, api_key, temperature=0.7, model=TOGETHER_MODEL, max_tokens=512):
+    """Yield text chunks from Together's streaming completions API"""
+    lines = llm_client.stream_lines(
+        TOGETHER_COMPLETIONS_URL,
+        together_payload(prompt, model, temperature, max_tokens, stream=True),
+        headers=together_headers(api_key)
+    )
+    # Token usage arrives with the last chunk
+    last = {}
+    for line in lines:
+        if not line or not line.startswith("data:"):
+            continue
+        payload = line[len("data:"):].strip()
+        if payload == "[DONE]":
+            lines.close()
+            break
+        last = json.loads(payload)
+        choices = last.get("choices") or []
+        text = choices[0].get("text") if choices else None
+        if text:
+            yield text
+    record_together_usage(last)
+
+def stream_gemini(prompt, api_key, temperature=0.7, model=GEMINI_MODEL):
+    """Yield text chunks from Gemini's streamGenerateContent (server-sent events)"""
+    lines = llm_client.stream_lines(
+        gemini_url(model, "streamGenerateContent") + "?alt=sse",
+        gemini_payload(prompt, temperature),
+        headers=gemini_headers(api_key)
+    )
+    # Every event carries the usage so far
+    last = {}
+    for line in lines:
+        if not line or not line.startswith("data:"):
+            continue
+        last = json.loads(line[len("data:"):])
+        text = gemini_text(last)
+        if text:
+            yield text
+    record_gemini_usage(last)
+
+def stream_providers():
+    """Configured providers in the router's order: healthy and fastest first"""
+    providers = []
+    together_api_key = os.environ.get("TOGETHER_API_KEY")
+    gemini_api_key = os.environ.get("GEMINI_API_KEY")
+    if together_api_key:
+        providers.append(("together", stream_together, together_api_key))
+    if gemini_api_key:
+        providers.append(("gemini", stream_gemini, gemini_api_key))
+    order = router.rank([name for name, _, _ in providers])
+    return sorted(providers, key=lambda provider: order.index(provider[0]))
+
+def sources_event(docs):
+    return sse_event("sources", [
+        {"content": doc.page_content[:200] + "...", "metadata": doc.metadata}
+        for doc in docs
+    ])
+
+def replay_answer(result, cached=True, coalesced=False):
+    """Yield a finished chain result as the same events a live stream sends, the answer as one token"""
+    yield sources_event(result.get("source_documents", []))
+    yield sse_event("token", {"text": result.get("result", "No response generated")})
+    yield sse_event("done", {"provider": None, "cached": cached, "coalesced": coalesced})
+
+def stream_answer(retriever, query, temperature=0.7, gemini_prompt_template="{prompt}", on_answer=None):
+    """Yield SSE events: retrieved sources first, then answer tokens, then done
+
+    A provider that fails before producing any token is skipped in favour of
+    the next one; once tokens have been sent the error is reported instead.
+    ``gemini_prompt_template`` wraps the prompt sent to Gemini, as it does for
+    the chain's GeminiLLM. A complete answer is passed to
+    ``on_answer(docs, text)`` before done is sent, e.g. to cache it.
+    """
+    try:
+        docs = retriever.invoke(query, config={"callbacks": [retrieval_timer]})
+    except Exception as e:
+        logger.error(f"Retrieval failed: {e}")
+        yield sse_event("error", {"error": f"Retrieval error: {str(e)}"})
+        return
+
+    yield sources_event(docs)
+
+    providers = stream_providers()
+    if not providers:
+        yield sse_event("error", {"error": "No valid API key found"})
+        return
+
+    prompt = build_prompt(query, docs)
+    for name, stream_fn, api_key in providers:
+        sent_tokens = False
+        chunks = []
+        provider_prompt = gemini_prompt_template.format(prompt=prompt) if name == "gemini" else prompt
+        try:
+            logger.info(f"Streaming answer from {name}...")
+            for text in stream_fn(provider_prompt, api_key, temperature=temperature):
+                sent_tokens = True
+                chunks.append(text)
+                yield sse_event("token", {"text": text})
+            if on_answer is not None:
+                try:
+                    on_answer(docs, "".join(chunks))
+                except Exception as e:
+                    logger.warning(f"Could not keep streamed answer: {e}")
+            yield sse_event("done", {"provider": name, "cached": False, "coalesced": False})
+            return
+        except Exception as e:
+            logger.error(f"Streaming from {name} failed: {e}")
+            # Only failures count towards routing; stream duration depends on the client reading it
+            router.provider_stats(name).record(0.0, False)
+            if sent_tokens:
+                yield sse_event("error", {"error": f"Streaming error: {str(e)}"})
+                return
+
+    yield sse_event("error", {"error": "All LLM providers failed"})
@@ -0,0 +1,156 @@
+"""
+Concurrency vs latency load test for the query path
+
+``python load_test.py URL [concurrency levels] [requests per level]`` posts
+the same query to URL at each concurrency level (default 1,10,50,100) and
+prints p50/p95 latency and throughput per level, e.g.
+
+    python load_test.py http://localhost:5000/query 1,10,50,100,200
+
+``python load_test.py --demo`` runs the comparison without API keys or
+documents: a local stub answers LLM calls after LOAD_TEST_LLM_DELAY seconds,
+and a small app that sends each query through the shared LLM client is
+served with gunicorn.conf.py by two sync workers (the old setup), then two
+gthread and, if installed, two gevent workers.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+LOAD_TEST_QUERY = os.environ.get("LOAD_TEST_QUERY", "What are the key findings?")
+LOAD_TEST_LLM_DELAY = float(os.environ.get("LOAD_TEST_LLM_DELAY", 0.5))
+
+# Environment for gunicorn.conf.py per worker type (THREADS > 1 would turn sync into gthread)
+DEMO_WORKER_CONFIGS = [
+    ("sync", {"WORKER_CLASS": "sync", "THREADS": "1"}),
+    ("gthread", {"WORKER_CLASS": "gthread", "THREADS": "100"}),
+    ("gevent", {"WORKER_CLASS": "gevent", "WORKER_CONNECTIONS": "1000"}),
+]
+
+def run_level(url, concurrency, num_requests, payload):
+    """Fire ``num_requests`` POSTs with ``concurrency`` in flight; latency percentiles and throughput"""
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_maxsize=concurrency))
+    session.mount("https://", HTTPAdapter(pool_maxsize=concurrency))
+
+    def one(_):
+        start_time = time.monotonic()
+        try:
+            ok = session.post(url, json=payload, timeout=300).status_code < 400
+        except requests.RequestException:
+            ok = False
+        return time.monotonic() - start_time, ok
+
+    start_time = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(one, range(num_requests)))
+    elapsed = time.monotonic() - start_time
+
+    latencies = np.array([latency for latency, _ in results])
+    return {
+        "concurrency": concurrency,
+        "requests": num_requests,
+        "errors": sum(1 for _, ok in results if not ok),
+        "p50_seconds": round(float(np.percentile(latencies, 50)), 3),
+        "p95_seconds": round(float(np.percentile(latencies, 95)), 3),
+        "requests_per_second": round(num_requests / elapsed, 1)
+    }
+
+def sweep(url, levels, requests_per_level=None, payload=None):
+    payload = payload or {"query": LOAD_TEST_QUERY}
+    reports = []
+    for concurrency in levels:
+        report = run_level(url, concurrency, requests_per_level or max(concurrency, 10), payload)
+        print(json.dumps(report), flush=True)
+        reports.append(report)
+    return reports
+
+def create_demo_app():
+    """Minimal /query and /health app whose queries wait on the LLM through the shared client"""
+    from flask import Flask, request, jsonify
+    from llm_client import TogetherLLM
+
+    app = Flask(__name__)
+    llm = TogetherLLM(together_api_key="load-test")
+
+    @app.route("/query", methods=["POST"])
+    def query():
+        return jsonify({"response": llm.invoke(request.get_json()["query"])})
+
+    @app.route("/health")
+    def health():
+        return jsonify({"status": "healthy"})
+
+    return app
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _wait_until_up(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            requests.get(url, timeout=1)
+            return True
+        except requests.RequestException:
+            time.sleep(0.2)
+    return False
+
+def demo(levels, requests_per_level=None):
+    from llm_client import run_stub_server
+
+    stub = run_stub_server(LOAD_TEST_LLM_DELAY, 0.0)
+    env = dict(
+        os.environ,
+        TOGETHER_COMPLETIONS_URL=stub.url,
+        LLM_MAX_CONCURRENCY="1000"
+    )
+    results = {"llm_delay_seconds": LOAD_TEST_LLM_DELAY}
+    for name, worker_env in DEMO_WORKER_CONFIGS:
+        if name == "gevent":
+            try:
+                import gevent  # noqa: F401
+            except ImportError:
+                continue
+        port = _free_port()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+             "--workers", "2", "--log-level", "warning", "load_test:create_demo_app()"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=dict(env, **worker_env)
+        )
+        try:
+            if not _wait_until_up(f"http://127.0.0.1:{port}/health", process):
+                results[name] = {"error": "gunicorn did not start"}
+                continue
+            print(f"-- {name} workers", flush=True)
+            results[name] = sweep(f"http://127.0.0.1:{port}/query", levels, requests_per_level)
+        finally:
+            process.terminate()
+            process.wait()
+    stub.shutdown()
+    return results
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    levels = [int(level) for level in args[1].split(",")] if len(args) > 1 else [1, 10, 50, 100]
+    requests_per_level = int(args[2]) if len(args) > 2 else None
+    if not args:
+        print(__doc__)
+        sys.exit(1)
+    if args[0] == "--demo":
+        print(json.dumps(demo(levels, requests_per_level), indent=2))
+    else:
+        sweep(args[0], levels, requests_per_level)
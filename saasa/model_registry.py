@@ -0,0 +1,106 @@
+"""
+Process-wide registry of embedding models shared by every RAG server
+"""
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = os.environ.get(
+    "EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"
+)
+# Chunks per forward pass; 0 threads leaves the runtime's default (all cores)
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 64))
+EMBED_THREADS = int(os.environ.get("EMBED_THREADS", 0))
+# "torch" (sentence-transformers) or "onnx" (ONNX Runtime, int8 quantized)
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch").lower()
+
+_thread_count = EMBED_THREADS
+
+def set_embedding_threads(num_threads=None):
+    """Set the inference thread count for this process and for models loaded later"""
+    global _thread_count
+    if num_threads is not None:
+        _thread_count = num_threads
+    if _thread_count <= 0:
+        return
+    try:
+        import torch
+        torch.set_num_threads(_thread_count)
+    except ImportError:
+        pass
+
+def embedding_threads():
+    """Configured inference thread count; 0 means the runtime's default"""
+    return _thread_count
+
+class ModelRegistry:
+    """Load each embedding model once per process and hand out the same instance"""
+
+    def __init__(self):
+        self._models = {}
+        self._load_times = {}
+        self.lock = threading.Lock()
+
+    def get_embeddings(self, model_name=None):
+        """Return the shared embeddings object for ``model_name``, loading it on first use"""
+        model_name = model_name or DEFAULT_EMBEDDING_MODEL
+        model = self._models.get(model_name)
+        if model is not None:
+            return model
+
+        with self.lock:
+            # Another thread may have finished loading while we waited
+            if model_name not in self._models:
+                logger.info(f"Loading embedding model: {model_name} ({EMBEDDING_BACKEND})")
+                start_time = time.time()
+                self._models[model_name] = self._load(model_name)
+                self._load_times[model_name] = time.time() - start_time
+                logger.info(f"Loaded {model_name} in {self._load_times[model_name]:.2f}s")
+            return self._models[model_name]
+
+    def _load(self, model_name):
+        if EMBEDDING_BACKEND == "onnx":
+            from onnx_embeddings import OnnxEmbeddings
+            return OnnxEmbeddings(model_name, batch_size=EMBED_BATCH_SIZE, num_threads=_thread_count)
+
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
+        set_embedding_threads()
+        return HuggingFaceEmbeddings(
+            model_name=model_name,
+            encode_kwargs={"batch_size": EMBED_BATCH_SIZE}
+        )
+
+    def preload(self, model_names=None):
+        """Eagerly load models, e.g. in the gunicorn master before workers fork"""
+        for model_name in model_names or [DEFAULT_EMBEDDING_MODEL]:
+            try:
+                self.get_embeddings(model_name)
+            except Exception as e:
+                logger.error(f"Failed to preload embedding model {model_name}: {e}")
+
+    def is_loaded(self, model_name=None):
+        """Check whether a model is already resident in this process"""
+        return (model_name or DEFAULT_EMBEDDING_MODEL) in self._models
+
+    def loaded_models(self):
+        """Return loaded model names with their load times in seconds"""
+        return dict(self._load_times)
+
+# Global registry
+registry = ModelRegistry()
+
+def backend_tag():
+    """Tag distinguishing non-default backends' vectors in the embedding cache, or None"""
+    return "onnx-int8" if EMBEDDING_BACKEND == "onnx" else None
+
+def get_embeddings(model_name=None):
+    """Get the shared embeddings object for a model"""
+    return registry.get_embeddings(model_name)
+
+def preload_embeddings(model_names=None):
+    """Preload embedding models into the shared registry"""
+    registry.preload(model_names)
@@ -1,48 +1,140 @@
 """
 Monitoring and metrics collection for production deployment
 """
+import os
 import time
 import psutil
 import logging
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import request, jsonify, g
+from flask import request, jsonify, g, Response
 import json
+import threading
+
+from latency_histogram import WindowedHistograms
+from prometheus_metrics import PROMETHEUS_AVAILABLE, exposition
+from tracing import new_request_id, start_trace, end_trace, exporter as trace_exporter
 
 logger = logging.getLogger(__name__)
 
+# Seconds between background CPU/memory/disk samples; health checks read the latest one
+HEALTH_SAMPLE_INTERVAL = float(os.environ.get("HEALTH_SAMPLE_INTERVAL", 5))
+
+class SystemSampler:
+    """Background thread refreshing CPU, memory and disk usage every ``interval`` seconds
+
+    Readers get the cached sample, so a health probe never waits on psutil.
+    CPU is the average over the last interval, measured between samples
+    rather than by sleeping. The thread is started on first use in each
+    process, so workers forked from a preloaded master run their own.
+    """
+
+    def __init__(self, interval=HEALTH_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.sample = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def _take_sample(self):
+        memory = psutil.virtual_memory()
+        self.sample = {
+            'cpu_percent': psutil.cpu_percent(),
+            'memory_percent': memory.percent,
+            'memory_available_gb': memory.available / (1024**3),
+            'disk_percent': psutil.disk_usage('/').percent,
+            'sampled_at': time.time()
+        }
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self._take_sample()
+            except Exception as e:
+                logger.error(f"System sampling failed: {e}")
+
+    def start(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            # cpu_percent measures from its previous call; this first one only sets the baseline
+            self._take_sample()
+            threading.Thread(target=self._run, name="system-sampler", daemon=True).start()
+
+    def snapshot(self):
+        """Latest sample plus its age in seconds"""
+        self.start()
+        sample = dict(self.sample)
+        sample['age_seconds'] = round(time.time() - sample.pop('sampled_at'), 3)
+        return sample
+
+# Global system sampler
+system_sampler = SystemSampler()
+
+def route_label(status_code):
+    """Histogram series for the current request: method, route rule (not raw path) and status class"""
+    rule = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    return f"{request.method} {rule} {status_code // 100}xx"
+
 class MetricsCollector:
     """Collect application metrics"""
     
     def __init__(self):
         self.request_count = 0
         self.error_count = 0
-        self.response_times = []
+        self.total_response_time = 0.0
+        self.latency = WindowedHistograms()
         self.start_time = datetime.now()
+        self.sources = {}
+        self.lock = threading.Lock()
     
-    def record_request(self, response_time, status_code):
-        """Record a request"""
-        self.request_count += 1
-        self.response_times.append(response_time)
-        
-        if status_code >= 400:
-            self.error_count += 1
+    def record_request(self, response_time, status_code, series=None):
+        """Record a request; ``series`` names its latency histogram (route and status class)"""
+        with self.lock:
+            self.request_count += 1
+            self.total_response_time += response_time
+            if status_code >= 400:
+                self.error_count += 1
+        self.latency.record(series or f"{status_code // 100}xx", response_time)
     
-    def get_metrics(self):
-        """Get current metrics"""
+    def register_source(self, name, callback):
+        """Include ``callback()`` under ``name`` in every metrics snapshot"""
+        self.sources[name] = callback
+    
+    def request_stats(self):
+        """Uptime and request counters only: cheap enough for every health probe"""
         uptime = datetime.now() - self.start_time
-        avg_response_time = sum(self.response_times) / len(self.response_times) if self.response_times else 0
-        
+        with self.lock:
+            request_count, error_count = self.request_count, self.error_count
+            avg_response_time = self.total_response_time / request_count if request_count else 0
         return {
             'uptime_seconds': uptime.total_seconds(),
-            'request_count': self.request_count,
-            'error_count': self.error_count,
-            'error_rate': self.error_count / self.request_count if self.request_count > 0 else 0,
-            'avg_response_time': avg_response_time,
-            'system_cpu': psutil.cpu_percent(),
-            'system_memory': psutil.virtual_memory().percent,
-            'system_disk': psutil.disk_usage('/').percent
+            'request_count': request_count,
+            'error_count': error_count,
+            'error_rate': error_count / request_count if request_count > 0 else 0,
+            'avg_response_time': avg_response_time
+        }
+    
+    def get_metrics(self):
+        """Get current metrics"""
+        system = system_sampler.snapshot()
+        snapshot = {
+            **self.request_stats(),
+            'latency': self.latency.summary(),
+            'system_cpu': system['cpu_percent'],
+            'system_memory': system['memory_percent'],
+            'system_disk': system['disk_percent']
         }
+        
+        for name, callback in self.sources.items():
+            try:
+                snapshot[name] = callback()
+            except Exception as e:
+                logger.error(f"Metrics source {name} failed: {e}")
+                snapshot[name] = {'error': str(e)}
+        
+        return snapshot
 
 # Global metrics collector
 metrics = MetricsCollector()
@@ -59,7 +151,7 @@ def monitor_request(f):
             
             # Record metrics
             status_code = getattr(response, 'status_code', 200) if hasattr(response, 'status_code') else 200
-            metrics.record_request(response_time, status_code)
+            metrics.record_request(response_time, status_code, route_label(status_code))
             
             # Log request
             logger.info(f"Request: {request.method} {request.path} - {status_code} - {response_time:.3f}s")
@@ -68,7 +160,7 @@ def monitor_request(f):
             
         except Exception as e:
             response_time = time.time() - start_time
-            metrics.record_request(response_time, 500)
+            metrics.record_request(response_time, 500, route_label(500))
             
             logger.error(f"Request error: {request.method} {request.path} - {str(e)}")
             raise
@@ -102,21 +194,16 @@ def log_performance(f):
     return decorated_function
 
 def health_check():
-    """Comprehensive health check"""
+    """Comprehensive health check, from the cached system sample and in-memory counters"""
     try:
-        # System metrics
-        cpu_percent = psutil.cpu_percent(interval=1)
-        memory = psutil.virtual_memory()
-        disk = psutil.disk_usage('/')
-        
-        # Application metrics
-        app_metrics = metrics.get_metrics()
+        system = system_sampler.snapshot()
+        app_metrics = metrics.request_stats()
         
         # Determine health status
         is_healthy = (
-            cpu_percent < 80 and
-            memory.percent < 80 and
-            disk.percent < 90 and
+            system['cpu_percent'] < 80 and
+            system['memory_percent'] < 80 and
+            system['disk_percent'] < 90 and
             app_metrics['error_rate'] < 0.1
         )
         
@@ -126,12 +213,7 @@ def health_check():
             'status': status,
             'timestamp': datetime.now().isoformat(),
             'uptime_seconds': app_metrics['uptime_seconds'],
-            'system': {
-                'cpu_percent': cpu_percent,
-                'memory_percent': memory.percent,
-                'disk_percent': disk.percent,
-                'memory_available_gb': memory.available / (1024**3)
-            },
+            'system': system,
             'application': {
                 'request_count': app_metrics['request_count'],
                 'error_count': app_metrics['error_count'],
@@ -148,36 +230,80 @@ def health_check():
             'timestamp': datetime.now().isoformat()
         }
 
-def setup_monitoring(app):
-    """Setup monitoring for the Flask app"""
+def setup_monitoring(app, register_health=True, readiness_check=None):
+    """Setup monitoring for the Flask app
+    
+    ``/health/live`` answers as long as the worker can serve requests;
+    ``/health/ready`` returns 503 until ``readiness_check()`` returns
+    ``(True, details)``, e.g. once the embedding model is loaded.
+    """
+    system_sampler.start()
+    metrics.register_source('tracing', trace_exporter.stats)
     
     @app.before_request
     def before_request():
         g.start_time = time.time()
+        # Keep the caller's id so logs and traces line up across services
+        g.request_id = request.headers.get('X-Request-ID') or new_request_id()
+        rule = request.url_rule.rule if request.url_rule is not None else request.path
+        g.trace = start_trace(f"{request.method} {rule}", g.request_id, path=request.path)
     
     @app.after_request
     def after_request(response):
+        response_time = 0.0
         if hasattr(g, 'start_time'):
             response_time = time.time() - g.start_time
-            metrics.record_request(response_time, response.status_code)
+            metrics.record_request(response_time, response.status_code, route_label(response.status_code))
+        
+        trace = g.get('trace')
+        if trace is not None:
+            trace[0].attributes['status_code'] = response.status_code
         
         # Add monitoring headers
         response.headers['X-Response-Time'] = f"{response_time:.3f}s"
-        response.headers['X-Request-ID'] = request.headers.get('X-Request-ID', 'unknown')
+        response.headers['X-Request-ID'] = g.get('request_id') or new_request_id()
         
         return response
     
+    @app.teardown_request
+    def teardown_request(error):
+        end_trace(g.pop('trace', None), error)
+    
     @app.route('/metrics')
     def get_metrics():
         """Get application metrics"""
         return jsonify(metrics.get_metrics())
     
-    @app.route('/health')
-    def health():
-        """Health check endpoint"""
-        health_data = health_check()
-        status_code = 200 if health_data['status'] == 'healthy' else 503
-        return jsonify(health_data), status_code
+    @app.route('/metrics/prometheus')
+    def get_prometheus_metrics():
+        """RAG stage timings, LLM tokens and index sizes from every worker, in Prometheus text format"""
+        if not PROMETHEUS_AVAILABLE:
+            return jsonify({'error': 'prometheus_client is not installed'}), 503
+        body, content_type = exposition()
+        return Response(body, content_type=content_type)
+    
+    @app.route('/health/live')
+    def liveness():
+        """Liveness probe: no dependencies checked, so a slow backend never gets the worker restarted"""
+        return jsonify({'status': 'alive', 'timestamp': datetime.now().isoformat()})
+    
+    @app.route('/health/ready')
+    def readiness():
+        """Readiness probe: whether this worker can answer queries yet"""
+        ready, details = readiness_check() if readiness_check else (True, {})
+        return jsonify({
+            'status': 'ready' if ready else 'not_ready',
+            'timestamp': datetime.now().isoformat(),
+            **details
+        }), 200 if ready else 503
+    
+    if register_health:
+        @app.route('/health')
+        def health():
+            """Health check endpoint"""
+            health_data = health_check()
+            status_code = 200 if health_data['status'] == 'healthy' else 503
+            return jsonify(health_data), status_code
 
 class PerformanceLogger:
     """Performance logging utility"""
@@ -0,0 +1,187 @@
+"""
+Sentence-transformers embeddings on ONNX Runtime with int8 dynamic quantization
+
+Select with EMBEDDING_BACKEND=onnx. The first load exports the model's
+transformer to ONNX, quantizes it and caches the result under
+ONNX_MODEL_DIR; later loads (and other workers) only read the cached files.
+
+Parity with HuggingFaceEmbeddings is covered by tests/test_onnx_embeddings.py;
+``python onnx_embeddings.py <model>`` runs the same check for another model.
+"""
+import os
+import sys
+import json
+import logging
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+ONNX_MODEL_DIR = os.environ.get("ONNX_MODEL_DIR", "cache/onnx")
+
+MODEL_FILE = "model.int8.onnx"
+CONFIG_FILE = "embedding_config.json"
+
+_export_lock = threading.Lock()
+
+def _model_dir(model_name):
+    return os.path.join(ONNX_MODEL_DIR, model_name.replace("/", "__"))
+
+def export_quantized_model(model_name, output_dir=None):
+    """Export the transformer to ONNX and quantize its weights to int8"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    output_dir = output_dir or _model_dir(model_name)
+    os.makedirs(output_dir, exist_ok=True)
+    logger.info(f"Exporting {model_name} to ONNX in {output_dir}")
+
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+
+    fp32_path = os.path.join(output_dir, f"model.fp32.{os.getpid()}.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                **{name: {0: "batch", 1: "sequence"} for name in input_names},
+                "last_hidden_state": {0: "batch", 1: "sequence"}
+            },
+            opset_version=14
+        )
+    int8_path = os.path.join(output_dir, f"{MODEL_FILE}.{os.getpid()}.tmp")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+
+    tokenizer.save_pretrained(output_dir)
+    config = {
+        "model_name": model_name,
+        "input_names": input_names,
+        "max_seq_length": model.max_seq_length,
+        "normalize": any(isinstance(module, Normalize) for module in model)
+    }
+    with open(os.path.join(output_dir, CONFIG_FILE), "w") as f:
+        json.dump(config, f)
+    # The model file appears last, so its presence means the export is complete
+    os.replace(int8_path, os.path.join(output_dir, MODEL_FILE))
+    return output_dir
+
+class OnnxEmbeddings(Embeddings):
+    """Mean-pooled sentence embeddings from a quantized ONNX export of ``model_name``"""
+
+    backend = "onnx-int8"
+
+    def __init__(self, model_name, batch_size=64, num_threads=0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        model_dir = _model_dir(model_name)
+        with _export_lock:
+            if not os.path.exists(os.path.join(model_dir, MODEL_FILE)):
+                export_quantized_model(model_name, model_dir)
+
+        with open(os.path.join(model_dir, CONFIG_FILE)) as f:
+            self.config = json.load(f)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+        options = ort.SessionOptions()
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, MODEL_FILE), options, providers=["CPUExecutionProvider"]
+        )
+
+    def embed_documents(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed(texts[start:start + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text):
+        return self._embed([text])[0].tolist()
+
+    def _embed(self, texts):
+        encoded = self.tokenizer(
+            list(texts), padding=True, truncation=True,
+            max_length=self.config["max_seq_length"], return_tensors="np"
+        )
+        feeds = {name: encoded[name].astype(np.int64) for name in self.config["input_names"]}
+        hidden = self.session.run(None, feeds)[0]
+
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config["normalize"]:
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled
+
+PARITY_TEXTS = [
+    "Quarterly revenue grew 12% driven by subscription renewals.",
+    "The warranty covers manufacturing defects for two years.",
+    "Employees must submit expense reports within 30 days.",
+    "Photosynthesis converts light energy into chemical energy.",
+    "The API rate limit is 100 requests per minute per key.",
+    "Patients should fast for eight hours before the procedure.",
+    "The bridge was completed in 1937 after four years of work.",
+    "Refunds are issued to the original payment method.",
+    "Backups run nightly and are retained for ninety days.",
+    "The recipe calls for two cups of flour and one egg.",
+]
+PARITY_QUERIES = [
+    "how long is the warranty",
+    "when are backups taken",
+    "what drove revenue growth",
+    "how many requests can I make",
+    "how do refunds work",
+]
+
+def check_parity(model_name, texts=PARITY_TEXTS, queries=PARITY_QUERIES, k=3,
+                 min_cosine=0.98, min_recall=0.9):
+    """Compare ONNX int8 output with HuggingFaceEmbeddings; returns (passed, report)"""
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    reference = HuggingFaceEmbeddings(model_name=model_name)
+    candidate = OnnxEmbeddings(model_name)
+
+    def normalized(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    ref_docs = normalized(reference.embed_documents(texts))
+    onnx_docs = normalized(candidate.embed_documents(texts))
+    cosines = (ref_docs * onnx_docs).sum(axis=1)
+
+    ref_queries = normalized([reference.embed_query(query) for query in queries])
+    onnx_queries = normalized([candidate.embed_query(query) for query in queries])
+    ref_top = np.argsort(-(ref_queries @ ref_docs.T), axis=1)[:, :k]
+    onnx_top = np.argsort(-(onnx_queries @ onnx_docs.T), axis=1)[:, :k]
+    recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_top, onnx_top)])
+
+    report = {
+        "model_name": model_name,
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        f"recall_at_{k}": float(recall)
+    }
+    return cosines.min() >= min_cosine and recall >= min_recall, report
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from model_registry import DEFAULT_EMBEDDING_MODEL
+
+    passed, report = check_parity(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_EMBEDDING_MODEL)
+    print(json.dumps(report, indent=2))
+    print("PASS" if passed else "FAIL")
+    sys.exit(0 if passed else 1)
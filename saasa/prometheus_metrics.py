@@ -0,0 +1,130 @@
+"""
+Prometheus metrics for the RAG pipeline, shared by every gunicorn worker
+
+Stage timings (file save, document loading, splitting, embedding, FAISS
+build, retrieval, LLM call), LLM token usage and in-memory index sizes are
+recorded with prometheus_client. Under gunicorn, whose config sets
+PROMETHEUS_MULTIPROC_DIR and clears it on start, each worker writes its
+samples to files there and ``/metrics/prometheus`` aggregates all of them at
+scrape time, so whichever worker answers the scrape reports for the whole
+server. A single-process run (``python app.py``, ``flask run``) keeps its
+samples in memory, so no per-pid files outlive it. Without prometheus_client
+installed every helper here is a no-op.
+"""
+import os
+import time
+import logging
+from contextlib import contextmanager
+
+from tracing import span, current_span
+
+logger = logging.getLogger(__name__)
+
+# prometheus_client reads this at import time; only gunicorn.conf.py sets it, and wipes it on start
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if PROMETHEUS_MULTIPROC_DIR:
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+try:
+    from prometheus_client import (
+        CollectorRegistry, REGISTRY, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+    )
+    from prometheus_client import multiprocess
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    logger.warning("prometheus_client not installed; /metrics/prometheus is disabled")
+    PROMETHEUS_AVAILABLE = False
+
+# 5ms .. ~10 minutes, doubling: wide enough for a retrieval and a large upload's embedding stage
+STAGE_BUCKETS = tuple(0.005 * 2 ** i for i in range(18))
+
+if PROMETHEUS_AVAILABLE:
+    stage_seconds = Histogram(
+        "rag_stage_seconds", "Time spent in each RAG pipeline stage", ["stage"], buckets=STAGE_BUCKETS
+    )
+    stage_failures = Counter(
+        "rag_stage_failures_total", "RAG pipeline stages that raised an error", ["stage"]
+    )
+    llm_tokens = Counter(
+        "llm_tokens_total", "Tokens reported by LLM providers", ["provider", "direction"]
+    )
+    # Summed over live workers: every worker holds its own copy of the indexes it serves
+    index_vectors = Gauge(
+        "vector_index_vectors", "Vectors in FAISS indexes held in memory", multiprocess_mode="livesum"
+    )
+    index_memory = Gauge(
+        "vector_index_memory_bytes", "Estimated bytes of FAISS indexes held in memory",
+        multiprocess_mode="livesum"
+    )
+
+def observe_stage(stage, seconds):
+    if PROMETHEUS_AVAILABLE:
+        stage_seconds.labels(stage).observe(seconds)
+
+def record_stage_failure(stage):
+    if PROMETHEUS_AVAILABLE:
+        stage_failures.labels(stage).inc()
+
+@contextmanager
+def stage_timer(stage):
+    """Time the block as one run of ``stage``; an exception also counts as a failure of it
+
+    Inside a traced request the block is also recorded as a span.
+    """
+    start_time = time.perf_counter()
+    try:
+        with span(stage):
+            yield
+    except Exception:
+        record_stage_failure(stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start_time)
+
+class StageClock:
+    """Accumulates the time of a stage that runs in pieces (e.g. per batch) and observes it once"""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.seconds = 0.0
+
+    @contextmanager
+    def running(self):
+        start_time = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            record_stage_failure(self.stage)
+            raise
+        finally:
+            self.seconds += time.perf_counter() - start_time
+
+    def observe(self):
+        observe_stage(self.stage, self.seconds)
+        # Too fine-grained for a span per piece; the enclosing span gets the total instead
+        traced = current_span()
+        if traced is not None:
+            traced.attributes[f"{self.stage}_seconds"] = round(self.seconds, 3)
+
+def record_llm_tokens(provider, prompt_tokens, completion_tokens):
+    """Count a call's usage as reported by the provider; missing counts are skipped"""
+    if not PROMETHEUS_AVAILABLE:
+        return
+    if prompt_tokens:
+        llm_tokens.labels(provider, "prompt").inc(prompt_tokens)
+    if completion_tokens:
+        llm_tokens.labels(provider, "completion").inc(completion_tokens)
+
+def record_index_size(vectors, memory_bytes):
+    """This worker's in-memory index totals, replacing the previous values"""
+    if PROMETHEUS_AVAILABLE:
+        index_vectors.set(vectors)
+        index_memory.set(memory_bytes)
+
+def exposition():
+    """Text exposition of every worker's metrics, as (body, content type)"""
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
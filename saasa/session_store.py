@@ -0,0 +1,166 @@
+"""
+Session index storage shared by every gunicorn worker on the host
+"""
+import os
+import time
+import shutil
+import sqlite3
+import logging
+import threading
+
+from vector_persistence import save_vector_store, load_vector_store, estimate_vector_store_bytes
+
+logger = logging.getLogger(__name__)
+
+class SessionStore:
+    """Interface for session index backends"""
+
+    def save(self, session_id, vector_store):
+        """Persist a session's vector store and return its new version"""
+        raise NotImplementedError
+
+    def load(self, session_id):
+        """Return ``(vector_store, version)``, or ``(None, None)`` if unknown"""
+        raise NotImplementedError
+
+    def version(self, session_id):
+        """Current version of a session, or None if unknown"""
+        raise NotImplementedError
+
+    def touch(self, session_id):
+        """Record that a session was used"""
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def expired(self, cutoff_timestamp):
+        """Session ids not used since ``cutoff_timestamp``"""
+        raise NotImplementedError
+
+class LocalSessionStore(SessionStore):
+    """Index files on local disk with a SQLite metadata table
+
+    Each save writes a new ``<session>/v<version>/`` directory before the
+    version is committed to SQLite, so readers in other workers never see a
+    half-written index and notice newer versions with one indexed lookup.
+    """
+
+    def __init__(self, root="sessions"):
+        self.root = root
+        self.db_path = os.path.join(root, "sessions.sqlite3")
+        self.lock = threading.Lock()
+        self._conn = None
+        os.makedirs(root, exist_ok=True)
+
+    def save(self, session_id, vector_store):
+        with self.lock:
+            row = self._connect().execute(
+                "SELECT version FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        # Nanosecond timestamps keep versions unique across concurrent writers
+        version = max(time.time_ns(), (row[0] + 1) if row else 0)
+        save_vector_store(vector_store, self._version_path(session_id, version))
+
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT INTO sessions (session_id, version, size_bytes, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT(session_id) DO UPDATE SET "
+                "version = excluded.version, size_bytes = excluded.size_bytes, last_used = excluded.last_used "
+                "WHERE excluded.version > sessions.version",
+                (session_id, version, estimate_vector_store_bytes(vector_store), now, now)
+            )
+            conn.commit()
+
+        self._remove_old_versions(session_id, keep=version)
+        return version
+
+    def load(self, session_id):
+        # A concurrent save may delete the version we just looked up; retry once
+        for _ in range(2):
+            version = self.version(session_id)
+            if version is None:
+                return None, None
+            try:
+                vector_store = load_vector_store(self._version_path(session_id, version))
+            except (OSError, RuntimeError) as e:
+                logger.warning(f"Retrying load of session {session_id}: {e}")
+                continue
+            if vector_store is not None:
+                return vector_store, version
+        return None, None
+
+    def version(self, session_id):
+        with self.lock:
+            row = self._connect().execute(
+                "SELECT version FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def touch(self, session_id):
+        with self.lock:
+            conn = self._connect()
+            conn.execute(
+                "UPDATE sessions SET last_used = ? WHERE session_id = ?", (time.time(), session_id)
+            )
+            conn.commit()
+
+    def delete(self, session_id):
+        with self.lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            conn.commit()
+        shutil.rmtree(self._session_path(session_id), ignore_errors=True)
+
+    def expired(self, cutoff_timestamp):
+        with self.lock:
+            rows = self._connect().execute(
+                "SELECT session_id FROM sessions WHERE last_used < ?", (cutoff_timestamp,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def _session_path(self, session_id):
+        if not session_id.isalnum():
+            raise ValueError(f"Invalid session id: {session_id}")
+        return os.path.join(self.root, session_id)
+
+    def _version_path(self, session_id, version):
+        return os.path.join(self._session_path(session_id), f"v{version}")
+
+    def _remove_old_versions(self, session_id, keep):
+        # Newer directories may belong to a concurrent save that is still writing
+        session_path = self._session_path(session_id)
+        for name in os.listdir(session_path):
+            path = os.path.join(session_path, name)
+            if name.startswith("v") and name[1:].isdigit() and int(name[1:]) >= keep:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+    def _connect(self):
+        # Opened lazily so gunicorn workers never inherit a connection from the master
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, version INTEGER NOT NULL, size_bytes INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+SESSION_STORES = {
+    "local": LocalSessionStore,
+}
+
+def create_session_store(kind=None, **kwargs):
+    """Build the session store named by ``kind`` or the SESSION_STORE env var"""
+    kind = kind or os.environ.get("SESSION_STORE", "local")
+    if kind not in SESSION_STORES:
+        raise ValueError(f"Unknown session store: {kind}")
+    return SESSION_STORES[kind](**kwargs)
@@ -0,0 +1,73 @@
+"""
+Single-flight request coalescing: concurrent calls with the same key share one execution
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+class SingleFlight:
+    """Run ``fn`` once per key at a time; callers arriving while it runs get the same result
+
+    Only in-flight calls are shared. Once a call finishes its key is free
+    again, so nothing is cached here (the answer cache does that).
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Return ``(fn(), shared)``; ``shared`` is True when another caller's execution was reused"""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = _Flight()
+                self.leaders += 1
+                leader = True
+            else:
+                flight.followers += 1
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            # Not just Exception: a timeout or exit in the leader must not hand followers a None result
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            if flight.followers:
+                logger.info(f"Shared one execution with {flight.followers} identical concurrent requests")
+            flight.done.set()
+        return flight.result, False
+
+    def in_flight(self, key):
+        """Whether a call for ``key`` is running now"""
+        with self.lock:
+            return key in self.flights
+
+    def stats(self):
+        with self.lock:
+            return {
+                "in_flight": len(self.flights),
+                "executions": self.leaders,
+                "coalesced": self.coalesced
+            }
@@ -0,0 +1,370 @@
+"""
+Structured fast path for CSV uploads: rows go into SQLite and aggregate or
+filter questions are answered with SQL over the full table, without the LLM
+"""
+import os
+import re
+import csv
+import json
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: questions the planner misreads would get a confident wrong answer instead of the LLM's
+STRUCTURED_QUERY_ENABLED = os.environ.get("STRUCTURED_QUERY_ENABLED", "false").lower() == "true"
+TABLES_DIR = os.environ.get("TABLES_DIR", "tables")
+# Text columns with at most this many distinct values can be matched as filters
+MAX_FILTER_VALUES = int(os.environ.get("MAX_FILTER_VALUES", 500))
+INSERT_BATCH_ROWS = 1000
+MAX_GROUPS = 50
+
+AGGREGATES = [
+    (r"\b(?:total|sum)\b", "SUM", "total"),
+    (r"\b(?:average|avg|mean)\b", "AVG", "average"),
+    (r"\b(?:maximum|max|highest|largest|biggest)\b", "MAX", "highest"),
+    (r"\b(?:minimum|min|lowest|smallest)\b", "MIN", "lowest"),
+    (r"\b(?:how many|count|number of)\b", "COUNT", "number of rows"),
+]
+COMPARISONS = [
+    (r">=|at least", ">="),
+    (r"<=|at most", "<="),
+    (r">|greater than|more than|over|above", ">"),
+    (r"<|less than|fewer than|under|below", "<"),
+    (r"=|equals|equal to|is", "="),
+]
+# Never matched as filter values, so a category called "in" or "all" cannot hijack a question
+STOPWORDS = {
+    "a", "all", "an", "and", "any", "are", "as", "at", "be", "by", "did", "do", "does", "each", "for",
+    "from", "had", "has", "have", "how", "i", "in", "is", "it", "me", "my", "no", "not", "of", "on",
+    "or", "our", "per", "the", "their", "there", "this", "to", "was", "we", "were", "what", "which",
+    "who", "with"
+}
+# Nouns that refer to the table's rows in general rather than to specific ones
+ROW_WORDS = {"row", "rows", "record", "records", "entry", "entries", "item", "items", "line", "lines"}
+# Words that can appear in a question without changing what it asks of the table
+FILLER_WORDS = STOPWORDS | ROW_WORDS | {
+    "called", "can", "csv", "data", "dataset", "file", "give", "named", "please", "show", "spreadsheet",
+    "table", "tell", "value", "where", "whose", "you"
+}
+WORD_PATTERN = r"[a-z0-9]+(?:[-'.][a-z0-9]+)*"
+
+def _identifier(name, taken):
+    base = re.sub(r"[^a-z0-9]+", "_", name.strip().lower()).strip("_") or "column"
+    if base[0].isdigit():
+        base = f"c_{base}"
+    identifier, suffix = base, 2
+    while identifier in taken:
+        identifier, suffix = f"{base}_{suffix}", suffix + 1
+    taken.add(identifier)
+    return identifier
+
+def _convert(value):
+    value = value.strip() if value is not None else ""
+    if value == "":
+        return None
+    cleaned = value.replace(",", "")
+    for cast in (int, float):
+        try:
+            return cast(cleaned)
+        except ValueError:
+            pass
+    return value
+
+def _phrase(identifier):
+    return identifier.replace("_", " ")
+
+def _format(value):
+    if isinstance(value, float) and not value.is_integer():
+        return f"{value:,.2f}"
+    if isinstance(value, (int, float)):
+        return f"{int(value):,}"
+    return str(value)
+
+class TableStore:
+    """One SQLite file per session (or shared index) holding a table per uploaded CSV"""
+
+    def __init__(self, root=TABLES_DIR):
+        self.root = root
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def load_csv(self, owner_id, file_path, doc_id=None, replace=False):
+        """Copy a CSV into its own table; ``replace`` drops the owner's earlier tables"""
+        if replace:
+            self.delete(owner_id)
+
+        with self.lock, self._connect(owner_id) as conn:
+            taken = {row[0] for row in conn.execute("SELECT table_name FROM _tables")}
+            table = _identifier(os.path.splitext(os.path.basename(file_path))[0], taken)
+
+            with open(file_path, newline="", encoding="utf-8") as f:
+                reader = csv.reader(f)
+                header = next(reader, [])
+                if not header:
+                    return None
+                column_ids = set()
+                columns = [_identifier(name, column_ids) for name in header]
+                column_list = ", ".join(f'"{column}"' for column in columns)
+                conn.execute(f'CREATE TABLE "{table}" ({column_list})')
+
+                insert = f'INSERT INTO "{table}" VALUES ({", ".join("?" for _ in columns)})'
+                rows, batch = 0, []
+                for record in reader:
+                    values = [_convert(value) for value in record[:len(columns)]]
+                    batch.append(values + [None] * (len(columns) - len(values)))
+                    if len(batch) >= INSERT_BATCH_ROWS:
+                        conn.executemany(insert, batch)
+                        rows, batch = rows + len(batch), []
+                if batch:
+                    conn.executemany(insert, batch)
+                    rows += len(batch)
+
+            numeric, values = [], {}
+            for column in columns:
+                text_count, numeric_count, distinct = conn.execute(
+                    f'SELECT SUM(typeof("{column}") = \'text\'), '
+                    f'SUM(typeof("{column}") IN (\'integer\', \'real\')), COUNT(DISTINCT "{column}") FROM "{table}"'
+                ).fetchone()
+                if numeric_count and not text_count:
+                    numeric.append(column)
+                elif distinct and distinct <= MAX_FILTER_VALUES:
+                    values[column] = [
+                        row[0] for row in conn.execute(
+                            f'SELECT DISTINCT "{column}" FROM "{table}" WHERE "{column}" IS NOT NULL'
+                        )
+                    ]
+
+            conn.execute(
+                "INSERT INTO _tables (table_name, doc_id, source, columns, numeric_columns, filter_values, row_count) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (table, doc_id, os.path.basename(file_path), json.dumps(columns), json.dumps(numeric),
+                 json.dumps(values), rows)
+            )
+        logger.info(f"Loaded {rows} rows from {file_path} into table {table}")
+        return table
+
+    def drop_document(self, owner_id, doc_id):
+        if not os.path.exists(self._db_path(owner_id)):
+            return
+        with self.lock, self._connect(owner_id) as conn:
+            for (table,) in conn.execute("SELECT table_name FROM _tables WHERE doc_id = ?", (doc_id,)).fetchall():
+                conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+            conn.execute("DELETE FROM _tables WHERE doc_id = ?", (doc_id,))
+
+    def delete(self, owner_id):
+        with self.lock:
+            for suffix in ("", "-wal", "-shm"):
+                path = self._db_path(owner_id) + suffix
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def answer(self, owner_id, question):
+        """Answer ``question`` with SQL if it reads as an aggregate or filter query, else None"""
+        if not os.path.exists(self._db_path(owner_id)):
+            return None
+        with self._connect(owner_id) as conn:
+            catalog = conn.execute(
+                "SELECT table_name, source, columns, numeric_columns, filter_values FROM _tables"
+            ).fetchall()
+            plans = []
+            for table, source, columns, numeric, values in catalog:
+                plan = plan_query(question, table, json.loads(columns), json.loads(numeric), json.loads(values))
+                if plan is not None:
+                    plans.append((plan["score"], source, plan))
+            if not plans:
+                return None
+
+            _, source, plan = max(plans, key=lambda item: item[0])
+            rows = conn.execute(plan["sql"], plan["params"]).fetchall()
+            matching = conn.execute(plan["count_sql"], plan["params"]).fetchone()[0]
+        return {
+            "result": describe(plan, rows, matching, source),
+            "sql": plan["sql"],
+            "params": plan["params"],
+            "table": plan["table"],
+            "rows_matched": matching
+        }
+
+    def _db_path(self, owner_id):
+        if not owner_id.isalnum():
+            raise ValueError(f"Invalid table owner: {owner_id}")
+        return os.path.join(self.root, f"{owner_id}.sqlite3")
+
+    def _connect(self, owner_id):
+        conn = sqlite3.connect(self._db_path(owner_id), timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS _tables (table_name TEXT PRIMARY KEY, doc_id TEXT, source TEXT, "
+            "columns TEXT, numeric_columns TEXT, filter_values TEXT, row_count INTEGER)"
+        )
+        return _closing(conn)
+
+class _closing:
+    """Commit (or roll back) and close, unlike sqlite3's own context manager which only commits"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.conn.commit()
+        else:
+            self.conn.rollback()
+        self.conn.close()
+
+def _mentions(text, phrase):
+    return re.search(rf"\b{re.escape(phrase)}\b", text) is not None
+
+def _mentions_value(question, value):
+    """Whether the lowercased question contains ``value`` as a whole phrase, plural allowed"""
+    return re.search(rf"(?<![\w-]){re.escape(value)}(?:s|es)?(?![\w-])", question) is not None
+
+def _words(text):
+    return re.findall(WORD_PATTERN, text)
+
+def _explained(word, known):
+    return any(candidate in known for candidate in (word, word[:-1], word[:-2]) if candidate)
+
+def plan_query(question, table, columns, numeric, values):
+    """Turn a question into SQL over ``table``; None unless it names an aggregate we can compute
+
+    Every content word of the question must be covered by the plan: the
+    aggregate, the columns, the matched filter values and comparisons.
+    Anything else ("last year", "growth", "customers") is a part of the
+    question SQL would silently ignore, so it goes to the LLM instead.
+    "Which X had the highest Y" answers with the X of the top row.
+    """
+    lowered = re.sub(r"'s\b", "", question.lower())
+    text = re.sub(r"[^a-z0-9.<>=-]+", " ", lowered)
+    covered = set()
+
+    matches = [(re.search(pattern, text), function, label) for pattern, function, label in AGGREGATES]
+    matches = [(match, function, label) for match, function, label in matches if match]
+    if not matches:
+        return None
+    match, function, label = min(matches, key=lambda item: item[0].start())
+    covered.update(_words(match.group(0)))
+
+    mentioned = sorted(
+        (column for column in columns if _mentions(text, _phrase(column))),
+        key=lambda column: -len(column)
+    )
+    for column in mentioned:
+        covered.update(_phrase(column).split())
+
+    group = None
+    for column in mentioned:
+        if re.search(rf"\b(?:by|per|for each|each)\s+{re.escape(_phrase(column))}\b", text):
+            group = column
+            break
+
+    # "which year had the highest profit": the answer is a year, not a profit
+    pick = None
+    if function in ("MAX", "MIN") and group is None:
+        for column in mentioned:
+            if re.match(rf"\s*(?:which|what)\s+{re.escape(_phrase(column))}\b", text):
+                pick = column
+                break
+
+    conditions, used = [], {group, pick}
+    for column, column_values in values.items():
+        if column in used:
+            continue
+        for value in sorted(column_values, key=lambda value: -len(str(value))):
+            phrase = str(value).lower()
+            if len(phrase) > 1 and phrase not in STOPWORDS and _mentions_value(lowered, phrase):
+                conditions.append((column, "=", value))
+                covered.update(_words(phrase))
+                used.add(column)
+                break
+
+    for column in numeric:
+        if column in used:
+            continue
+        for pattern, operator in COMPARISONS:
+            match = re.search(rf"\b{re.escape(_phrase(column))}\s+(?:{pattern})\s+(-?[\d.]+)", text)
+            if match:
+                conditions.append((column, operator, _convert(match.group(1))))
+                covered.update(_words(match.group(0)))
+                used.add(column)
+                break
+
+    # The table name alone ("how many customers are in the data") says nothing about the rows wanted
+    counts_rows = function == "COUNT" and any(word in ROW_WORDS for word in _words(text))
+    if not mentioned and not conditions and not counts_rows:
+        return None
+
+    covered.update(_phrase(table).split())
+    unexplained = sorted({
+        word for word in _words(text) if word not in FILLER_WORDS and not _explained(word, covered)
+    })
+    if unexplained:
+        logger.info(f"Not answering with SQL on {table}: nothing in the plan covers {', '.join(unexplained)}")
+        return None
+
+    if function == "COUNT":
+        if pick is not None:
+            return None
+        target = None
+    else:
+        targets = [column for column in mentioned if column in numeric and column not in used]
+        if not targets:
+            return None
+        target = targets[0]
+
+    where = " AND ".join(f'"{column}" {operator} ?' for column, operator, _ in conditions)
+    where = f" WHERE {where}" if where else ""
+    expression = "COUNT(*)" if target is None else f'{function}("{target}")'
+    if pick:
+        order = "DESC" if function == "MAX" else "ASC"
+        sql = (f'SELECT "{pick}", "{target}" FROM "{table}" WHERE "{target}" IS NOT NULL'
+               f'{where.replace(" WHERE", " AND")} ORDER BY "{target}" {order} LIMIT 1')
+    elif group:
+        sql = (f'SELECT "{group}", {expression} AS value FROM "{table}"{where} '
+               f'GROUP BY "{group}" ORDER BY value DESC LIMIT {MAX_GROUPS}')
+    else:
+        sql = f'SELECT {expression} FROM "{table}"{where}'
+
+    return {
+        "table": table,
+        "sql": sql,
+        "count_sql": f'SELECT COUNT(*) FROM "{table}"{where}',
+        "params": [value for _, _, value in conditions],
+        "label": label,
+        "target": target,
+        "group": group,
+        "pick": pick,
+        "conditions": conditions,
+        # Prefer the table whose columns and values the question mentions most
+        "score": len(mentioned) + len(conditions)
+    }
+
+def describe(plan, rows, matching, source):
+    """Plain-language answer for an executed plan"""
+    subject = plan["label"] if plan["target"] is None else f"{plan['label']} {_phrase(plan['target'])}"
+    filters = [f"{_phrase(column)} {operator} {value}" for column, operator, value in plan["conditions"]]
+    scope = f" where {' and '.join(filters)}" if filters else ""
+    basis = f"(computed over {matching:,} matching rows of {source})"
+
+    if plan.get("pick"):
+        if not rows:
+            return f"No rows of {source} match{scope}."
+        picked, value = rows[0]
+        return (f"The {_phrase(plan['pick'])} with the {subject}{scope} is {picked} "
+                f"({_phrase(plan['target'])} {_format(value)}; computed over {matching:,} matching rows of {source}).")
+
+    if plan["group"]:
+        if not rows:
+            return f"No rows of {source} match{scope}."
+        lines = [f"- {group}: {_format(value)}" for group, value in rows]
+        return f"The {subject} by {_phrase(plan['group'])}{scope} {basis}:\n" + "\n".join(lines)
+
+    value = rows[0][0] if rows else None
+    if value is None:
+        return f"No rows of {source} match{scope}."
+    return f"The {subject}{scope} is {_format(value)} {basis}."
@@ -0,0 +1,11 @@
+"""
+Shared test setup: the helper modules are imported flat, as the apps do via sys.path
+"""
+import os
+import sys
+import tempfile
+
+SAASA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SAASA_DIR)
+# Keep prometheus_client's per-process files out of the working tree
+os.environ.setdefault("METRICS_DIR", tempfile.mkdtemp(prefix="metrics-"))
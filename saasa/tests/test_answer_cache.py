@@ -0,0 +1,26 @@
+from answer_cache import AnswerCache
+
+def failing_embed(text):
+    raise RuntimeError("embedding model unavailable")
+
+def test_put_survives_embedding_failure_and_serves_exact_repeats():
+    cache = AnswerCache(semantic=True, embed_query=failing_embed)
+
+    cache.put("docs", "What is the refund policy?", {"answer": "30 days"})
+
+    assert cache.get("docs", "what is the refund policy") == {"answer": "30 days"}
+    assert cache.get("docs", "how do refunds work") is None
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (1, 1, 1)
+
+def test_semantic_hit_for_near_duplicate_query():
+    vectors = {"what is the refund policy": [1.0, 0.0], "whats the refund policy": [0.99, 0.1]}
+    cache = AnswerCache(
+        semantic=True, similarity_threshold=0.95, embed_query=lambda text: vectors.get(text, [0.0, 1.0])
+    )
+
+    cache.put("docs", "What is the refund policy?", "30 days")
+
+    assert cache.get("docs", "Whats the refund policy") == "30 days"
+    assert cache.get("other docs", "Whats the refund policy") is None
+    assert cache.stats()["semantic_hits"] == 1
@@ -0,0 +1,27 @@
+from embedding_cache import EmbeddingCache
+
+def put(cache, prefix, count):
+    cache.put_many("model", [f"{prefix}-{i}" for i in range(count)], [[float(i)] * 4 for i in range(count)])
+
+def test_cap_is_enforced_at_periodic_checks(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "cache.sqlite3"), max_entries=100, evict_every=50)
+    for batch in range(10):
+        put(cache, f"batch{batch}", 30)
+
+    stats = cache.stats()
+    assert stats["entries"] == 100
+    assert stats["evictions"] == 200
+    # The most recently written batch survives eviction
+    assert all(vector is not None for vector in cache.get_many("model", [f"batch9-{i}" for i in range(30)]))
+
+def test_stats_do_not_query_sqlite(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "cache.sqlite3"), evict_every=1000)
+    put(cache, "a", 10)
+    cache.get_many("model", ["a-1", "missing"])
+    statements = []
+    cache._conn.set_trace_callback(statements.append)
+
+    stats = cache.stats()
+
+    assert statements == []
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 10)
@@ -0,0 +1,27 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from hybrid_retrieval import BM25Index
+
+def test_readding_ids_that_trigger_compaction_keeps_the_whole_batch():
+    index = BM25Index()
+    index.add([("a", "apple"), ("b", "banana"), ("c", "cherry")])
+    index.remove(["b"])
+
+    # Replacing "a" and "c" leaves more dead chunks than live ones, which compacts
+    index.add([("d", "date"), ("a", "apricot"), ("e", "elderberry"), ("c", "cranberry")])
+
+    assert len(index) == 4
+    assert sorted(index.doc_ids) == ["a", "c", "d", "e"]
+    for doc_id, word in [("a", "apricot"), ("c", "cranberry"), ("d", "date"), ("e", "elderberry")]:
+        assert [hit[0] for hit in index.search(word, 5)] == [doc_id]
+    assert index.search("apple", 5) == []
+
+def test_repeated_id_in_one_batch_keeps_its_last_text():
+    index = BM25Index()
+    index.add([("a", "apple"), ("a", "avocado")])
+
+    assert len(index) == 1
+    assert index.search("apple", 5) == []
+    assert [hit[0] for hit in index.search("avocado", 5)] == ["a"]
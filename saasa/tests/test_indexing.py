@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+pytest.importorskip("langchain_community.vectorstores")
+
+from langchain_community.vectorstores import FAISS
+
+import faiss_index
+from faiss_index import build_index, index_type_of, stored_vectors, upgrade_index
+from indexing import remove_document
+
+NUM_DOCS = 3000
+DIMENSION = 64
+
+@pytest.fixture(scope="module")
+def vectors():
+    return np.random.default_rng(0).standard_normal((NUM_DOCS, DIMENSION)).astype(np.float32)
+
+def make_store(vectors, index_type):
+    text_embeddings = [(f"chunk {i}", vector.tolist()) for i, vector in enumerate(vectors)]
+    # Ten chunks per document
+    metadatas = [{"doc_id": f"doc{i // 10}"} for i in range(len(vectors))]
+    vector_store = FAISS.from_embeddings(text_embeddings, None, metadatas=metadatas)
+    vector_store.index = build_index(vectors, index_type)
+    return vector_store
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw", "ivfpq"])
+def test_search_after_removal_only_returns_remaining_chunks(vectors, index_type):
+    vector_store = make_store(vectors, index_type)
+
+    assert remove_document(vector_store, "doc5") == 10
+    assert vector_store.index.ntotal == NUM_DOCS - 10
+    for query in vectors[::100]:
+        for doc in vector_store.similarity_search_by_vector(query.tolist(), k=10):
+            assert doc.metadata["doc_id"] != "doc5"
+
+def test_ivfpq_removal_keeps_remaining_codes(vectors):
+    vector_store = make_store(vectors, "ivfpq")
+    before = stored_vectors(vector_store.index)
+
+    for doc_id in ("doc5", "doc40", "doc250"):
+        remove_document(vector_store, doc_id)
+
+    assert index_type_of(vector_store.index) == "ivfpq"
+    removed = [i for i in range(NUM_DOCS) if i // 10 in (5, 40, 250)]
+    # Relabelled in place rather than re-quantized, so every reconstruction is unchanged
+    np.testing.assert_array_equal(stored_vectors(vector_store.index), np.delete(before, removed, axis=0))
+
+def test_hnsw_store_grown_past_hnsw_max_becomes_ivfpq(vectors, monkeypatch):
+    monkeypatch.setattr(faiss_index, "FAISS_FLAT_MAX", 100)
+    monkeypatch.setattr(faiss_index, "FAISS_HNSW_MAX", 2000)
+    vector_store = make_store(vectors, "hnsw")
+
+    upgrade_index(vector_store, "auto")
+
+    assert index_type_of(vector_store.index) == "ivfpq"
+    assert vector_store.index.ntotal == NUM_DOCS
+
+def test_ivfpq_is_never_rebuilt_into_a_smaller_type(vectors, monkeypatch):
+    monkeypatch.setattr(faiss_index, "FAISS_HNSW_MAX", 10 ** 6)
+    vector_store = make_store(vectors, "ivfpq")
+    index = vector_store.index
+
+    assert upgrade_index(vector_store, "auto") is None
+    assert vector_store.index is index
@@ -0,0 +1,107 @@
+import time
+import threading
+
+import pytest
+
+import llm_client
+from llm_client import LLMClient, LLMError, LLMTimeoutError, backoff_delay, run_stub_server, together_payload
+
+PAYLOAD = together_payload("ping", llm_client.TOGETHER_MODEL, 0.7, 16)
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_MAX", 0.05)
+
+@pytest.fixture
+def stub_server():
+    servers = []
+
+    def start(**kwargs):
+        servers.append(run_stub_server(**kwargs))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def test_retries_429_and_5xx_then_succeeds(stub_server, fast_backoff):
+    server = stub_server(statuses=[503, 429, 500])
+    client = LLMClient(max_retries=3)
+
+    data = client.post_json(server.url, PAYLOAD, timeout=5)
+
+    assert data["choices"][0]["text"] == "stub answer"
+    assert server.requests == 4
+    assert client.stats()["retries"] == 3
+
+def test_gives_up_after_max_retries(stub_server, fast_backoff):
+    server = stub_server(statuses=[502] * 10)
+    client = LLMClient(max_retries=2)
+
+    with pytest.raises(LLMError, match="502"):
+        client.post_json(server.url, PAYLOAD, timeout=5)
+    assert server.requests == 3
+    assert client.stats()["failures"] == 1
+
+def test_client_errors_are_not_retried(stub_server, fast_backoff):
+    server = stub_server(statuses=[400])
+    with pytest.raises(LLMError, match="400"):
+        LLMClient(max_retries=3).post_json(server.url, PAYLOAD, timeout=5)
+    assert server.requests == 1
+
+def test_backoff_grows_exponentially_and_honours_retry_after(monkeypatch):
+    monkeypatch.setattr(llm_client.random, "uniform", lambda low, high: high)
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_BASE", 0.5)
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_MAX", 8)
+
+    assert [backoff_delay(attempt) for attempt in range(6)] == [0.5, 1, 2, 4, 8, 8]
+    assert backoff_delay(0, retry_after="3") == 3
+    assert backoff_delay(0, retry_after="soon") == 0.5
+
+def test_call_past_its_deadline_raises_timeout(stub_server):
+    server = stub_server(delay=1.0)
+    start_time = time.monotonic()
+
+    with pytest.raises(LLMTimeoutError):
+        LLMClient().post_json(server.url, PAYLOAD, timeout=0.2)
+    assert time.monotonic() - start_time < 0.8
+
+def test_concurrent_calls_are_capped(stub_server):
+    server = stub_server(delay=0.1)
+    client = LLMClient(max_concurrency=2)
+    threads = [
+        threading.Thread(target=client.post_json, args=(server.url, PAYLOAD), kwargs={"timeout": 5})
+        for _ in range(6)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert server.requests == 6
+    assert server.max_in_flight == 2
+    assert client.stats()["in_flight"] == 0
+
+def test_waiting_for_a_slot_counts_against_the_deadline(stub_server):
+    server = stub_server(delay=0.5)
+    client = LLMClient(max_concurrency=1)
+    holder = threading.Thread(target=client.post_json, args=(server.url, PAYLOAD), kwargs={"timeout": 5})
+    holder.start()
+    while server.requests == 0:
+        time.sleep(0.01)
+
+    with pytest.raises(LLMTimeoutError, match="No free LLM slot"):
+        client.post_json(server.url, PAYLOAD, timeout=0.1)
+    holder.join()
+
+def test_sequential_calls_reuse_one_pooled_connection(stub_server):
+    server = stub_server()
+    client = LLMClient()
+
+    for _ in range(5):
+        client.post_json(server.url, PAYLOAD, timeout=5)
+
+    assert server.requests == 5
+    assert server.connections == 1
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.documents import Document
+
+import llm_streaming
+from llm_streaming import replay_answer, stream_answer
+
+class FakeRetriever:
+    def invoke(self, query, config=None):
+        return [Document(page_content="Refunds are accepted within 30 days.")]
+
+def parse(events):
+    parsed = []
+    for event in events:
+        lines = event.strip().split("\n")
+        parsed.append((lines[0][len("event: "):], json.loads(lines[1][len("data: "):])))
+    return parsed
+
+def test_stream_wraps_gemini_prompt_and_hands_over_the_answer(monkeypatch):
+    prompts = []
+
+    def fake_gemini(prompt, api_key, temperature=0.7):
+        prompts.append(prompt)
+        yield "30 "
+        yield "days"
+
+    monkeypatch.setattr(llm_streaming, "stream_providers", lambda: [("gemini", fake_gemini, "key")])
+    answers = []
+
+    events = parse(stream_answer(
+        FakeRetriever(), "refund window?", gemini_prompt_template="Context: {prompt}\nBe detailed.",
+        on_answer=lambda docs, text: answers.append((len(docs), text))
+    ))
+
+    assert [event for event, _ in events] == ["sources", "token", "token", "done"]
+    assert prompts[0].startswith("Context: Use the following pieces of context")
+    assert prompts[0].endswith("Be detailed.")
+    assert answers == [(1, "30 days")]
+    assert events[-1][1] == {"provider": "gemini", "cached": False, "coalesced": False}
+
+def test_replay_sends_a_cached_answer_as_one_token():
+    result = {"result": "30 days", "source_documents": [Document(page_content="Refund policy")]}
+
+    events = parse(replay_answer(result))
+
+    assert [event for event, _ in events] == ["sources", "token", "done"]
+    assert events[0][1][0]["content"] == "Refund policy..."
+    assert events[1][1] == {"text": "30 days"}
+    assert events[2][1]["cached"] is True
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("langchain_community.embeddings")
+
+from model_registry import DEFAULT_EMBEDDING_MODEL
+from onnx_embeddings import check_parity, OnnxEmbeddings, PARITY_TEXTS
+
+def test_int8_onnx_embeddings_match_huggingface():
+    passed, report = check_parity(DEFAULT_EMBEDDING_MODEL, min_cosine=0.98, min_recall=0.9)
+    assert report["min_cosine"] >= 0.98, report
+    assert report["recall_at_3"] >= 0.9, report
+    assert passed
+
+def test_query_and_document_embeddings_agree():
+    embeddings = OnnxEmbeddings(DEFAULT_EMBEDDING_MODEL)
+    document = np.asarray(embeddings.embed_documents(PARITY_TEXTS[:1])[0])
+    query = np.asarray(embeddings.embed_query(PARITY_TEXTS[0]))
+    cosine = document @ query / (np.linalg.norm(document) * np.linalg.norm(query))
+    assert cosine == pytest.approx(1.0, abs=1e-5)
@@ -0,0 +1,16 @@
+import os
+
+import pytest
+
+import prometheus_metrics
+
+def test_single_process_run_keeps_samples_in_memory():
+    if not prometheus_metrics.PROMETHEUS_AVAILABLE:
+        pytest.skip("prometheus_client not installed")
+    assert "PROMETHEUS_MULTIPROC_DIR" not in os.environ
+
+    prometheus_metrics.observe_stage("test_stage", 0.25)
+    body, _ = prometheus_metrics.exposition()
+
+    assert b'rag_stage_seconds_count{stage="test_stage"} 1.0' in body
+    assert not os.path.exists(os.path.join(os.environ["METRICS_DIR"], "prometheus"))
@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+from single_flight import SingleFlight
+
+class LeaderAborted(BaseException):
+    """Stands in for a worker timeout or exit, which is not an Exception"""
+
+def run_with_follower(flight, fn):
+    """Run ``fn`` as the leader and return what a concurrent follower got"""
+    started = threading.Event()
+    release = threading.Event()
+    outcome = {}
+
+    def leader_fn():
+        started.set()
+        release.wait(5)
+        return fn()
+
+    def follower():
+        try:
+            outcome["result"] = flight.do("key", lambda: "follower ran")
+        except BaseException as e:
+            outcome["error"] = e
+
+    def leader():
+        try:
+            outcome["leader"] = flight.do("key", leader_fn)
+        except BaseException as e:
+            outcome["leader_error"] = e
+
+    leader_thread = threading.Thread(target=leader)
+    leader_thread.start()
+    started.wait(5)
+    follower_thread = threading.Thread(target=follower)
+    follower_thread.start()
+    # The follower has joined once it is counted
+    while flight.stats()["coalesced"] == 0:
+        follower_thread.join(0.01)
+    release.set()
+    leader_thread.join(5)
+    follower_thread.join(5)
+    return outcome
+
+def test_follower_shares_the_leader_result():
+    flight = SingleFlight()
+
+    outcome = run_with_follower(flight, lambda: "answer")
+
+    assert outcome["leader"] == ("answer", False)
+    assert outcome["result"] == ("answer", True)
+    assert flight.stats() == {"in_flight": 0, "executions": 1, "coalesced": 1}
+
+@pytest.mark.parametrize("error", [ValueError("boom"), LeaderAborted()])
+def test_follower_raises_the_leader_error(error):
+    flight = SingleFlight()
+
+    def fail():
+        raise error
+
+    outcome = run_with_follower(flight, fail)
+
+    assert outcome["leader_error"] is error
+    assert outcome["error"] is error
+    assert "result" not in outcome
+    assert flight.stats()["in_flight"] == 0
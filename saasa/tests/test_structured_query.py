@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+from structured_query import TableStore, plan_query
+
+DATA_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data.csv")
+
+@pytest.fixture
+def table_store(tmp_path):
+    store = TableStore(str(tmp_path / "tables"))
+    store.load_csv("owner", DATA_CSV)
+    return store
+
+@pytest.mark.parametrize("question", [
+    "What was the total profit last year?",
+    "What is the average sales growth?",
+    "What is the highest profit margin?",
+    "How many customers are in the data?",
+    "how many times does the report mention sales?",
+    "count of sales in the last month",
+    "How many pages does the PDF have?",
+    "What is the capital of France?",
+])
+def test_questions_sql_cannot_fully_answer_go_to_the_llm(table_store, question):
+    assert table_store.answer("owner", question) is None
+
+def test_which_x_had_the_highest_y_answers_with_x(table_store):
+    answer = table_store.answer("owner", "Which year had the highest profit?")
+    assert answer["result"].startswith("The year with the highest profit is 2024 ")
+
+    answer = table_store.answer("owner", "Which year had the lowest sales?")
+    assert answer["result"].startswith("The year with the lowest sales is 2023 ")
+
+@pytest.mark.parametrize("question, expected", [
+    ("What is the total profit?", "is 4,500"),
+    ("What's the average sales?", "is 550"),
+    ("How many rows are in the data?", "is 2"),
+    ("highest profit where sales > 550", "is 2,500"),
+])
+def test_fully_covered_questions_are_answered(table_store, question, expected):
+    assert expected in table_store.answer("owner", question)["result"]
+
+def test_table_name_alone_is_not_a_plan():
+    assert plan_query("how many orders are there", "orders", ["region"], [], {}) is None
+
+def test_values_match_hyphenated_plurals_and_unknown_values_fall_back():
+    values = {"product": ["T-Shirt", "Mug"]}
+    plan = plan_query("average price of t-shirts", "t", ["product", "price"], ["price"], values)
+    assert plan["conditions"] == [("product", "=", "T-Shirt")]
+    assert plan_query("average price of hoodies", "t", ["product", "price"], ["price"], values) is None
+
+def test_stopword_values_are_never_filters():
+    plan = plan_query("how many rows have name Al", "t", ["name"], [], {"name": ["in", "Al"]})
+    assert plan["conditions"] == [("name", "=", "Al")]
@@ -0,0 +1,265 @@
+"""
+Lightweight per-request tracing: nested spans across the RAG pipeline
+
+Every request gets an id (the caller's X-Request-ID, or a new one) and, for
+a TRACE_SAMPLE_RATE share of requests, a trace. Inside a traced request,
+``span(name)`` blocks, the LangChain runs of ``rag_chain.invoke`` (through
+``trace_callbacks()``) and ingestion job stages record spans under the
+request's root span. Finished spans are exported in batches by a background
+thread, as JSON lines to TRACE_FILE or as OTLP/HTTP JSON to a local
+collector. Outside a sampled trace ``span`` is a single context variable
+lookup, so leaving sampling off costs next to nothing.
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+try:
+    from langchain_core.callbacks import BaseCallbackHandler
+    LANGCHAIN_AVAILABLE = True
+except ImportError:
+    # Request ids and span() still work; chain runs are just not traced
+    BaseCallbackHandler = object
+    LANGCHAIN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Share of requests traced: 0 turns tracing off, 1 traces everything
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0))
+# "jsonl" writes one span per line to TRACE_FILE; "otlp" posts to TRACE_OTLP_ENDPOINT
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "jsonl").lower()
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.environ.get("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "evolvex-rag")
+TRACE_FLUSH_SECONDS = float(os.environ.get("TRACE_FLUSH_SECONDS", 2))
+# Spans waiting for export; more are dropped rather than slowing requests down
+TRACE_QUEUE_SIZE = 10000
+TRACE_BATCH_SIZE = 512
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    """One timed operation; ``parent_id`` is None for a trace's root span"""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start", "end", "error")
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.start = time.time()
+        self.end = None
+        self.error = None
+
+    def child(self, name, attributes=None):
+        return Span(name, self.trace_id, self.span_id, attributes)
+
+    def finish(self, error=None):
+        self.end = time.time()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        exporter.export(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round((self.end - self.start) * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+    def to_otlp(self):
+        otlp_span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            # SERVER for a request's root span, INTERNAL below it
+            "kind": 2 if self.parent_id is None else 1,
+            "startTimeUnixNano": str(int(self.start * 1e9)),
+            "endTimeUnixNano": str(int(self.end * 1e9)),
+            "attributes": [
+                {"key": key, "value": {"stringValue": str(value)}} for key, value in self.attributes.items()
+            ],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1}
+        }
+        if self.parent_id:
+            otlp_span["parentSpanId"] = self.parent_id
+        return otlp_span
+
+class SpanExporter:
+    """Queues finished spans and writes them out in batches from a background thread"""
+
+    def __init__(self, kind=TRACE_EXPORTER):
+        self.kind = kind
+        self.queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self.dropped = 0
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def export(self, span):
+        self._start()
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        # Started lazily so each forked worker runs its own flush thread
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                threading.Thread(target=self._run, name="trace-exporter", daemon=True).start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + TRACE_FLUSH_SECONDS
+            while len(batch) < TRACE_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception as e:
+                logger.error(f"Exporting {len(batch)} spans failed: {e}")
+
+    def write(self, spans):
+        if self.kind == "otlp":
+            payload = {"resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}
+                ]},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": [finished.to_otlp() for finished in spans]}]
+            }]}
+            import requests
+            requests.post(TRACE_OTLP_ENDPOINT, json=payload, timeout=5).raise_for_status()
+        else:
+            lines = "".join(json.dumps(finished.to_dict(), default=str) + "\n" for finished in spans)
+            with open(TRACE_FILE, "a") as f:
+                f.write(lines)
+
+    def stats(self):
+        return {"exporter": self.kind, "queued": self.queue.qsize(), "dropped": self.dropped}
+
+# Global span exporter
+exporter = SpanExporter()
+
+def new_request_id():
+    return uuid.uuid4().hex
+
+def start_trace(name, request_id, sample_rate=TRACE_SAMPLE_RATE, **attributes):
+    """Root span for a request when it is sampled, made current; None otherwise
+
+    Returns a token for ``end_trace``.
+    """
+    if sample_rate <= 0 or random.random() >= sample_rate:
+        return None
+    root = Span(name, uuid.uuid4().hex, attributes={"request_id": request_id, **attributes})
+    return root, _current_span.set(root)
+
+def end_trace(token, error=None, **attributes):
+    if token is None:
+        return
+    root, context_token = token
+    root.attributes.update(attributes)
+    try:
+        _current_span.reset(context_token)
+    except ValueError:
+        # Ended from another context; at least keep this thread's next request out of the trace
+        _current_span.set(None)
+    root.finish(error)
+
+def current_span():
+    return _current_span.get()
+
+@contextmanager
+def span(name, **attributes):
+    """Record the block as a child of the current span; does nothing outside a sampled trace"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = parent.child(name, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        _current_span.reset(token)
+        child.finish(e)
+        raise
+    _current_span.reset(token)
+    child.finish()
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Turns LangChain chain and retriever runs into spans under the span current at invoke time
+
+    Each run's span is made current while it runs, so ``span`` blocks inside
+    it (the LLM call, a provider request) nest below the right chain.
+    """
+
+    def __init__(self):
+        self.runs = {}
+
+    def _start(self, run_id, parent_run_id, name):
+        parent = self.runs[parent_run_id][0] if parent_run_id in self.runs else _current_span.get()
+        if parent is None:
+            return
+        child = parent.child(name)
+        self.runs[run_id] = (child, _current_span.get())
+        _current_span.set(child)
+
+    def _end(self, run_id, error=None):
+        entry = self.runs.pop(run_id, None)
+        if entry is None:
+            return
+        child, previous = entry
+        _current_span.set(previous)
+        child.finish(error)
+
+    @staticmethod
+    def _name(serialized, kwargs, kind):
+        name = kwargs.get("name") or (serialized or {}).get("name")
+        if not name and serialized and serialized.get("id"):
+            name = serialized["id"][-1]
+        return f"{kind}.{name or 'unknown'}"
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, self._name(serialized, kwargs, "chain"))
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, self._name(serialized, kwargs, "retriever"))
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+def trace_callbacks():
+    """Callbacks to pass to ``invoke`` so its runs are traced; empty when the request is not sampled"""
+    if _current_span.get() is None or not LANGCHAIN_AVAILABLE:
+        return []
+    # One handler per traced invoke keeps its run table private to that request
+    return [TracingCallbackHandler()]
@@ -0,0 +1,119 @@
+"""
+Save and load FAISS vector stores so indexes survive worker restarts
+"""
+import os
+import json
+import pickle
+import hashlib
+import logging
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+from model_registry import get_embeddings
+from faiss_index import tune_index, index_type_of, stored_vectors, MmapFlatIndex
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "index.pkl"
+# Flat indexes are stored as a plain float32 matrix so they can be memory-mapped
+VECTORS_FILE = "vectors.npy"
+LEXICAL_FILE = "lexical.pkl"
+
+VECTOR_STORE_MMAP = os.environ.get("VECTOR_STORE_MMAP", "true").lower() == "true"
+
+def save_vector_store(vector_store, folder_path):
+    """Write the index and docstore, replacing files atomically
+
+    Flat indexes go to ``vectors.npy``; other index types use FAISS's own
+    ``index.faiss`` format, as FAISS.save_local does.
+    """
+    os.makedirs(folder_path, exist_ok=True)
+    docstore_path = os.path.join(folder_path, DOCSTORE_FILE)
+    suffix = f".{os.getpid()}.tmp"
+
+    if index_type_of(vector_store.index) == "flat":
+        index_file, stale_file = VECTORS_FILE, INDEX_FILE
+        with open(os.path.join(folder_path, index_file) + suffix, "wb") as f:
+            np.save(f, stored_vectors(vector_store.index))
+    else:
+        index_file, stale_file = INDEX_FILE, VECTORS_FILE
+        faiss.write_index(vector_store.index, os.path.join(folder_path, index_file) + suffix)
+    with open(docstore_path + suffix, "wb") as f:
+        pickle.dump((vector_store.docstore, vector_store.index_to_docstore_id), f)
+    lexical_path = os.path.join(folder_path, LEXICAL_FILE)
+    lexical_index = getattr(vector_store, "lexical_index", None)
+    if lexical_index is not None:
+        with open(lexical_path + suffix, "wb") as f:
+            pickle.dump(lexical_index, f)
+        os.replace(lexical_path + suffix, lexical_path)
+    elif os.path.exists(lexical_path):
+        os.remove(lexical_path)
+
+    os.replace(os.path.join(folder_path, index_file) + suffix, os.path.join(folder_path, index_file))
+    os.replace(docstore_path + suffix, docstore_path)
+    # A previous save of a different index type must not shadow this one
+    if os.path.exists(os.path.join(folder_path, stale_file)):
+        os.remove(os.path.join(folder_path, stale_file))
+
+def load_vector_store(folder_path, embeddings=None, mmap=VECTOR_STORE_MMAP):
+    """Load a vector store written by ``save_vector_store``; returns None if absent
+
+    With ``mmap`` a flat index is opened memory-mapped and read-only, so
+    loading is near-instant and workers share its pages; copy the store
+    before modifying it.
+    """
+    index_path = os.path.join(folder_path, INDEX_FILE)
+    vectors_path = os.path.join(folder_path, VECTORS_FILE)
+    docstore_path = os.path.join(folder_path, DOCSTORE_FILE)
+    if not os.path.exists(docstore_path):
+        return None
+
+    if os.path.exists(vectors_path):
+        vectors = np.load(vectors_path, mmap_mode="r" if mmap else None)
+        if mmap:
+            index = MmapFlatIndex(vectors)
+        else:
+            index = faiss.IndexFlatL2(vectors.shape[1])
+            index.add(vectors)
+    elif os.path.exists(index_path):
+        index = tune_index(faiss.read_index(index_path))
+    else:
+        return None
+
+    # Only files this server wrote itself are ever unpickled here
+    with open(docstore_path, "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    vector_store = FAISS(embeddings or get_embeddings(), index, docstore, index_to_docstore_id)
+    lexical_path = os.path.join(folder_path, LEXICAL_FILE)
+    if os.path.exists(lexical_path):
+        with open(lexical_path, "rb") as f:
+            vector_store.lexical_index = pickle.load(f)
+    return vector_store
+
+def estimate_vector_store_bytes(vector_store):
+    """Approximate resident size: raw vectors plus stored chunk text
+
+    Memory-mapped vectors live in the shared page cache rather than the
+    process, so they are not counted.
+    """
+    index = vector_store.index
+    vector_bytes = 0 if isinstance(index, MmapFlatIndex) else index.ntotal * index.d * 4
+    text_bytes = sum(
+        len(doc.page_content) + len(str(doc.metadata))
+        for doc in getattr(vector_store.docstore, "_dict", {}).values()
+    )
+    return vector_bytes + text_bytes
+
+def fingerprint_vector_store(vector_store):
+    """Content hash of the indexed chunks and their metadata, in index order"""
+    digest = hashlib.sha256()
+    docs = vector_store.docstore._dict
+    for position in sorted(vector_store.index_to_docstore_id):
+        doc = docs[vector_store.index_to_docstore_id[position]]
+        digest.update(doc.page_content.encode("utf-8"))
+        digest.update(json.dumps(doc.metadata, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
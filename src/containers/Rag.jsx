@@ -4,6 +4,8 @@ import * as pdfjsLib from 'pdfjs-dist';
 // Set the worker source to a local file in the public folder
 pdfjsLib.GlobalWorkerOptions.workerSrc = '/pdf.worker.min.js';
 
+const JOB_POLL_INTERVAL_MS = 1000;
+
 export const Rag = () => {
   const [csvFile, setCsvFile] = useState(null);
   const [pdfFile, setPdfFile] = useState(null);
@@ -11,6 +13,8 @@ export const Rag = () => {
   const [response, setResponse] = useState('');
   const [message, setMessage] = useState('');
   const [isLoading, setIsLoading] = useState(false);
+  // True while an uploaded batch is still being ingested; queries would hit the previous index
+  const [isProcessing, setIsProcessing] = useState(false);
 
   const handleCsvChange = (event) => {
     const selectedFile = event.target.files[0];
@@ -34,6 +38,23 @@ export const Rag = () => {
     }
   };
 
+  // Poll the ingestion job started by /upload until it completes or fails
+  const waitForJob = async (statusUrl) => {
+    while (true) {
+      await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+      const response = await fetch('/api' + statusUrl);
+      const job = await response.json();
+      if (!response.ok) {
+        throw new Error(job.error || 'Could not read processing status');
+      }
+      if (job.status === 'completed') return job;
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Processing failed');
+      }
+      setMessage(`Processing files (${job.stage || job.status})...`);
+    }
+  };
+
   const handleFileUpload = async (event) => {
     event.preventDefault();
     setIsLoading(true);
@@ -49,20 +70,31 @@ export const Rag = () => {
         body: formData,
       });
 
-      if (response.ok) {
-        setMessage('Files uploaded successfully!');
-    } else {
-        setMessage('Error uploading files. Please try again.');
+      const data = await response.json().catch(() => ({}));
+      if (response.status === 202 && data.status_url) {
+        setIsProcessing(true);
+        setMessage('Files uploaded, processing started...');
+        await waitForJob(data.status_url);
+        setMessage('Files uploaded and processed successfully!');
+      } else if (response.ok) {
+        setMessage(data.message || 'Files uploaded successfully!');
+      } else {
+        setMessage('Error uploading files: ' + (data.error || 'Please try again.'));
       }
     } catch (error) {
       setMessage('Error uploading files: ' + error.message);
     } finally {
+      setIsProcessing(false);
       setIsLoading(false);
     }
   };
 
   const handleQuerySubmit = async (event) => {
     event.preventDefault();
+    if (isProcessing) {
+      setMessage('Please wait until the uploaded files are processed.');
+      return;
+    }
     if (!query.trim()) {
       setMessage('Please enter a query.');
       return;
@@ -70,9 +102,10 @@ export const Rag = () => {
 
     setIsLoading(true);
     setMessage('');
+    setResponse('');
 
     try {
-      const response = await fetch('/api/query', {
+      const response = await fetch('/api/query/stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -80,14 +113,52 @@ export const Rag = () => {
         body: JSON.stringify({ query }),
       });
 
-      if (response.ok) {
-        const data = await response.json();
-        setResponse(data.response || 'No response received.');
-        setMessage('Query processed successfully!');
-      } else {
+      if (!response.ok || !response.body) {
         setMessage('Error processing query. Please try again.');
+        return;
+      }
+
+      // Read Server-Sent Events: "sources" first, then "token" chunks, then "done"
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let answer = '';
+      let streamError = null;
+      let cached = false;
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const rawEvent of events) {
+          const eventLine = rawEvent.split('\n').find((line) => line.startsWith('event:'));
+          const dataLine = rawEvent.split('\n').find((line) => line.startsWith('data:'));
+          if (!eventLine || !dataLine) continue;
+
+          const eventType = eventLine.slice('event:'.length).trim();
+          const data = JSON.parse(dataLine.slice('data:'.length));
+          if (eventType === 'token') {
+            answer += data.text;
+            setResponse(answer);
+          } else if (eventType === 'error') {
+            streamError = data.error;
+          } else if (eventType === 'done') {
+            // A repeated question is replayed from the answer cache in one token event
+            cached = Boolean(data.cached);
+          }
+        }
       }
-      } catch (error) {
+
+      if (streamError) {
+        setMessage('Error processing query: ' + streamError);
+      } else {
+        if (!answer) setResponse('No response received.');
+        setMessage(cached ? 'Query answered from cache!' : 'Query processed successfully!');
+      }
+    } catch (error) {
       setMessage('Error processing query: ' + error.message);
     } finally {
       setIsLoading(false);
@@ -291,15 +362,15 @@ export const Rag = () => {
             />
             <input 
               type="submit" 
-              value="Submit Query" 
-              disabled={isLoading}
+              value={isProcessing ? 'Processing files...' : 'Submit Query'}
+              disabled={isLoading || isProcessing}
               style={{ 
                 borderRadius: '2rem', 
                 border: '2px solid var(--b-c)', 
                 padding: '1em 2em', 
-                cursor: isLoading ? 'not-allowed' : 'pointer', 
+                cursor: (isLoading || isProcessing) ? 'not-allowed' : 'pointer', 
                 transition: 'all ease 0.25s',
-                background: isLoading ? '#ccc' : 'var(--w-c)',
+                background: (isLoading || isProcessing) ? '#ccc' : 'var(--w-c)',
                 color: 'var(--b-c)',
                 fontWeight: '600',
                 fontSize: '1rem'
@@ -1,17 +1,23 @@
 import os
-from flask import Flask, request, jsonify
+import sys
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from langchain_community.document_loaders import CSVLoader, PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
 from langchain.chains import RetrievalQA
-from langchain_together import Together
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Shared RAG helpers live alongside the production app in saasa/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "saasa"))
+from model_registry import get_embeddings
+from indexing import build_vector_store
+from vector_persistence import save_vector_store, load_vector_store
+from llm_streaming import stream_answer
+from llm_client import TogetherLLM
+
 app = Flask(__name__)
 app.secret_key = "supersecretkey"
 UPLOAD_FOLDER = f"/home/{os.environ.get('USERNAME', 'precisegoalsin')}/uploads"
@@ -20,10 +26,11 @@ app.config["MAX_CONTENT_LENGTH"] = 1 * 1024 * 1024  # 1 MB limit
 ALLOWED_EXTENSIONS = {"csv", "pdf"}
 
 # Preload embeddings at startup to save CPU time
-embeddings = HuggingFaceEmbeddings(
-    model_name="sentence-transformers/all-MiniLM-L6-v2")
+embeddings = get_embeddings()
 vector_store = None  # Global vector store
 rag_chain = None     # Global RAG chain
+# The last uploaded index is kept here and reopened memory-mapped on restart
+VECTOR_STORE_DIR = os.environ.get("VECTOR_STORE_DIR", os.path.join(UPLOAD_FOLDER, "vector_store"))
 
 # CORS setup
 CORS(app, resources={
@@ -72,7 +79,7 @@ def split_documents(docs):
 def setup_vector_store(docs):
     try:
         print("Setting up vector store...")
-        return FAISS.from_documents(docs, embeddings)
+        return build_vector_store(docs, embeddings)
     except Exception as e:
         print(f"Error in setup_vector_store: {str(e)}")
         raise
@@ -84,14 +91,27 @@ def setup_rag_chain(vector_store):
         api_key = os.getenv("TOGETHER_API_KEY")
         if not api_key:
             raise ValueError("TOGETHER_API_KEY not found")
-        llm = Together(model="meta-llama/Llama-3-70b-chat-hf",
-                       together_api_key=api_key, temperature=0.7)
+        llm = TogetherLLM(together_api_key=api_key, temperature=0.7)
         return RetrievalQA.from_chain_type(llm=llm, chain_type="stuff", retriever=vector_store.as_retriever(search_kwargs={"k": 2}))
     except Exception as e:
         print(f"Error in setup_rag_chain: {str(e)}")
         raise
 
 
+def restore_vector_store():
+    global vector_store, rag_chain
+    try:
+        vector_store = load_vector_store(VECTOR_STORE_DIR, embeddings)
+        if vector_store is not None:
+            print(f"Restored vector store from {VECTOR_STORE_DIR}")
+            rag_chain = setup_rag_chain(vector_store)
+    except Exception as e:
+        print(f"Could not restore vector store: {str(e)}")
+
+
+restore_vector_store()
+
+
 @app.route("/upload", methods=["POST", "OPTIONS"])
 def upload_files():
     global vector_store, rag_chain
@@ -143,6 +163,7 @@ def upload_files():
         split_docs = split_documents(docs)
         vector_store = setup_vector_store(split_docs)
         rag_chain = setup_rag_chain(vector_store)
+        save_vector_store(vector_store, VECTOR_STORE_DIR)
 
         response = jsonify(
             {"message": "Files uploaded and processed successfully"})
@@ -206,6 +227,45 @@ def query_documents():
         return response, 500
 
 
+@app.route("/query/stream", methods=["POST", "OPTIONS"])
+def query_documents_stream():
+    print(f"Received {request.method} request to /query/stream")
+
+    if request.method == "OPTIONS":
+        response = jsonify({"status": "success"})
+        response.headers.add("Access-Control-Allow-Origin",
+                             "https://evolvexai.vercel.app")
+        response.headers.add(
+            "Access-Control-Allow-Methods", "POST, OPTIONS")
+        response.headers.add("Access-Control-Allow-Headers", "Content-Type")
+        return response, 200
+
+    if not rag_chain:
+        response = jsonify(
+            {"error": "No documents have been uploaded and processed yet"})
+        response.headers.add("Access-Control-Allow-Origin",
+                             "https://evolvexai.vercel.app")
+        return response, 400
+
+    data = request.get_json(silent=True)
+    if not data or 'query' not in data:
+        response = jsonify({"error": "Query parameter is required"})
+        response.headers.add("Access-Control-Allow-Origin",
+                             "https://evolvexai.vercel.app")
+        return response, 400
+
+    query = data['query']
+    print(f"Streaming query: {query}")
+
+    response = Response(
+        stream_with_context(stream_answer(rag_chain.retriever, query)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.headers.add("Access-Control-Allow-Origin",
+                         "https://evolvexai.vercel.app")
+    return response, 200
+
+
 @app.route("/", methods=["GET"])
 def index():
     response = jsonify({"status": "API is running"})